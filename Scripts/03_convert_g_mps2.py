@@ -1,36 +1,48 @@
 import os
 import pandas as pd
 from pathlib import Path
+from columnar_store import iter_inputs, is_store, load_main, save_main
+from manifest import incremental_stage
+from parallel_executor import run_parallel
+
+# === CONFIGURATION ===
+STAGE_VERSION = 1
 
 # Gravitational constant
 G_TO_MPS2 = 9.80665
 
-def convert_g_to_mps2_in_folder(root_folder, overwrite=True):
-    for dirpath, _, filenames in os.walk(root_folder):
-        for file in filenames:
-            if file.endswith(".xlsx") and not file.startswith("~$"):
-                file_path = os.path.join(dirpath, file)
-                try:
-                    df = pd.read_excel(file_path)
-
-                    # Proceed only if x, y, z columns exist
-                    if all(axis in df.columns for axis in ['x', 'y', 'z']):
-                        df['x_mps2'] = df['x'] * G_TO_MPS2
-                        df['y_mps2'] = df['y'] * G_TO_MPS2
-                        df['z_mps2'] = df['z'] * G_TO_MPS2
-
-                        if overwrite:
-                            df.to_excel(file_path, index=False)
-                            print(f"[✔] Updated (overwritten): {file_path}")
-                        else:
-                            new_path = Path(file_path).with_stem(Path(file_path).stem + "_mps2")
-                            df.to_excel(new_path, index=False)
-                            print(f"[✔] Created new file: {new_path}")
-                    else:
-                        print(f"[!] Skipped (missing x/y/z): {file_path}")
-
-                except Exception as e:
-                    print(f"[✘] Error processing {file_path}: {e}")
-
-
-convert_g_to_mps2_in_folder(r"D:\extracted data from JSON file ISI\rerport writing data", overwrite=False)
+def process_dataframe(df, reports):
+    if all(axis in df.columns for axis in ['x', 'y', 'z']):
+        df['x_mps2'] = df['x'] * G_TO_MPS2
+        df['y_mps2'] = df['y'] * G_TO_MPS2
+        df['z_mps2'] = df['z'] * G_TO_MPS2
+    return df
+
+@incremental_stage("03_convert_g_mps2")
+def convert_g_to_mps2_in_file(file_path, overwrite=True):
+    df = load_main(file_path, columns=['x', 'y', 'z'], upto="03_convert_g_mps2")
+
+    # Proceed only if x, y, z columns exist
+    if all(axis in df.columns for axis in ['x', 'y', 'z']):
+        df = process_dataframe(df, {})
+
+        if is_store(file_path):
+            # Stores only gain the new columns, so there is nothing to overwrite
+            save_main(file_path, df, "03_convert_g_mps2", columns=['x_mps2', 'y_mps2', 'z_mps2'])
+            print(f"[✔] Updated: {file_path}")
+        elif overwrite:
+            df.to_excel(file_path, index=False)
+            print(f"[✔] Updated (overwritten): {file_path}")
+        else:
+            new_path = Path(file_path).with_stem(Path(file_path).stem + "_mps2")
+            df.to_excel(new_path, index=False)
+            print(f"[✔] Created new file: {new_path}")
+    else:
+        print(f"[!] Skipped (missing x/y/z): {file_path}")
+
+def convert_g_to_mps2_in_folder(root_folder, overwrite=True, workers=None):
+    return run_parallel(convert_g_to_mps2_in_file, iter_inputs(root_folder), workers=workers, args=(overwrite,))
+
+
+if __name__ == "__main__":
+    convert_g_to_mps2_in_folder(r"D:\extracted data from JSON file ISI\rerport writing data", overwrite=False)
@@ -1,40 +1,50 @@
 import os
 import pandas as pd
-
-def flag_missing_values(filepath):
-    try:
-        df = pd.read_excel(filepath)
-        
-        # Identify axis columns (x/y/z in either format)
-        axes = ['x_mps2', 'y_mps2', 'z_mps2']
-        if not all(axis in df.columns for axis in axes):
-            print(f"⚠️ Skipping {filepath}: Missing expected axis columns.")
-            return
-
-        # Add missing value flag
-        df['is_missing'] = ((df['x_mps2'] == 0.0) | 
-                            (df['y_mps2'] == 0.0) | 
+from columnar_store import iter_inputs, is_store, load_main, save_main
+from manifest import incremental_stage
+from parallel_executor import run_parallel
+
+# === CONFIGURATION ===
+STAGE_VERSION = 1
+
+def process_dataframe(df, reports):
+    # Add missing value flag
+    if all(axis in df.columns for axis in ['x_mps2', 'y_mps2', 'z_mps2']):
+        df['is_missing'] = ((df['x_mps2'] == 0.0) |
+                            (df['y_mps2'] == 0.0) |
                             (df['z_mps2'] == 0.0)).astype(int)
+    return df
 
-        # Preserve full datetime if available
-        if 'datetime' in df.columns:
-            df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
-            df['datetime'] = df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
-
-        # Save new file
-        new_path = filepath.replace('.xlsx', '_flagged_missing.xlsx')
-        df.to_excel(new_path, index=False)
-        print(f"✅ Saved flagged file: {new_path}")
-
-    except Exception as e:
-        print(f"❌ Error processing {filepath}: {e}")
-
-def recursively_flag_folder(folder_path):
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            if file.endswith(".xlsx") and not file.endswith('_flagged_missing.xlsx'):
-                full_path = os.path.join(root, file)
-                flag_missing_values(full_path)
+@incremental_stage("04_detect_missing_values")
+def flag_missing_values(filepath):
+    df = load_main(filepath, columns=['x_mps2', 'y_mps2', 'z_mps2'], upto="04_detect_missing_values")
+    
+    # Identify axis columns (x/y/z in either format)
+    axes = ['x_mps2', 'y_mps2', 'z_mps2']
+    if not all(axis in df.columns for axis in axes):
+        print(f"⚠️ Skipping {filepath}: Missing expected axis columns.")
+        return
+
+    df = process_dataframe(df, {})
+
+    # Stores keep the typed datetime column, so only the new flag is appended
+    if is_store(filepath):
+        save_main(filepath, df, "04_detect_missing_values", columns=['is_missing'])
+        print(f"✅ Saved flagged column: {filepath}")
+        return
+
+    # Preserve full datetime if available
+    if 'datetime' in df.columns:
+        df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
+        df['datetime'] = df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
+
+    # Save new file
+    new_path = filepath.replace('.xlsx', '_flagged_missing.xlsx')
+    df.to_excel(new_path, index=False)
+    print(f"✅ Saved flagged file: {new_path}")
+
+def recursively_flag_folder(folder_path, workers=None):
+    return run_parallel(flag_missing_values, iter_inputs(folder_path, exclude_suffixes=('_flagged_missing.xlsx',)), workers=workers)
 
 # === USAGE ===
 # Replace with your folder path
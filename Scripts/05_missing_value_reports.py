@@ -1,93 +1,123 @@
 import os
 import pandas as pd
 import numpy as np
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from columnar_store import iter_inputs, load_main, save_sheets
+from manifest import incremental_stage
+from parallel_executor import run_parallel
 
 # === CONFIGURATION ===
+STAGE_VERSION = 2
+REPORT_COLUMNS = ['datetime', 'is_missing', 'x_mps2', 'y_mps2', 'z_mps2', 'x_imputed', 'y_imputed', 'z_imputed']
 ROLLING_WINDOW = 6
+CONTEXT_RADIUS = ROLLING_WINDOW // 2  # rows shown before and after each missing point
+SUMMARY_BIN = '1s'      # bin width of the Missingness_Pattern sheet
+UNRELIABLE_BIN = '10s'  # bin width of the Unreliable_Windows sheet
 UNRELIABLE_THRESHOLD = 3  # Threshold for number of missing points per window
 
 
-def create_imputation_plot_data(df):
-    imputed_points = df[df['is_missing'] == 1].copy()
-    if imputed_points.empty:
-        return pd.DataFrame()
-
-    combined_rows = []
-    for idx in imputed_points.index:
-        start = max(0, idx - 3)
-        end = min(len(df), idx + 4)
-        local = df.iloc[start:end].copy()
-        local['x_used'] = np.where(local['x_mps2'] == 0, local['x_imputed'], local['x_mps2'])
-        local['y_used'] = np.where(local['y_mps2'] == 0, local['y_imputed'], local['y_mps2'])
-        local['z_used'] = np.where(local['z_mps2'] == 0, local['z_imputed'], local['z_mps2'])
-        combined_rows.append(local[['datetime', 'x_mps2', 'x_used', 'y_mps2', 'y_used', 'z_mps2', 'z_used']])
+def context_mask(is_missing, radius=CONTEXT_RADIUS):
+    """True for every row within ``radius`` rows of a missing point (a 1-D mask dilation)."""
+    hits = np.concatenate([[0], np.cumsum(np.asarray(is_missing) == 1)])
+    n = len(hits) - 1
+    positions = np.arange(n)
+    lo = np.maximum(positions - radius, 0)
+    hi = np.minimum(positions + radius + 1, n)
+    return hits[hi] - hits[lo] > 0
 
-    result = pd.concat(combined_rows).drop_duplicates().reset_index(drop=True)
-    return result
 
+def create_imputation_plot_data(df):
+    mask = context_mask(df['is_missing'].to_numpy())
+    if not mask.any():
+        return pd.DataFrame()
 
-def create_missingness_summary(df):
-    df['second'] = df['datetime'].dt.floor('1s')
-    summary = df.groupby('second')['is_missing'].sum().reset_index()
+    local = df[mask]
+    result = pd.DataFrame({'datetime': local['datetime']})
+    for axis in ['x', 'y', 'z']:
+        raw = local[f'{axis}_mps2']
+        result[f'{axis}_mps2'] = raw
+        result[f'{axis}_used'] = np.where(raw == 0, local[f'{axis}_imputed'], raw)
+    return result.drop_duplicates().reset_index(drop=True)
+
+
+def resample_missing(df, bin_widths=(SUMMARY_BIN, UNRELIABLE_BIN)):
+    """Missing-point counts per time bin for several bin widths: {width: Series}.
+
+    ``datetime`` is floored once, to the finest width; coarser widths that are
+    multiples of it are summed from those counts instead of from the raw rows.
+    """
+    widths = sorted(set(bin_widths), key=pd.Timedelta)
+    base = widths[0]
+    counts = {base: df.groupby(df['datetime'].dt.floor(base))['is_missing'].sum()}
+    for width in widths[1:]:
+        if pd.Timedelta(width) % pd.Timedelta(base) == pd.Timedelta(0):
+            fine = counts[base]
+            counts[width] = fine.groupby(fine.index.floor(width)).sum()
+        else:
+            counts[width] = df.groupby(df['datetime'].dt.floor(width))['is_missing'].sum()
+    return counts
+
+
+def create_missingness_summary(df, counts=None, bin_width=SUMMARY_BIN):
+    counts = resample_missing(df, [bin_width]) if counts is None else counts
+    summary = counts[bin_width].reset_index()
     summary.columns = ['Timestamp_Second', 'Missing_Count']
     return summary
 
 
-def create_unreliable_windows(df):
-    df['window'] = df['datetime'].dt.floor('10s')
-    windows = df.groupby('window')['is_missing'].sum().reset_index()
-    windows = windows[windows['is_missing'] > UNRELIABLE_THRESHOLD].copy()
-    windows['End_Time'] = windows['window'] + pd.Timedelta(seconds=10)
-    return windows[['window', 'End_Time', 'is_missing']].rename(columns={'window': 'Start_Time', 'is_missing': 'Missing_Count'})
+def create_unreliable_windows(df, counts=None, bin_width=UNRELIABLE_BIN):
+    counts = resample_missing(df, [bin_width]) if counts is None else counts
+    windows = counts[bin_width]
+    windows = windows[windows > UNRELIABLE_THRESHOLD]
+    return pd.DataFrame({
+        'Start_Time': windows.index,
+        'End_Time': windows.index + pd.Timedelta(bin_width),
+        'Missing_Count': windows.to_numpy(),
+    })
 
 
-def write_analysis_to_excel(filepath):
-    try:
-        df = pd.read_excel(filepath)
-        df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
-        df.dropna(subset=['datetime'], inplace=True)
-
-        wb = load_workbook(filepath)
-
-        # === Imputation Plot View Sheet ===
+def build_missing_value_reports(df):
+    # Without imputed values (or missing points) the plot view is None: an earlier one is removed
+    sheets = {"Imputation_Plot_View": None}
+    if all(f'{axis}_imputed' in df.columns for axis in ['x', 'y', 'z']):
         plot_df = create_imputation_plot_data(df)
         if not plot_df.empty:
-            ws1 = wb.create_sheet("Imputation_Plot_View")
-            for r in dataframe_to_rows(plot_df, index=False, header=True):
-                ws1.append(r)
+            sheets["Imputation_Plot_View"] = plot_df
+    counts = resample_missing(df, (SUMMARY_BIN, UNRELIABLE_BIN))
+    sheets["Missingness_Pattern"] = create_missingness_summary(df, counts)
+    sheets["Unreliable_Windows"] = create_unreliable_windows(df, counts)
+    return sheets
 
-        # === Missingness Summary ===
-        summary_df = create_missingness_summary(df)
-        ws2 = wb.create_sheet("Missingness_Pattern")
-        for r in dataframe_to_rows(summary_df, index=False, header=True):
-            ws2.append(r)
 
-        # === Unreliable Windows ===
-        unreliable_df = create_unreliable_windows(df)
-        ws3 = wb.create_sheet("Unreliable_Windows")
-        for r in dataframe_to_rows(unreliable_df, index=False, header=True):
-            ws3.append(r)
+def process_dataframe(df, reports):
+    # Reports only: work on a copy so the helper columns stay out of the main table
+    if 'datetime' not in df.columns or 'is_missing' not in df.columns:
+        return df
+    report_df = df[[c for c in REPORT_COLUMNS if c in df.columns]].copy()
+    report_df['datetime'] = pd.to_datetime(report_df['datetime'], errors='coerce')
+    report_df.dropna(subset=['datetime'], inplace=True)
+    reports.update(build_missing_value_reports(report_df))
+    return df
 
-        wb.save(filepath)
-        print(f"✅ Updated: {filepath}")
 
-    except Exception as e:
-        print(f"❌ Error processing {filepath}: {e}")
+@incremental_stage("05_missing_value_reports")
+def write_analysis_to_excel(filepath):
+    df = load_main(filepath, columns=REPORT_COLUMNS, upto="05_missing_value_reports")
+    df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
+    df.dropna(subset=['datetime'], inplace=True)
+
+    # Imputation plot view, missingness summary and unreliable windows, in the store or the workbook
+    save_sheets(filepath, build_missing_value_reports(df))
+    print(f"✅ Updated: {filepath}")
 
 
-def recursive_add_analysis(folder_path):
-    for dirpath, _, filenames in os.walk(folder_path):
-        for file in filenames:
-            if file.endswith("_flagged_missing.xlsx"):
-                full_path = os.path.join(dirpath, file)
-                write_analysis_to_excel(full_path)
+def recursive_add_analysis(folder_path, workers=None):
+    return run_parallel(write_analysis_to_excel, iter_inputs(folder_path, suffix="_flagged_missing.xlsx"), workers=workers)
 
 
 # === USAGE ===
-root_folder = r"D:\extracted data from JSON file ISI\extracted data\sensor_data_CLEANED\sensor_data_cleaned_original"
-recursive_add_analysis(root_folder)
+if __name__ == "__main__":
+    root_folder = r"D:\extracted data from JSON file ISI\extracted data\sensor_data_CLEANED\sensor_data_cleaned_original"
+    recursive_add_analysis(root_folder)
 
 
 
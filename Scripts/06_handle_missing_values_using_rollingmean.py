@@ -2,71 +2,50 @@
 import os
 import pandas as pd
 import numpy as np
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from columnar_store import iter_inputs, load_main, save_main
+from manifest import incremental_stage
+from parallel_executor import run_parallel
+from rolling_imputation import impute_where
 
 # === CONFIGURATION ===
+STAGE_VERSION = 2
 ROLLING_WINDOW = 6  # 3 before + 3 after
+KERNEL = "boxcar"  # or "triangular" / "gaussian" to weight the window
 AXES = ['x', 'y', 'z']
 MPS2_AXES = ['x_mps2', 'y_mps2', 'z_mps2']
 
 def impute_missing_with_rolling_mean(df):
+    # Mean of the non-zero m/s² samples in the centred window, only where a raw sample dropped out
     for axis_raw, axis_mps2 in zip(AXES, MPS2_AXES):
-        imputed_col = f'{axis_raw}_imputed'
-        imputed_vals = []
-
-        for i in range(len(df)):
-            if df.at[i, 'is_missing'] == 1 and df.at[i, axis_raw] == 0:
-                # Rolling window (3 before, 3 after)
-                start = max(0, i - 3)
-                end = min(len(df), i + 4)
-                window = df.loc[start:end-1, axis_mps2]
-                valid_vals = window[window != 0]
-
-                if len(valid_vals) >= 1:
-                    imputed_vals.append(valid_vals.mean())
-                else:
-                    imputed_vals.append('N.A.')
-            else:
-                imputed_vals.append('N.A.')
-
-        df[imputed_col] = imputed_vals
+        target = (df['is_missing'].to_numpy() == 1) & (df[axis_raw].to_numpy() == 0)
+        df[f'{axis_raw}_imputed'] = impute_where(df[axis_mps2].to_numpy(), target,
+                                                 half_width=ROLLING_WINDOW // 2, kernel=KERNEL)
     return df
 
-def update_excel_safely(filepath):
-    try:
-        wb = load_workbook(filepath)
-        sheetnames = wb.sheetnames
-        main_sheet = wb[sheetnames[0]]  # Assuming first sheet is main data sheet
-
-        # Load data from the main sheet into pandas
-        df = pd.read_excel(filepath, sheet_name=sheetnames[0])
-
-        if not all(col in df.columns for col in MPS2_AXES + AXES + ['is_missing']):
-            print(f"[!] Skipping {filepath} due to missing required columns.")
-            return
-
+def process_dataframe(df, reports):
+    if all(col in df.columns for col in MPS2_AXES + AXES + ['is_missing']):
         df = impute_missing_with_rolling_mean(df)
+    return df
 
-        # Remove the existing sheet and re-add updated one
-        wb.remove(main_sheet)
-        ws = wb.create_sheet(sheetnames[0], 0)
+@incremental_stage("06_handle_missing_values_using_rollingmean")
+def update_excel_safely(filepath):
+    # Load data from the main sheet (or only the needed columns of a capture store)
+    required_cols = MPS2_AXES + AXES + ['is_missing']
+    df = load_main(filepath, columns=required_cols, upto="06_handle_missing_values_using_rollingmean")
 
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws.append(r)
+    if not all(col in df.columns for col in required_cols):
+        print(f"[!] Skipping {filepath} due to missing required columns.")
+        return
 
-        wb.save(filepath)
-        print(f"[✓] Imputed columns added safely to: {filepath}")
+    df = impute_missing_with_rolling_mean(df)
 
-    except Exception as e:
-        print(f"[✗] Error processing {filepath}: {e}")
+    # Replace the main sheet, or append the imputed columns to the store
+    save_main(filepath, df, "06_handle_missing_values_using_rollingmean",
+              columns=[f'{axis}_imputed' for axis in AXES])
+    print(f"[✓] Imputed columns added safely to: {filepath}")
 
-def process_folder(root_folder):
-    for dirpath, _, filenames in os.walk(root_folder):
-        for file in filenames:
-            if file.endswith(".xlsx") and not file.startswith("~$"):
-                full_path = os.path.join(dirpath, file)
-                update_excel_safely(full_path)
+def process_folder(root_folder, workers=None):
+    return run_parallel(update_excel_safely, iter_inputs(root_folder), workers=workers)
 
 # === USAGE ===
 if __name__ == '__main__':
@@ -1,47 +1,50 @@
 import os
 import pandas as pd
 import numpy as np
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from columnar_store import NA_MARKERS, iter_inputs, is_store, load_main, save_main
+from manifest import incremental_stage
+from parallel_executor import run_parallel
 
+# === CONFIGURATION ===
+STAGE_VERSION = 1
+
+def apply_imputed_values(df):
+    updated = False
+    for axis in ['x', 'y', 'z']:
+        raw_col = f"{axis}_mps2"
+        imputed_col = f"{axis}_imputed"
+        if raw_col in df.columns and imputed_col in df.columns:
+            # Only update where imputed value is not NaN
+            imputed = pd.to_numeric(df[imputed_col].replace(NA_MARKERS, np.nan))
+            non_null_mask = imputed.notna()
+            before = df[raw_col].copy()
+            df.loc[non_null_mask, raw_col] = imputed[non_null_mask]
+            if not before.equals(df[raw_col]):
+                updated = True
+    return df, updated
+
+def process_dataframe(df, reports):
+    df, _ = apply_imputed_values(df)
+    return df
+
+@incremental_stage("07_impute_missing_values")
 def integrate_imputed_values(filepath):
     print(f"📄 Checking: {os.path.basename(filepath)}")
-    try:
-        df = pd.read_excel(filepath, sheet_name=0, na_values=["N.A.", "NA", "n.a.", "na"])
-
-        updated = False
-        for axis in ['x', 'y', 'z']:
-            raw_col = f"{axis}_mps2"
-            imputed_col = f"{axis}_imputed"
-            if raw_col in df.columns and imputed_col in df.columns:
-                # Only update where imputed value is not NaN
-                non_null_mask = df[imputed_col].notna()
-                before = df[raw_col].copy()
-                df.loc[non_null_mask, raw_col] = df.loc[non_null_mask, imputed_col]
-                if not before.equals(df[raw_col]):
-                    updated = True
-
-        if updated:
-            wb = load_workbook(filepath)
-            main_sheet = wb.sheetnames[0]
-            wb.remove(wb[main_sheet])
-            ws = wb.create_sheet(main_sheet, 0)
-            for r in dataframe_to_rows(df, index=False, header=True):
-                ws.append(r)
-            wb.save(filepath)
-            print(f"✅ Imputed values integrated in {os.path.basename(filepath)}")
-        else:
-            print(f"⏩ Skipped (no imputed values to apply)")
-
-    except Exception as e:
-        print(f"[✗] Error in {filepath}: {e}")
-
-def recursive_imputation_integration(folder_path):
-    for dirpath, _, filenames in os.walk(folder_path):
-        for file in filenames:
-            if file.endswith(".xlsx") and not file.startswith("~$"):
-                full_path = os.path.join(dirpath, file)
-                integrate_imputed_values(full_path)
+    if is_store(filepath):
+        df = load_main(filepath, columns=['x_mps2', 'y_mps2', 'z_mps2', 'x_imputed', 'y_imputed', 'z_imputed'], upto="07_impute_missing_values")
+    else:
+        df = pd.read_excel(filepath, sheet_name=0, na_values=NA_MARKERS)
+
+    df, updated = apply_imputed_values(df)
+
+    if updated:
+        save_main(filepath, df, "07_impute_missing_values", columns=['x_mps2', 'y_mps2', 'z_mps2'])
+        print(f"✅ Imputed values integrated in {os.path.basename(filepath)}")
+    else:
+        print(f"⏩ Skipped (no imputed values to apply)")
+
+def recursive_imputation_integration(folder_path, workers=None):
+    return run_parallel(integrate_imputed_values, iter_inputs(folder_path), workers=workers)
 
 # === USAGE ===
 if __name__ == "__main__":
@@ -1,12 +1,25 @@
 import os
 import pandas as pd
 import numpy as np
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-
-def detect_boxplot_outliers(df, axis):
-    Q1 = df[axis].quantile(0.25)
-    Q3 = df[axis].quantile(0.75)
+from columnar_store import iter_inputs, load_main, save_main, save_sheets
+from manifest import incremental_stage
+from parallel_executor import run_parallel
+from quantile_sketch import baseline_quantiles
+
+# === CONFIGURATION ===
+STAGE_VERSION = 1
+BOX_PLOT_COLUMNS = ['x_outlier_box_plot', 'y_outlier_box_plot', 'z_outlier_box_plot', 'is_outlier_boxplot']
+# Quartiles from a fleet baseline built by quantile_sketch.py instead of each capture alone (None = per capture)
+BASELINE_FILE = None
+BASELINE_LEVEL = "sensor"   # sensor, machine or fleet
+
+def detect_boxplot_outliers(df, axis, capture=None):
+    quartiles = baseline_quantiles(BASELINE_FILE, capture, axis, [0.25, 0.75], BASELINE_LEVEL)
+    if quartiles is not None:
+        Q1, Q3 = quartiles
+    else:
+        Q1 = df[axis].quantile(0.25)
+        Q3 = df[axis].quantile(0.75)
     IQR = Q3 - Q1
     lower_bound = Q1 - 1.5 * IQR
     upper_bound = Q3 + 1.5 * IQR
@@ -32,75 +45,70 @@ def add_axiswise_and_combined_flags(df, flag_df):
     return df
 
 def update_main_sheet_with_flags(filepath, df):
-    wb = load_workbook(filepath)
-    sheetnames = wb.sheetnames
-    main_sheet = sheetnames[0]
+    # Rewrites the main sheet, or appends only the flag columns to a capture store
+    save_main(filepath, df, "09_outlier_detection_box_plot", columns=BOX_PLOT_COLUMNS)
+    print(f"🟢 Updated main sheet with axis-wise + combined outlier flags in: {os.path.basename(filepath)}")
 
-    # Remove old main sheet
-    wb.remove(wb[main_sheet])
-    ws = wb.create_sheet(main_sheet, 0)
+def build_boxplot_flags(df, capture=None):
+    axis_cols = ['x_mps2', 'y_mps2', 'z_mps2']
+    outlier_report = []
+    flag_df = pd.DataFrame({'datetime': df['datetime']})
+
+    for axis in axis_cols:
+        if axis in df.columns:
+            flags, lower, upper = detect_boxplot_outliers(df, axis, capture)
+            flag_col = f'{axis}_box_flag'
+            flag_df[flag_col] = flags
+
+            outliers = df[flags == 1][['datetime', axis]].copy()
+            outliers['Axis'] = axis
+            outliers['Serial_No'] = outliers.index + 2
+            outliers.rename(columns={axis: 'Outlier_Value'}, inplace=True)
+            outlier_report.append(outliers)
+
+    # Combine the per-axis report
+    if outlier_report:
+        report_df = pd.concat(outlier_report, ignore_index=True)
+        report_df = report_df[['Serial_No', 'datetime', 'Axis', 'Outlier_Value']]
+    else:
+        report_df = pd.DataFrame(columns=['Serial_No', 'datetime', 'Axis', 'Outlier_Value'])
 
-    for r in dataframe_to_rows(df, index=False, header=True):
-        ws.append(r)
+    return flag_df, report_df
 
-    wb.save(filepath)
-    print(f"🟢 Updated main sheet with axis-wise + combined outlier flags in: {os.path.basename(filepath)}")
+def process_dataframe(df, reports):
+    if 'datetime' not in df.columns:
+        return df
+    flag_df, report_df = build_boxplot_flags(df, df.attrs.get("capture"))
+    reports["BoxPlot_Flags"] = flag_df
+    reports["BoxPlot_Report"] = report_df
+    return add_axiswise_and_combined_flags(df, flag_df)
 
+@incremental_stage("09_outlier_detection_box_plot")
 def process_file_boxplot(filepath):
-    try:
-        print(f"📄 Processing: {filepath}")
-        df = pd.read_excel(filepath)
-
-        if 'datetime' not in df.columns:
-            print(f"⚠️ Skipped: 'datetime' column not found.")
-            return
-
-        axis_cols = ['x_mps2', 'y_mps2', 'z_mps2']
-        outlier_report = []
-        flag_df = pd.DataFrame({'datetime': df['datetime']})
-
-        for axis in axis_cols:
-            if axis in df.columns:
-                flags, lower, upper = detect_boxplot_outliers(df, axis)
-                flag_col = f'{axis}_box_flag'
-                flag_df[flag_col] = flags
-
-                outliers = df[flags == 1][['datetime', axis]].copy()
-                outliers['Axis'] = axis
-                outliers['Serial_No'] = outliers.index + 2
-                outliers.rename(columns={axis: 'Outlier_Value'}, inplace=True)
-                outlier_report.append(outliers)
-
-        # Save flag sheet and report
-        if outlier_report:
-            report_df = pd.concat(outlier_report, ignore_index=True)
-            report_df = report_df[['Serial_No', 'datetime', 'Axis', 'Outlier_Value']]
-        else:
-            report_df = pd.DataFrame(columns=['Serial_No', 'datetime', 'Axis', 'Outlier_Value'])
-
-        with pd.ExcelWriter(filepath, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            flag_df.to_excel(writer, sheet_name="BoxPlot_Flags", index=False)
-            report_df.to_excel(writer, sheet_name="BoxPlot_Report", index=False)
-
-        # Add axis-wise and combined flags to main sheet
-        df = add_axiswise_and_combined_flags(df, flag_df)
-        update_main_sheet_with_flags(filepath, df)
-
-        print(f"✅ Done: Flags, report, and main sheet updated ➤ {os.path.basename(filepath)}\n")
-
-    except Exception as e:
-        print(f"❌ Error processing {filepath}: {e}")
-
-def recursive_boxplot_analysis(folder_path):
-    for dirpath, _, filenames in os.walk(folder_path):
-        for file in filenames:
-            if file.endswith('.xlsx'):
-                full_path = os.path.join(dirpath, file)
-                process_file_boxplot(full_path)
+    print(f"📄 Processing: {filepath}")
+    df = load_main(filepath, columns=['datetime', 'x_mps2', 'y_mps2', 'z_mps2'], upto="09_outlier_detection_box_plot")
+
+    if 'datetime' not in df.columns:
+        print(f"⚠️ Skipped: 'datetime' column not found.")
+        return
+
+    flag_df, report_df = build_boxplot_flags(df, filepath)
+
+    save_sheets(filepath, {"BoxPlot_Flags": flag_df, "BoxPlot_Report": report_df})
+
+    # Add axis-wise and combined flags to main sheet
+    df = add_axiswise_and_combined_flags(df, flag_df)
+    update_main_sheet_with_flags(filepath, df)
+
+    print(f"✅ Done: Flags, report, and main sheet updated ➤ {os.path.basename(filepath)}\n")
+
+def recursive_boxplot_analysis(folder_path, workers=None):
+    return run_parallel(process_file_boxplot, iter_inputs(folder_path), workers=workers)
 
 # === USAGE ===
-folder_path = r"D:\extracted data from JSON file ISI\rerport writing data\reccurence"
-recursive_boxplot_analysis(folder_path)
+if __name__ == "__main__":
+    folder_path = r"D:\extracted data from JSON file ISI\rerport writing data\reccurence"
+    recursive_boxplot_analysis(folder_path)
 
 
 
@@ -1,191 +1,218 @@
 import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from io import BytesIO
 from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.drawing.image import Image as XLImage
-from PIL import Image
-
-
-def analyze_spikes_and_embed(filepath, std_dev_threshold=3.0, use_adaptive_threshold=True, quantile_threshold=0.99):
-    try:
-        df = pd.read_excel(filepath)
-
-        # Parse datetime
-        if 'timestamp' in df.columns:
-            df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-        elif 'datetime' in df.columns:
-            df['datetime'] = pd.to_datetime(df['datetime'])
+from columnar_store import iter_inputs, is_store, load_main, save_images, save_main, save_sheets
+from instrumentation import timed
+from manifest import incremental_stage
+from parallel_executor import run_parallel
+from plot_renderer import decimate, submit_figures
+from quantile_sketch import baseline_quantiles
+from report_writer import replace_image_sheet, replace_sheet
+
+# === CONFIGURATION ===
+STAGE_VERSION = 2
+STD_DEV_THRESHOLD = 3.0
+USE_ADAPTIVE_THRESHOLD = True
+QUANTILE_THRESHOLD = 0.99
+# Adaptive thresholds from a fleet baseline built by quantile_sketch.py (None = per capture)
+BASELINE_FILE = None
+BASELINE_LEVEL = "sensor"   # sensor, machine or fleet
+# Plots: rendered in the background from decimated signals (see plot_renderer.py)
+RENDER_PLOTS = True         # False skips the Plots sheet, e.g. for batch runs
+PLOT_DECIMATION = "minmax"  # "minmax", "lttb" or None (draw every sample)
+PLOT_MAX_POINTS = 2400      # line points per axis, two per pixel column of the 12 in figure
+
+
+def parse_datetime(df):
+    if 'timestamp' in df.columns:
+        df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
+    elif 'datetime' in df.columns:
+        df['datetime'] = pd.to_datetime(df['datetime'])
+    return df
+
+
+def detect_axes(df):
+    if all(col in df.columns for col in ['x', 'y', 'z']):
+        return ['x', 'y', 'z']
+    if all(col in df.columns for col in ['x_mps2', 'y_mps2', 'z_mps2']):
+        return ['x_mps2', 'y_mps2', 'z_mps2']
+    return None
+
+
+def compute_spike_statistics(df, axes, std_dev_threshold=STD_DEV_THRESHOLD, use_adaptive_threshold=USE_ADAPTIVE_THRESHOLD, quantile_threshold=QUANTILE_THRESHOLD, capture=None):
+    all_spikes = []
+    summary_stats = []
+    peak_points = []
+
+    for axis in axes:
+        df[axis] = df[axis].ffill().bfill()
+        mean = df[axis].mean()
+        std = df[axis].std()
+        z_col = f"{axis}_zscore"
+        df[z_col] = (df[axis] - mean) / std if std > 0 else 0
+
+        # Adaptive thresholds based on quantiles
+        thresholds = baseline_quantiles(BASELINE_FILE, capture, axis, [1 - quantile_threshold, quantile_threshold], BASELINE_LEVEL)
+        if thresholds is not None:
+            lower_thresh, upper_thresh = thresholds
         else:
-            print(f"[ERROR] No 'timestamp' or 'datetime' column found in: {filepath}")
-            return
-
-        # Detect axes
-        if all(col in df.columns for col in ['x', 'y', 'z']):
-            axes = ['x', 'y', 'z']
-        elif all(col in df.columns for col in ['x_mps2', 'y_mps2', 'z_mps2']):
-            axes = ['x_mps2', 'y_mps2', 'z_mps2']
-        else:
-            print(f"[ERROR] Required axis columns not found in: {filepath}")
-            return
-
-        print(f"\n📊 Analyzing: {os.path.basename(filepath)}")
-
-        all_spikes = []
-        summary_stats = []
-        peak_points = []
-
-        for axis in axes:
-            df[axis] = df[axis].ffill().bfill()
-            mean = df[axis].mean()
-            std = df[axis].std()
-            z_col = f"{axis}_zscore"
-            df[z_col] = (df[axis] - mean) / std if std > 0 else 0
-
-            # Adaptive thresholds based on quantiles
             upper_thresh = df[axis].quantile(quantile_threshold)
             lower_thresh = df[axis].quantile(1 - quantile_threshold)
 
-            outlier_flag_col = f"{axis[0]}_outlier_z_score"
-            if use_adaptive_threshold:
-                df[outlier_flag_col] = (df[axis] > upper_thresh) | (df[axis] < lower_thresh)
-            else:
-                df[outlier_flag_col] = df[z_col].abs() > std_dev_threshold
-
-            spikes = df[df[outlier_flag_col]]
-            if not spikes.empty:
-                spike_info = spikes[['datetime', axis, z_col]].copy()
-                spike_info['Serial_No'] = spikes.index + 2
-                spike_info['Axis'] = axis
-                spike_info.rename(columns={axis: 'Spike_Value', z_col: 'Z_Score'}, inplace=True)
-                all_spikes.append(spike_info)
-
-                max_idx = spike_info['Z_Score'].abs().idxmax()
-                peak_row = spike_info.loc[max_idx]
-                peak_points.append(peak_row)
-
-            summary_stats.append({
-                "Axis": axis,
-                "Mean": mean,
-                "Std Dev": std,
-                "Upper Threshold": upper_thresh,
-                "Lower Threshold": lower_thresh,
-                "Max Z-score": df[z_col].abs().max(),
-                "Spikes Found": len(spikes),
-                "% Spikes": round(len(spikes) / len(df) * 100, 2)
-            })
-
-        # Combine axis-specific flags into a single is_outlier column
-        axis_flags = [f"{axis[0]}_outlier_z_score" for axis in axes]
-        df['is_outlier'] = df[axis_flags].any(axis=1).astype(int)
-
-        # Generate plots
-        fig1, axs1 = plt.subplots(len(axes), 1, figsize=(12, 8), sharex=True)
-        for i, axis in enumerate(axes):
-            flag_col = f"{axis[0]}_outlier_z_score"
-            axs1[i].plot(df['datetime'], df[axis], label=f'{axis} signal')
-            axs1[i].scatter(df.loc[df[flag_col], 'datetime'], df.loc[df[flag_col], axis], color='red', label='Spikes')
-            axs1[i].legend()
-            axs1[i].set_ylabel("Amplitude")
-            axs1[i].grid(True)
-        axs1[-1].set_xlabel("Time")
-        fig1.tight_layout()
-        buf1 = BytesIO()
-        fig1.savefig(buf1, format='png')
-        plt.close(fig1)
-
-        fig2, axs2 = plt.subplots(len(axes), 1, figsize=(12, 8), sharex=True)
-        for i, axis in enumerate(axes):
-            z = df[f"{axis}_zscore"]
-            axs2[i].plot(df['datetime'], z, label=f'{axis} Z-score', color='green')
-            axs2[i].axhline(std_dev_threshold, color='red', linestyle='--', label='±Threshold')
-            axs2[i].axhline(-std_dev_threshold, color='red', linestyle='--')
-            axs2[i].legend()
-            axs2[i].set_ylabel("Z-Score")
-            axs2[i].grid(True)
-        axs2[-1].set_xlabel("Time")
-        fig2.tight_layout()
-        buf2 = BytesIO()
-        fig2.savefig(buf2, format='png')
-        plt.close(fig2)
-
-        # === Update Excel File ===
-        wb = load_workbook(filepath)
-        main_sheet = wb.sheetnames[0]
-        wb.remove(wb[main_sheet])
-        ws = wb.create_sheet(main_sheet, 0)
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws.append(r)
-
-        # Add or replace Plots sheet
-        if 'Plots' in wb.sheetnames:
-            wb.remove(wb['Plots'])
-        ws_plot = wb.create_sheet("Plots")
-
-        # Convert plots to Pillow image and insert
-        for i, buf in enumerate([buf1, buf2]):
-            buf.seek(0)
-            img = Image.open(buf)
-            image_path = f"temp_plot_{i}.png"
-            img.save(image_path)
-            xl_img = XLImage(image_path)
-            ws_plot.add_image(xl_img, f"B{2 + i * 30}")
-
-        # Spike Report
-        if all_spikes:
-            spike_df = pd.concat(all_spikes, ignore_index=True)
-            spike_df['datetime'] = pd.to_datetime(spike_df['datetime']).dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
-            if 'Spike_Report' in wb.sheetnames:
-                wb.remove(wb['Spike_Report'])
-            ws_report = wb.create_sheet("Spike_Report")
-            for r in dataframe_to_rows(spike_df, index=False, header=True):
-                ws_report.append(r)
-
-        # Summary Stats
-        if 'Summary_Stats' in wb.sheetnames:
-            wb.remove(wb['Summary_Stats'])
-        ws_summary = wb.create_sheet("Summary_Stats")
-        for r in dataframe_to_rows(pd.DataFrame(summary_stats), index=False, header=True):
-            ws_summary.append(r)
-
-        # Peak Points
-        if peak_points:
-            peak_df = pd.DataFrame(peak_points)
-            peak_df['datetime'] = pd.to_datetime(peak_df['datetime']).dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
-            peak_df = peak_df[['Serial_No', 'datetime', 'Axis', 'Spike_Value', 'Z_Score']]
-            if 'Peak_Spike_Coordinates' in wb.sheetnames:
-                wb.remove(wb['Peak_Spike_Coordinates'])
-            ws_peaks = wb.create_sheet("Peak_Spike_Coordinates")
-            for r in dataframe_to_rows(peak_df, index=False, header=True):
-                ws_peaks.append(r)
-
-        wb.save(filepath)
+        outlier_flag_col = f"{axis[0]}_outlier_z_score"
+        if use_adaptive_threshold:
+            df[outlier_flag_col] = (df[axis] > upper_thresh) | (df[axis] < lower_thresh)
+        else:
+            df[outlier_flag_col] = df[z_col].abs() > std_dev_threshold
+
+        spikes = df[df[outlier_flag_col]]
+        if not spikes.empty:
+            spike_info = spikes[['datetime', axis, z_col]].copy()
+            spike_info['Serial_No'] = spikes.index + 2
+            spike_info['Axis'] = axis
+            spike_info.rename(columns={axis: 'Spike_Value', z_col: 'Z_Score'}, inplace=True)
+            all_spikes.append(spike_info)
+
+            max_idx = spike_info['Z_Score'].abs().idxmax()
+            peak_row = spike_info.loc[max_idx]
+            peak_points.append(peak_row)
+
+        summary_stats.append({
+            "Axis": axis,
+            "Mean": mean,
+            "Std Dev": std,
+            "Upper Threshold": upper_thresh,
+            "Lower Threshold": lower_thresh,
+            "Max Z-score": df[z_col].abs().max(),
+            "Spikes Found": len(spikes),
+            "% Spikes": round(len(spikes) / len(df) * 100, 2)
+        })
+
+    # Combine axis-specific flags into a single is_outlier column
+    axis_flags = [f"{axis[0]}_outlier_z_score" for axis in axes]
+    df['is_outlier'] = df[axis_flags].any(axis=1).astype(int)
+
+    return df, all_spikes, summary_stats, peak_points
+
+
+def spike_plot_specs(df, axes, std_dev_threshold=STD_DEV_THRESHOLD, method=PLOT_DECIMATION,
+                     max_points=PLOT_MAX_POINTS):
+    """Figure specs of the signal/spike plot and the z-score plot, with decimated lines."""
+    times = df['datetime'].to_numpy()
+    seconds = (times - times[0]) / np.timedelta64(1, 's') if len(times) else times
+    signal_panels, zscore_panels = [], []
+    for axis in axes:
+        flags = df[f"{axis[0]}_outlier_z_score"].to_numpy(dtype=bool)
+        values = df[axis].to_numpy()
+        z = df[f"{axis}_zscore"].to_numpy(dtype=float)
+        # The z-score is a linear function of the signal, so the same samples keep its shape too
+        idx = decimate(seconds, values, max_points, keep=flags, method=method)
+        signal_panels.append({
+            "lines": [(times[idx], values[idx], {"label": f'{axis} signal'})],
+            "points": [(times[flags], values[flags], {"color": 'red', "label": 'Spikes'})],
+            "ylabel": "Amplitude",
+        })
+        zscore_panels.append({
+            "lines": [(times[idx], z[idx], {"label": f'{axis} Z-score', "color": 'green'})],
+            "hlines": [(std_dev_threshold, {"color": 'red', "linestyle": '--', "label": '±Threshold'}),
+                       (-std_dev_threshold, {"color": 'red', "linestyle": '--'})],
+            "ylabel": "Z-Score",
+        })
+    return [{"figsize": (12, 8), "xlabel": "Time", "panels": panels} for panels in (signal_panels, zscore_panels)]
+
+
+@timed("plots")
+def render_spike_plots(df, axes, std_dev_threshold=STD_DEV_THRESHOLD):
+    """Start rendering both plots in the background; iterate the result for the PNG buffers."""
+    return submit_figures(spike_plot_specs(df, axes, std_dev_threshold))
+
+
+def build_spike_reports(all_spikes, summary_stats, peak_points):
+    sheets = {}
+    if all_spikes:
+        sheets["Spike_Report"] = pd.concat(all_spikes, ignore_index=True)
+    sheets["Summary_Stats"] = pd.DataFrame(summary_stats)
+    if peak_points:
+        sheets["Peak_Spike_Coordinates"] = pd.DataFrame(peak_points)[['Serial_No', 'datetime', 'Axis', 'Spike_Value', 'Z_Score']]
+    return sheets
+
+
+def process_dataframe(df, reports):
+    df = parse_datetime(df)
+    axes = detect_axes(df)
+    if 'datetime' not in df.columns or axes is None:
+        return df
+
+    df, all_spikes, summary_stats, peak_points = compute_spike_statistics(df, axes, capture=df.attrs.get("capture"))
+    reports.update(build_spike_reports(all_spikes, summary_stats, peak_points))
+    # An empty list also clears the plots of an earlier run
+    render = RENDER_PLOTS and df.attrs.get("render_plots", True)
+    reports["Plots"] = render_spike_plots(df, axes) if render else []
+    return df
+
+
+@incremental_stage("10_outlier_detection_z-score")
+def analyze_spikes_and_embed(filepath, std_dev_threshold=STD_DEV_THRESHOLD, use_adaptive_threshold=USE_ADAPTIVE_THRESHOLD, quantile_threshold=QUANTILE_THRESHOLD):
+    df = load_main(filepath, columns=['timestamp', 'datetime', 'x', 'y', 'z', 'x_mps2', 'y_mps2', 'z_mps2'], upto="10_outlier_detection_z-score")
+
+    # Parse datetime
+    df = parse_datetime(df)
+    if 'datetime' not in df.columns:
+        print(f"[ERROR] No 'timestamp' or 'datetime' column found in: {filepath}")
+        return
+
+    # Detect axes
+    axes = detect_axes(df)
+    if axes is None:
+        print(f"[ERROR] Required axis columns not found in: {filepath}")
+        return
+
+    print(f"\n📊 Analyzing: {os.path.basename(filepath)}")
+
+    df, all_spikes, summary_stats, peak_points = compute_spike_statistics(
+        df, axes, std_dev_threshold, use_adaptive_threshold, quantile_threshold, filepath)
+    axis_flags = [f"{axis[0]}_outlier_z_score" for axis in axes]
+
+    # Plots render in the background while the tables are written
+    plots = render_spike_plots(df, axes, std_dev_threshold) if RENDER_PLOTS else []
+
+    if is_store(filepath):
+        output_cols = ['datetime'] + axes + [f"{axis}_zscore" for axis in axes] + axis_flags + ['is_outlier']
+        save_main(filepath, df, "10_outlier_detection_z-score", columns=output_cols)
+        save_sheets(filepath, build_spike_reports(all_spikes, summary_stats, peak_points))
+        save_images(filepath, "Plots", plots)
         print(f"[✓] Embedded and saved to: {os.path.basename(filepath)}")
+        return
 
-    except Exception as e:
-        print(f"[✗] Error processing {filepath}: {e}")
-
-
-def recursive_spike_analysis(root_folder):
-    for dirpath, _, filenames in os.walk(root_folder):
-        for file in filenames:
-            if file.endswith('.xlsx') and not file.endswith('_analysis_report_embedded.xlsx'):
-                full_path = os.path.join(dirpath, file)
-                analyze_spikes_and_embed(full_path)
-
-
-if __name__ == "__main__":
-    folder_path = r"D:\extracted data from JSON file ISI\rerport writing data\reccurence"
-    recursive_spike_analysis(folder_path)
-
-
+    # === Update Excel File === (one load, one save; plots straight from their buffers)
+    wb = load_workbook(filepath)
+    replace_sheet(wb, wb.sheetnames[0], df, 0)
 
+    # Spike Report
+    if all_spikes:
+        spike_df = pd.concat(all_spikes, ignore_index=True)
+        spike_df['datetime'] = pd.to_datetime(spike_df['datetime']).dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
+        replace_sheet(wb, "Spike_Report", spike_df)
 
+    # Summary Stats
+    replace_sheet(wb, "Summary_Stats", pd.DataFrame(summary_stats))
 
+    # Peak Points
+    if peak_points:
+        peak_df = pd.DataFrame(peak_points)
+        peak_df['datetime'] = pd.to_datetime(peak_df['datetime']).dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]
+        replace_sheet(wb, "Peak_Spike_Coordinates", peak_df[['Serial_No', 'datetime', 'Axis', 'Spike_Value', 'Z_Score']])
 
+    replace_image_sheet(wb, "Plots", plots)
+    wb.save(filepath)
+    print(f"[✓] Embedded and saved to: {os.path.basename(filepath)}")
 
 
+def recursive_spike_analysis(root_folder, workers=None):
+    return run_parallel(analyze_spikes_and_embed, iter_inputs(root_folder, exclude_suffixes=('_analysis_report_embedded.xlsx',)), workers=workers)
 
 
+if __name__ == "__main__":
+    folder_path = r"D:\extracted data from JSON file ISI\rerport writing data\reccurence"
+    recursive_spike_analysis(folder_path)
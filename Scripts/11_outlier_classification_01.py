@@ -1,136 +1,169 @@
 import os
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from columnar_store import iter_inputs, load_main, save_main
+from manifest import incremental_stage
+from parallel_executor import run_parallel
+
+# === CONFIGURATION ===
+STAGE_VERSION = 2
 
 # Define flag columns
 Z_SCORE_FLAGS = ['x_outlier_z_score', 'y_outlier_z_score', 'z_outlier_z_score']
 BOX_PLOT_FLAGS = ['x_outlier_box_plot', 'y_outlier_box_plot', 'z_outlier_box_plot']
-
-# Utility: count True flags
-def count_true_flags(row, cols):
-    return sum(bool(row.get(col, False)) for col in cols)
-
-# === Logic 1: Loosened Yet Structured ===
-def evaluate_contextual_label_loosened(df, idx):
-    row = df.iloc[idx]
-    curr_z = count_true_flags(row, Z_SCORE_FLAGS)
-    curr_box = count_true_flags(row, BOX_PLOT_FLAGS)
-    curr_total = curr_z + curr_box
-
-    neighbor_total = 0
-    for j in [idx - 1, idx + 1]:
-        if 0 <= j < len(df):
-            neighbor_total += count_true_flags(df.iloc[j], Z_SCORE_FLAGS + BOX_PLOT_FLAGS)
-
-    is_outlier_flagged = row['is_outlier'] == 1 or row['is_outlier_boxplot'] == 1
-
-    if is_outlier_flagged:
-        if curr_total >= 1:
-            if neighbor_total >= 1 or curr_total >= 2:
-                return "True Anomaly"
-            else:
-                return "Likely Sensor Fault"
-        else:
-            return "Uncertain"
-    elif neighbor_total >= 2:
-        return "Uncertain"
-    else:
-        return "Normal"
-
-# === Logic 2: Enhanced Detection-Specific ===
-def evaluate_contextual_label_enhanced(df, idx):
-    row = df.iloc[idx]
-    curr_z = count_true_flags(row, Z_SCORE_FLAGS)
-    curr_box = count_true_flags(row, BOX_PLOT_FLAGS)
-    zscore_flag = curr_z > 0
-    boxplot_flag = curr_box > 0
-
-    neighbor_total = 0
-    for j in [idx - 1, idx + 1]:
-        if 0 <= j < len(df):
-            neighbor_total += count_true_flags(df.iloc[j], Z_SCORE_FLAGS + BOX_PLOT_FLAGS)
-
-    if zscore_flag and boxplot_flag:
-        if neighbor_total >= 1:
-            return "True Anomaly"
-        else:
-            return "Likely Mechanical Fault (Weak Context)"
-    elif zscore_flag or boxplot_flag:
-        if zscore_flag and not boxplot_flag and neighbor_total >= 1:
-            return "Likely Mechanical Fault (Z-score only)"
-        elif neighbor_total >= 2:
-            return "Likely Sensor Fault with Context"
+LABEL_COLUMNS = ['loosened_contextual_label', 'enhanced_contextual_label',
+                 'contextual_score_loosened', 'contextual_score_enhanced',
+                 'final_contextual_score', 'final_contextual_label']
+
+NEIGHBOR_OFFSETS = [-1, 1]
+
+# Contextual labelling as declarative rule tables. Every row is described by a
+# few integer arrays (flag counts of the row and of its neighbours, see
+# flag_context), and each rule set lists (condition, label) pairs that are
+# evaluated for all rows at once with np.select: the first matching rule wins,
+# rows matching none get the default. To add a rule set, append an entry with
+# its own label column, rules, scores and weight in the final score.
+RULE_SETS = {
+    # Logic 1: Loosened Yet Structured
+    "loosened": {
+        "label_column": "loosened_contextual_label",
+        "score_column": "contextual_score_loosened",
+        "rules": [
+            (lambda c: c["is_outlier_flagged"] & (c["curr_total"] >= 1) & ((c["neighbor_total"] >= 1) | (c["curr_total"] >= 2)), "True Anomaly"),
+            (lambda c: c["is_outlier_flagged"] & (c["curr_total"] >= 1), "Likely Sensor Fault"),
+            (lambda c: c["is_outlier_flagged"], "Uncertain"),
+            (lambda c: c["neighbor_total"] >= 2, "Uncertain"),
+        ],
+        "default": "Normal",
+        "scores": {
+            "Normal": 0,
+            "Uncertain": 1,
+            "Likely Sensor Fault": 2,
+            "True Anomaly": 3
+        },
+        "weight": 0.5,
+    },
+    # Logic 2: Enhanced Detection-Specific
+    "enhanced": {
+        "label_column": "enhanced_contextual_label",
+        "score_column": "contextual_score_enhanced",
+        "rules": [
+            (lambda c: c["zscore_flag"] & c["boxplot_flag"] & (c["neighbor_total"] >= 1), "True Anomaly"),
+            (lambda c: c["zscore_flag"] & c["boxplot_flag"], "Likely Mechanical Fault (Weak Context)"),
+            (lambda c: c["zscore_flag"] & ~c["boxplot_flag"] & (c["neighbor_total"] >= 1), "Likely Mechanical Fault (Z-score only)"),
+            (lambda c: (c["zscore_flag"] | c["boxplot_flag"]) & (c["neighbor_total"] >= 2), "Likely Sensor Fault with Context"),
+            (lambda c: c["zscore_flag"] | c["boxplot_flag"], "Uncertain"),
+            (lambda c: c["neighbor_total"] >= 2, "Suspicious Region"),
+        ],
+        "default": "Normal",
+        "scores": {
+            "Normal": 0,
+            "Suspicious Region": 1,
+            "Uncertain": 2,
+            "Likely Mechanical Fault (Weak Context)": 2.5,
+            "Likely Sensor Fault with Context": 3,
+            "Likely Mechanical Fault (Z-score only)": 3.5,
+            "True Anomaly": 4
+        },
+        "weight": 0.5,
+    },
+}
+
+# Final label from the combined score: (upper bound, label), the rest is "Confirmed Anomaly"
+FINAL_LABEL_BOUNDS = [(0.25, "Normal"), (0.5, "Mild Anomaly"), (0.75, "Probable Fault")]
+FINAL_LABEL_TOP = "Confirmed Anomaly"
+
+# Flag counts as integer arrays (a flag counts when it is truthy, missing columns count as False)
+def count_flags(df, cols):
+    counts = np.zeros(len(df), dtype=np.int64)
+    for col in cols:
+        if col in df.columns:
+            counts += df[col].to_numpy().astype(bool)
+    return counts
+
+def neighbor_sum(counts, offsets=NEIGHBOR_OFFSETS):
+    """counts[i + k] summed over the offsets k, with nothing beyond the edges."""
+    total = np.zeros_like(counts)
+    n = len(counts)
+    for k in offsets:
+        if k > 0:
+            total[:n - k] += counts[k:]
+        elif k < 0:
+            total[-k:] += counts[:n + k]
         else:
-            return "Uncertain"
-    elif neighbor_total >= 2:
-        return "Suspicious Region"
-    else:
-        return "Normal"
-
-# Apply both label strategies + summarize
-def apply_contextual_labeling_methods(df):
-    df['loosened_contextual_label'] = [evaluate_contextual_label_loosened(df, i) for i in range(len(df))]
-    df['enhanced_contextual_label'] = [evaluate_contextual_label_enhanced(df, i) for i in range(len(df))]
-
-    label_score_map_loosened = {
-        "Normal": 0,
-        "Uncertain": 1,
-        "Likely Sensor Fault": 2,
-        "True Anomaly": 3
+            total += counts
+    return total
+
+def flag_context(df):
+    """The per-row quantities the rule tables are written in."""
+    curr_z = count_flags(df, Z_SCORE_FLAGS)
+    curr_box = count_flags(df, BOX_PLOT_FLAGS)
+    return {
+        "curr_z": curr_z,
+        "curr_box": curr_box,
+        "curr_total": curr_z + curr_box,
+        "zscore_flag": curr_z > 0,
+        "boxplot_flag": curr_box > 0,
+        "neighbor_total": neighbor_sum(curr_z + curr_box),
+        "is_outlier_flagged": ((df['is_outlier'] == 1) | (df['is_outlier_boxplot'] == 1)).to_numpy(),
     }
 
-    label_score_map_enhanced = {
-        "Normal": 0,
-        "Suspicious Region": 1,
-        "Uncertain": 2,
-        "Likely Mechanical Fault (Weak Context)": 2.5,
-        "Likely Sensor Fault with Context": 3,
-        "Likely Mechanical Fault (Z-score only)": 3.5,
-        "True Anomaly": 4
-    }
-
-    df['contextual_score_loosened'] = df['loosened_contextual_label'].map(label_score_map_loosened)
-    df['contextual_score_enhanced'] = df['enhanced_contextual_label'].map(label_score_map_enhanced)
-
-    df['final_contextual_score'] = (
-        0.5 * (df['contextual_score_loosened'] / 3) +
-        0.5 * (df['contextual_score_enhanced'] / 4)
-    )
-
-    def assign_final_label(score):
-        if score < 0.25:
-            return "Normal"
-        elif score < 0.5:
-            return "Mild Anomaly"
-        elif score < 0.75:
-            return "Probable Fault"
-        else:
-            return "Confirmed Anomaly"
-
-    df['final_contextual_label'] = df['final_contextual_score'].apply(assign_final_label)
+def evaluate_rule_set(context, rule_set):
+    """Labels (categorical, ordered by score) and scores of one rule set for all rows."""
+    rules = rule_set["rules"]
+    labels = np.select([condition(context) for condition, _ in rules],
+                       [label for _, label in rules], default=rule_set["default"])
+    scores = rule_set["scores"]
+    categories = sorted(scores, key=scores.get)
+    labels = pd.Categorical(labels, categories=categories, ordered=True)
+    score_values = np.array([scores[c] for c in categories])[labels.codes]
+    return labels, score_values
+
+def final_labels(score):
+    score = np.asarray(score, dtype=float)
+    labels = np.select([score < bound for bound, _ in FINAL_LABEL_BOUNDS],
+                       [label for _, label in FINAL_LABEL_BOUNDS], default=FINAL_LABEL_TOP)
+    categories = [label for _, label in FINAL_LABEL_BOUNDS] + [FINAL_LABEL_TOP]
+    return pd.Categorical(labels, categories=categories, ordered=True)
+
+# Apply all label strategies + summarize
+def apply_contextual_labeling_methods(df, rule_sets=None):
+    rule_sets = RULE_SETS if rule_sets is None else rule_sets
+    context = flag_context(df)
+
+    results = [evaluate_rule_set(context, rule_set) for rule_set in rule_sets.values()]
+    for rule_set, (labels, _) in zip(rule_sets.values(), results):
+        df[rule_set["label_column"]] = labels
+    for rule_set, (_, scores) in zip(rule_sets.values(), results):
+        df[rule_set["score_column"]] = scores
+
+    final_score = None
+    for rule_set in rule_sets.values():
+        # Each rule set contributes its score scaled to 0..1
+        part = rule_set["weight"] * (df[rule_set["score_column"]] / max(rule_set["scores"].values()))
+        final_score = part if final_score is None else final_score + part
+
+    df['final_contextual_score'] = final_score
+    df['final_contextual_label'] = final_labels(df['final_contextual_score'])
     return df
 
 # Overwrite only main sheet, preserve others
 def update_main_sheet_preserving_others(filepath, updated_df):
-    wb = load_workbook(filepath)
-    main_sheet_name = wb.sheetnames[0]
-
-    # Remove old main sheet
-    wb.remove(wb[main_sheet_name])
-    ws = wb.create_sheet(main_sheet_name, 0)
-
-    for r in dataframe_to_rows(updated_df, index=False, header=True):
-        ws.append(r)
-
-    wb.save(filepath)
+    save_main(filepath, updated_df, "11_outlier_classification_01", columns=LABEL_COLUMNS)
     print(f"[✓] Contextual labels safely added to: {os.path.basename(filepath)}")
 
+def process_dataframe(df, reports):
+    required_cols = Z_SCORE_FLAGS + BOX_PLOT_FLAGS + ['is_outlier', 'is_outlier_boxplot']
+    if all(col in df.columns for col in required_cols):
+        df = apply_contextual_labeling_methods(df)
+    return df
+
 # File processor function
+@incremental_stage("11_outlier_classification_01")
 def process_file(filepath):
-    df = pd.read_excel(filepath, sheet_name=0)
-
     required_cols = Z_SCORE_FLAGS + BOX_PLOT_FLAGS + ['is_outlier', 'is_outlier_boxplot']
+    df = load_main(filepath, columns=required_cols, upto="11_outlier_classification_01")
+
     if not all(col in df.columns for col in required_cols):
         print(f"[!] Missing required columns in: {filepath}")
         return
@@ -139,11 +172,8 @@ def process_file(filepath):
     update_main_sheet_preserving_others(filepath, df)
 
 # Folder processor
-def process_folder(root_dir):
-    for dirpath, _, filenames in os.walk(root_dir):
-        for file in filenames:
-            if file.endswith('.xlsx'):
-                process_file(os.path.join(dirpath, file))
+def process_folder(root_dir, workers=None):
+    return run_parallel(process_file, iter_inputs(root_dir), workers=workers)
 
 # === USAGE ===
 if __name__ == '__main__':
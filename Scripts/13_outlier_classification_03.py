@@ -1,14 +1,36 @@
 import os
 import pandas as pd
 import numpy as np
-from collections import defaultdict
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from columnar_store import iter_inputs, load_main, save_main, save_sheets
+from manifest import incremental_stage
+from parallel_executor import run_parallel
 
 # === CONFIGURATION ===
+STAGE_VERSION = 3
 SEGMENT_DURATION = 15  # seconds
 OFFSET_TOLERANCE = 0.5  # seconds for recurrence matching
 MIN_RECURSIONS = 3  # how many segments must repeat the same offset
+RECURRENCE_COLUMNS = ['time_offset', 'segment_id', 'offset_in_segment', 'recurring_anomaly', 'recurrence_score']
+
+# Period search: instead of the fixed SEGMENT_DURATION, every period from
+# PERIOD_MIN up to PERIOD_MAX_FRACTION of the capture length is scored at once
+# from the power spectrum of the outlier event train (one FFT per capture)
+PERIOD_SEARCH = True
+PERIOD_MIN = 1.0  # seconds
+PERIOD_MAX_FRACTION = 0.5
+TOP_PERIODS = 5
+MAX_HARMONICS = 16  # harmonics summed per candidate frequency
+
+def recurrence_counts(offset_in_segment, segment_id):
+    """For every outlier: in how many segments an outlier falls into the same offset bin."""
+    keys = np.round(np.asarray(offset_in_segment) / OFFSET_TOLERANCE).astype(np.int64)
+    segments = np.asarray(segment_id, dtype=np.int64)
+    if not len(keys):
+        return np.zeros(0, dtype=np.int64)
+    # Distinct (offset bin, segment) pairs, then the number of segments per offset bin
+    pairs = np.unique(np.stack([keys, segments]), axis=1)
+    bins, segment_counts = np.unique(pairs[0], return_counts=True)
+    return segment_counts[np.searchsorted(bins, keys)]
 
 def detect_recurring_offsets(df):
     df['datetime'] = pd.to_datetime(df['datetime'])
@@ -16,69 +38,110 @@ def detect_recurring_offsets(df):
     df['segment_id'] = (df['time_offset'] // SEGMENT_DURATION).astype(int)
     df['offset_in_segment'] = df['time_offset'] % SEGMENT_DURATION
 
-    # Only consider outliers
-    outlier_df = df[df['is_outlier'] == 1].copy()
+    # Only outliers are binned and scored; every other row gets 0
+    is_outlier = (df['is_outlier'] == 1).to_numpy()
+    counts = recurrence_counts(df['offset_in_segment'].to_numpy()[is_outlier], df['segment_id'].to_numpy()[is_outlier])
 
-    offset_map = defaultdict(set)
-    for _, row in outlier_df.iterrows():
-        rounded_offset = round(row['offset_in_segment'] / OFFSET_TOLERANCE) * OFFSET_TOLERANCE
-        offset_map[rounded_offset].add(row['segment_id'])
-
-    recurring_offsets = {
-        offset for offset, segments in offset_map.items() if len(segments) >= MIN_RECURSIONS
-    }
-
-    df['recurring_anomaly'] = df.apply(
-       lambda row: int(
-           row['is_outlier'] == 1 and
-           round(row['offset_in_segment'] / OFFSET_TOLERANCE) * OFFSET_TOLERANCE in recurring_offsets
-        ), axis=1
-    )
-
-    # Add recurrence strength if needed
-    recurrence_strength = {
-        offset: len(segments) for offset, segments in offset_map.items()
-    }
-
-    df['recurrence_score'] = df.apply(
-        lambda row: recurrence_strength.get(
-            round(row['offset_in_segment'] / OFFSET_TOLERANCE) * OFFSET_TOLERANCE, 0
-        ) if row['is_outlier'] == 1 else 0, axis=1
-    )
+    score = np.zeros(len(df), dtype=np.int64)
+    score[is_outlier] = counts
+    df['recurring_anomaly'] = (score >= MIN_RECURSIONS).astype(np.int64)
+    df['recurrence_score'] = score
+    return df
 
+def _is_harmonic(period, chosen, tolerance=0.02):
+    """True when ``period`` is close to an integer multiple or fraction of a chosen period."""
+    for c in chosen:
+        ratio = max(period, c) / min(period, c)
+        if abs(ratio - round(ratio)) <= tolerance * ratio:
+            return True
+    return False
+
+def find_recurring_periods(time_offset, is_outlier, top=TOP_PERIODS):
+    """Strongest recurrence periods of the outlier events of one capture.
+
+    The outlier times are binned at OFFSET_TOLERANCE into an event train, and
+    one zero-padded FFT gives its power at every candidate frequency,
+    normalised so that randomly placed events average 1. The power of the
+    first MAX_HARMONICS harmonics of a frequency is summed and expressed as standard deviations
+    above that random level (Score), so a train of short bursts ranks at its
+    fundamental rather than at an overtone. Harmonics and sub-harmonics of a
+    period already reported are skipped. Recurring_Events is the number of
+    outliers the stage itself would flag with SEGMENT_DURATION set to the period.
+    """
+    columns = ['Period_s', 'Score', 'Recurring_Events']
+    time_offset = np.asarray(time_offset, dtype=float)
+    is_outlier = np.asarray(is_outlier, dtype=bool)
+    events = time_offset[is_outlier & ~np.isnan(time_offset)]
+    duration = np.nanmax(time_offset) if len(time_offset) else 0.0
+    max_period = duration * PERIOD_MAX_FRACTION
+    if len(events) < MIN_RECURSIONS or max_period < PERIOD_MIN:
+        return pd.DataFrame(columns=columns)
+
+    n_bins = int(duration // OFFSET_TOLERANCE) + 1
+    train = np.zeros(n_bins)
+    train[(events // OFFSET_TOLERANCE).astype(np.int64)] = 1.0
+    size = 1 << int(np.ceil(np.log2(4 * n_bins)))
+    power = np.abs(np.fft.rfft(train - train.mean(), size)) ** 2 / train.sum()
+
+    index = np.arange(len(power))
+    with np.errstate(divide="ignore"):
+        periods = size * OFFSET_TOLERANCE / index
+    candidates = (periods >= PERIOD_MIN) & (periods <= max_period)
+    lowest = index[candidates].min() if candidates.any() else len(power)
+
+    # Harmonic sum over k = 1 .. MAX_HARMONICS: power[::k][i] is the power at
+    # frequency i * k, so each harmonic is one strided slice (linear in length)
+    total = np.zeros(len(power))
+    harmonics = np.zeros(len(power))
+    for k in range(1, min(MAX_HARMONICS, -(-len(power) // max(lowest, 1))) + 1):
+        harmonic = power[::k]
+        total[:len(harmonic)] += harmonic
+        harmonics[:len(harmonic)] += 1
+    score = (total - harmonics) / np.sqrt(np.maximum(harmonics, 1))
+
+    left = np.concatenate([[-np.inf], score[:-1]])
+    right = np.concatenate([score[1:], [-np.inf]])
+    peaks = np.flatnonzero(candidates & (score >= left) & (score > right))
+    peaks = peaks[np.argsort(-score[peaks], kind="stable")]
+
+    rows, chosen = [], []
+    for j in peaks:
+        period = float(periods[j])
+        if _is_harmonic(period, chosen):
+            continue
+        chosen.append(period)
+        counts = recurrence_counts(events % period, events // period)
+        rows.append({'Period_s': period, 'Score': float(score[j]),
+                     'Recurring_Events': int((counts >= MIN_RECURSIONS).sum())})
+        if len(rows) == top:
+            break
+    return pd.DataFrame(rows, columns=columns)
+
+def process_dataframe(df, reports):
+    if 'datetime' in df.columns and 'is_outlier' in df.columns:
+        df = detect_recurring_offsets(df)
+        if PERIOD_SEARCH:
+            reports["Recurrence_Periods"] = find_recurring_periods(df['time_offset'], df['is_outlier'] == 1)
     return df
 
+@incremental_stage("13_outlier_classification_03")
 def analyze_file_recurrence(filepath):
     print(f"🔁 Processing Recurrence: {os.path.basename(filepath)}")
-    try:
-        df = pd.read_excel(filepath)
-        if 'datetime' not in df.columns or 'is_outlier' not in df.columns:
-            print("⚠️ Missing required columns.")
-            return
-
-        df = detect_recurring_offsets(df)
-
-        # Overwrite only the main sheet
-        wb = load_workbook(filepath)
-        sheetnames = wb.sheetnames
-        main_sheet = sheetnames[0]
-        wb.remove(wb[main_sheet])
-        ws = wb.create_sheet(main_sheet, 0)
-
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws.append(r)
+    df = load_main(filepath, columns=['datetime', 'is_outlier'], upto="13_outlier_classification_03")
+    if 'datetime' not in df.columns or 'is_outlier' not in df.columns:
+        print("⚠️ Missing required columns.")
+        return
 
-        wb.save(filepath)
-        print(f"✅ Saved: Recurrence results added ➤ {os.path.basename(filepath)}")
+    df = detect_recurring_offsets(df)
 
-    except Exception as e:
-        print(f"[✗] Error processing {filepath}: {e}")
+    # Overwrite only the main sheet
+    save_main(filepath, df, "13_outlier_classification_03", columns=RECURRENCE_COLUMNS)
+    if PERIOD_SEARCH:
+        save_sheets(filepath, {"Recurrence_Periods": find_recurring_periods(df['time_offset'], df['is_outlier'] == 1)})
+    print(f"✅ Saved: Recurrence results added ➤ {os.path.basename(filepath)}")
 
-def process_folder(root_dir):
-    for dirpath, _, filenames in os.walk(root_dir):
-        for file in filenames:
-            if file.endswith(".xlsx") and not file.startswith("~$"):
-                analyze_file_recurrence(os.path.join(dirpath, file))
+def process_folder(root_dir, workers=None):
+    return run_parallel(analyze_file_recurrence, iter_inputs(root_dir), workers=workers)
 
 # === MAIN EXECUTION ===
 if __name__ == "__main__":
@@ -3,19 +3,31 @@ import pandas as pd
 import numpy as np
 from scipy.fft import fft, fftfreq
 from scipy.signal import detrend
-from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+from columnar_store import iter_inputs, load_main, save_sheets
+from manifest import incremental_stage
+from parallel_executor import run_parallel
+from spectral_features import spectrogram_features, window_features
 
 # === CONFIGURATION ===
-bands = [(0, 1), (1, 3), (3, 5), (5, 10)]  # Only up to 10 Hz
-axes = ['x_mps2', 'y_mps2', 'z_mps2']
+STAGE_VERSION = 2
+BANDS = [(0, 1), (1, 3), (3, 5), (5, 10)]  # Only up to 10 Hz
+AXES = ['x_mps2', 'y_mps2', 'z_mps2']
+FEATURE_NAMES = ['total_power', 'spectral_centroid'] + [f'band_{lo}_{hi}Hz' for lo, hi in BANDS]
+SPECTROGRAM_MODE = False          # also write overlapping-window features to a "Spectrogram_Features" sheet
+SPECTROGRAM_WINDOW_SECONDS = 2.0
+SPECTROGRAM_HOP_SECONDS = 0.5     # 75 % overlap
+SPECTROGRAM_TAPER = "hann"        # any scipy.signal.get_window name
+SPECTROGRAM_BANDS = BANDS
+
+# fft_features() is the per-window reference; compute_fft_features() gets the
+# same numbers for all windows at once from spectral_features.window_features()
 
 def fft_features(signal, fs):
     if len(signal) < 8:
         return {
             'total_power': 0.0,
             'spectral_centroid': 0.0,
-            **{f'band_{lo}_{hi}Hz': 0.0 for lo, hi in bands}
+            **{f'band_{lo}_{hi}Hz': 0.0 for lo, hi in BANDS}
         }
 
     signal = detrend(signal)
@@ -35,56 +47,79 @@ def fft_features(signal, fs):
         'spectral_centroid': centroid
     }
 
-    for lo, hi in bands:
+    for lo, hi in BANDS:
         features[f'band_{lo}_{hi}Hz'] = np.sum(power[(freqs >= lo) & (freqs < hi)])
 
     return features
 
+def compute_fft_features(df):
+    df = df.copy()
+    df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
+    df.dropna(subset=['datetime'], inplace=True)
+    df.sort_values('datetime', inplace=True)
+
+    df['interval'] = df['datetime'].dt.floor('10s')
+
+    time_deltas = df['datetime'].diff().dt.total_seconds().dropna()
+    fs = 1 / time_deltas.mean() if not time_deltas.empty else 100.0
+
+    if df.empty:
+        return pd.DataFrame()
+    intervals, window_ids = np.unique(df['interval'].to_numpy(), return_inverse=True)
+    columns = {'datetime': intervals}
+    for axis in AXES:
+        if axis in df.columns:
+            features = window_features(df[axis].to_numpy(dtype=float), window_ids, len(intervals), fs, BANDS)
+            for i, name in enumerate(FEATURE_NAMES):
+                columns[f'{axis}_{name}'] = features[:, i]
+    return pd.DataFrame(columns)
+
+def compute_spectrogram_features(df):
+    # Same sample rate estimate as compute_fft_features; windows are counted in samples
+    df = df.copy()
+    df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
+    df.dropna(subset=['datetime'], inplace=True)
+    df.sort_values('datetime', inplace=True)
+
+    time_deltas = df['datetime'].diff().dt.total_seconds().dropna()
+    fs = 1 / time_deltas.mean() if not time_deltas.empty else 100.0
+    window = int(round(SPECTROGRAM_WINDOW_SECONDS * fs))
+    hop = max(1, int(round(SPECTROGRAM_HOP_SECONDS * fs)))
+
+    names = ['total_power', 'spectral_centroid'] + [f'band_{lo}_{hi}Hz' for lo, hi in SPECTROGRAM_BANDS]
+    times = df['datetime'].to_numpy()
+    columns = {}
+    for axis in AXES:
+        if axis in df.columns:
+            starts, features = spectrogram_features(df[axis].to_numpy(dtype=float), fs, window, hop,
+                                                    SPECTROGRAM_TAPER, SPECTROGRAM_BANDS)
+            # Each window is stamped with the time of its centre sample
+            columns.setdefault('datetime', times[starts + window // 2])
+            for i, name in enumerate(names):
+                columns[f'{axis}_{name}'] = features[:, i]
+    return pd.DataFrame(columns)
+
+def process_dataframe(df, reports):
+    if 'datetime' in df.columns:
+        df_axes = df[['datetime'] + [a for a in AXES if a in df.columns]]
+        reports["FFT_Features"] = compute_fft_features(df_axes)
+        if SPECTROGRAM_MODE:
+            reports["Spectrogram_Features"] = compute_spectrogram_features(df_axes)
+    return df
+
+@incremental_stage("14_FFT_feature")
 def process_fft_file(input_path):
-    try:
-        df = pd.read_excel(input_path, sheet_name=0)
-        df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
-        df.dropna(subset=['datetime'], inplace=True)
-        df.sort_values('datetime', inplace=True)
-
-        df['interval'] = df['datetime'].dt.floor('10s')
-
-        time_deltas = df['datetime'].diff().dt.total_seconds().dropna()
-        fs = 1 / time_deltas.mean() if not time_deltas.empty else 100.0
-
-        records = []
-        for interval_time, group in df.groupby('interval'):
-            row = {'datetime': interval_time}
-            for axis in axes:
-                if axis in group.columns:
-                    stats = fft_features(group[axis].dropna().values, fs)
-                    row.update({f'{axis}_{k}': v for k, v in stats.items()})
-            records.append(row)
-
-        fft_df = pd.DataFrame(records)
-
-        # Append to the original file in a new sheet without deleting other sheets
-        wb = load_workbook(input_path)
-        sheet_name = "FFT_Features"
-        if sheet_name in wb.sheetnames:
-            wb.remove(wb[sheet_name])
-        ws = wb.create_sheet(title=sheet_name)
-
-        for r in dataframe_to_rows(fft_df, index=False, header=True):
-            ws.append(r)
-
-        wb.save(input_path)
-        print(f"✅ Embedded FFT features into: {os.path.basename(input_path)}")
-
-    except Exception as e:
-        print(f"❌ Error processing {input_path}: {e}")
-
-def recursive_fft_analysis(root_folder):
-    for dirpath, _, filenames in os.walk(root_folder):
-        for file in filenames:
-            if file.endswith('.xlsx') and not file.endswith('_fft_features_cleaned_10s.xlsx'):
-                full_path = os.path.join(dirpath, file)
-                process_fft_file(full_path)
+    df = load_main(input_path, columns=['datetime'] + AXES, upto="14_FFT_feature")
+    sheets = {"FFT_Features": compute_fft_features(df)}
+    if SPECTROGRAM_MODE:
+        sheets["Spectrogram_Features"] = compute_spectrogram_features(df)
+
+    # Append to the original file in a new sheet without deleting other sheets
+    save_sheets(input_path, sheets)
+    print(f"✅ Embedded FFT features into: {os.path.basename(input_path)}")
+
+def recursive_fft_analysis(root_folder, workers=None):
+    return run_parallel(process_fft_file, iter_inputs(root_folder, exclude_suffixes=('_fft_features_cleaned_10s.xlsx',)), workers=workers)
 
 # === USAGE ===
 if __name__ == "__main__":
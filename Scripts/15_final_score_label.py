@@ -2,147 +2,190 @@ import os
 import pandas as pd
 import numpy as np
 from openpyxl import load_workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.styles import PatternFill
+from columnar_store import has_sheet, iter_inputs, is_store, load_main, load_sheet, save_main
+from manifest import incremental_stage
+from parallel_executor import run_parallel
+from report_writer import replace_sheet
+from score_model import load_model
 
 # === CONFIGURATION ===
+STAGE_VERSION = 1
 bands = [(0, 1), (1, 3), (3, 5), (5, 10)]  # Frequency bands up to 10 Hz
 axes = ['x', 'y', 'z']
-
-def normalize_columns(df, cols):
+SCORE_MODEL_FILE = None    # JSON scoring model from score_model.py; None = normalise and label each capture by itself
+LABELS = ['Healthy', 'Monitor', 'Warning', 'Critical']
+LABEL_QUANTILES = [0.50, 0.75, 0.95]   # Final_score quantiles that separate the labels
+TIME_DOMAIN_WEIGHTS = {'time_series_score': 0.5, 'contextual_score': 0.2, 'temporal_score': 0.2, 'recurrence_score': 0.1}
+FREQUENCY_SOURCE = "fft"   # "fft": 10 s FFT_Features windows; "spectrogram": overlapping Spectrogram_Features windows of 14
+SCORE_COLUMNS = ['rms_score', 'kurt_score', 'time_series_score', 'contextual_score', 'temporal_score',
+                 'recurrence_score', 'time_domain_score', 'time_based_frequency_score', 'Final_score', 'Final_label']
+
+def column_ranges(df, cols):
+    return {col: [float(df[col].min()), float(df[col].max())] for col in cols if df[col].dtype in [float, int]}
+
+def normalize_columns(df, cols, ranges=None):
+    # With fixed ``ranges`` (from a scoring model) values outside them are clipped to 0..1
     df = df.copy()
     for col in cols:
         if df[col].dtype in [float, int]:
-            min_val, max_val = df[col].min(), df[col].max()
+            fixed = ranges is not None and col in ranges
+            min_val, max_val = ranges[col] if fixed else (df[col].min(), df[col].max())
             if max_val != min_val:
                 df[col] = (df[col] - min_val) / (max_val - min_val)
+                if fixed:
+                    df[col] = df[col].clip(0, 1)
             else:
                 df[col] = 0
     return df
 
-def process_excel_file(filepath):
-    try:
-        print(f"Processing: {filepath}")
-
-        # Load main and FFT sheets
-        df_main = pd.read_excel(filepath, sheet_name=0)
-        df_fft = pd.read_excel(filepath, sheet_name='FFT_Features')
-
-        # Preprocessing
-        df_main['datetime'] = pd.to_datetime(df_main['datetime'], errors='coerce')
-        df_fft['interval'] = pd.to_datetime(df_fft['datetime'], errors='coerce')
-        
-        # ✅ FIXED INTERVAL ALIGNMENT (removed +10s shift)
-        df_main['interval'] = df_main['datetime'].dt.floor('10s')
-
-        # --- Time-Domain Score with Weights ---
-        for axis in axes:
-            df_main[f'rms_combined_flag_{axis}'] = df_main[f'rms_combined_flag_{axis}'].astype(int)
-            df_main[f'kurt_combined_flag_{axis}'] = df_main[f'kurt_combined_flag_{axis}'].astype(int)
-
-        df_main['rms_score'] = df_main[[f'rms_combined_flag_{a}' for a in axes]].sum(axis=1) / 3
-        df_main['kurt_score'] = df_main[[f'kurt_combined_flag_{a}' for a in axes]].sum(axis=1) / 3
-        df_main['time_series_score'] = (df_main['rms_score'] + df_main['kurt_score']) / 2
-
-        df_main['contextual_score'] = df_main['final_contextual_score']
-        df_main['temporal_score'] = df_main['temporal_outlier_type'].apply(lambda x: 1 if x == 'Grouped' else 0)
-        max_rec_score = df_main['recurrence_score'].max()
-        df_main['recurrence_score'] = (
-            df_main['recurrence_score'] / max_rec_score if max_rec_score > 0 else 0
-        )
-
-        df_main['time_domain_score'] = (
-            0.5 * df_main['time_series_score'] +
-            0.2 * df_main['contextual_score'] +
-            0.2 * df_main['temporal_score'] +
-            0.1 * df_main['recurrence_score']
-        )
-
-        # --- Frequency Score ---
-        fft_features_cols = []
-        for axis in axes:
-            prefix = f"{axis}_mps2"
-            fft_features_cols += [
-                f'{prefix}_total_power',
-                f'{prefix}_spectral_centroid',
-                f'{prefix}_band_0_1Hz',
-                f'{prefix}_band_1_3Hz',
-                f'{prefix}_band_3_5Hz',
-                f'{prefix}_band_5_10Hz']
-
-        df_fft = normalize_columns(df_fft, fft_features_cols)
-
-        for axis in axes:
-            prefix = f"{axis}_mps2"
-            df_fft[f'{axis}_score'] = df_fft[[ 
-                f'{prefix}_total_power',
-                f'{prefix}_spectral_centroid',
-                f'{prefix}_band_0_1Hz',
-                f'{prefix}_band_1_3Hz',
-                f'{prefix}_band_3_5Hz',
-                f'{prefix}_band_5_10Hz']].mean(axis=1)
-
-        df_fft['frequency_interval_score'] = df_fft[[f'{a}_score' for a in axes]].mean(axis=1)
-
-        # --- Merge Scores ---
+def label_scores(scores, cut_points):
+    # The number of cut-points below a score picks its label; NaN scores stay Healthy
+    values = scores.to_numpy(dtype=float)
+    index = np.searchsorted(np.asarray(cut_points, dtype=float), values, side='left')
+    index[np.isnan(values)] = 0
+    return pd.Series(np.array(LABELS, dtype=object)[index], index=scores.index)
+
+def frequency_features(df_freq):
+    return [c for c in df_freq.columns if any(c.startswith(f'{a}_mps2_') for a in axes)]
+
+def spectrogram_frequency_score(df_main, df_spec, ranges=None):
+    # Normalise every spectrogram feature, average per window and give each row
+    # the score of the window whose centre is nearest in time
+    df_spec = df_spec.copy()
+    df_spec['datetime'] = pd.to_datetime(df_spec['datetime'], errors='coerce')
+    df_spec = df_spec.dropna(subset=['datetime']).sort_values('datetime')
+    feature_cols = frequency_features(df_spec)
+    df_spec = normalize_columns(df_spec, feature_cols, ranges)
+    df_spec['frequency_window_score'] = df_spec[feature_cols].mean(axis=1)
+
+    rows = df_main[['datetime']].reset_index().dropna(subset=['datetime']).sort_values('datetime')
+    if df_spec.empty or rows.empty:
+        return pd.Series(np.nan, index=df_main.index)
+    rows = pd.merge_asof(rows, df_spec[['datetime', 'frequency_window_score']], on='datetime', direction='nearest')
+    return rows.set_index('index')['frequency_window_score'].reindex(df_main.index)
+
+def score_dataframe(df_main, df_fft, df_spec=None, model=None):
+    # A scoring ``model`` fixes the recurrence maximum, feature ranges, weights and
+    # label cut-points, so every row is scored on its own; without it they come
+    # from this capture
+    model = model or {}
+    use_spectrogram = FREQUENCY_SOURCE == "spectrogram" and df_spec is not None
+    if model.get('frequency_source', FREQUENCY_SOURCE) != FREQUENCY_SOURCE:
+        raise ValueError(f"Scoring model was fitted with FREQUENCY_SOURCE = '{model['frequency_source']}'")
+
+    # Preprocessing
+    df_main['datetime'] = pd.to_datetime(df_main['datetime'], errors='coerce')
+    df_fft['interval'] = pd.to_datetime(df_fft['datetime'], errors='coerce')
+    
+    # ✅ FIXED INTERVAL ALIGNMENT (removed +10s shift)
+    df_main['interval'] = df_main['datetime'].dt.floor('10s')
+
+    # --- Time-Domain Score with Weights ---
+    for axis in axes:
+        df_main[f'rms_combined_flag_{axis}'] = df_main[f'rms_combined_flag_{axis}'].astype(int)
+        df_main[f'kurt_combined_flag_{axis}'] = df_main[f'kurt_combined_flag_{axis}'].astype(int)
+
+    df_main['rms_score'] = df_main[[f'rms_combined_flag_{a}' for a in axes]].sum(axis=1) / 3
+    df_main['kurt_score'] = df_main[[f'kurt_combined_flag_{a}' for a in axes]].sum(axis=1) / 3
+    df_main['time_series_score'] = (df_main['rms_score'] + df_main['kurt_score']) / 2
+
+    df_main['contextual_score'] = df_main['final_contextual_score']
+    df_main['temporal_score'] = (df_main['temporal_outlier_type'] == 'Grouped').astype(int)
+    max_rec_score = model.get('recurrence_max', df_main['recurrence_score'].max())
+    df_main['recurrence_score'] = (
+        df_main['recurrence_score'] / max_rec_score if max_rec_score > 0 else 0
+    )
+    if 'recurrence_max' in model:
+        df_main['recurrence_score'] = df_main['recurrence_score'].clip(upper=1)
+
+    weights = model.get('weights', TIME_DOMAIN_WEIGHTS)
+    df_main['time_domain_score'] = sum(w * df_main[col] for col, w in weights.items())
+
+    # --- Frequency Score ---
+    fft_features_cols = []
+    for axis in axes:
+        prefix = f"{axis}_mps2"
+        fft_features_cols += [
+            f'{prefix}_total_power',
+            f'{prefix}_spectral_centroid',
+            f'{prefix}_band_0_1Hz',
+            f'{prefix}_band_1_3Hz',
+            f'{prefix}_band_3_5Hz',
+            f'{prefix}_band_5_10Hz']
+
+    ranges = model.get('feature_ranges')
+    df_fft = normalize_columns(df_fft, fft_features_cols, None if use_spectrogram else ranges)
+
+    for axis in axes:
+        prefix = f"{axis}_mps2"
+        df_fft[f'{axis}_score'] = df_fft[[ 
+            f'{prefix}_total_power',
+            f'{prefix}_spectral_centroid',
+            f'{prefix}_band_0_1Hz',
+            f'{prefix}_band_1_3Hz',
+            f'{prefix}_band_3_5Hz',
+            f'{prefix}_band_5_10Hz']].mean(axis=1)
+
+    df_fft['frequency_interval_score'] = df_fft[[f'{a}_score' for a in axes]].mean(axis=1)
+
+    # --- Merge Scores (dropping the result of an earlier run) ---
+    df_main = df_main.drop(columns=['time_based_frequency_score'], errors='ignore')
+    if use_spectrogram:
+        df_main['time_based_frequency_score'] = spectrogram_frequency_score(df_main, df_spec, ranges)
+    else:
         df_main = df_main.merge(df_fft[['interval', 'frequency_interval_score']], on='interval', how='left')
         df_main.rename(columns={'frequency_interval_score': 'time_based_frequency_score'}, inplace=True)
-        df_main['time_based_frequency_score'] = df_main['time_based_frequency_score'].fillna(0)
-
-        df_main['Final_score'] = (df_main['time_domain_score'] + df_main['time_based_frequency_score']) / 2
-
-        # --- Custom Quantile-Based Labeling ---
-        q2 = df_main['Final_score'].quantile(0.50)
-        q3 = df_main['Final_score'].quantile(0.75)
-        q99 = df_main['Final_score'].quantile(0.95)
-
-        def label_row(score):
-            if score > q99:
-                return 'Critical'
-            elif score > q3:
-                return 'Warning'
-            elif score > q2:
-                return 'Monitor'
-            else:
-                return 'Healthy'
-
-        df_main['Final_label'] = df_main['Final_score'].apply(label_row)
-
-        # === Excel Writing ===
-        wb = load_workbook(filepath)
-        main_sheet = wb.sheetnames[0]
-        wb.remove(wb[main_sheet])
-        ws = wb.create_sheet(main_sheet, 0)
-
-        # Define label colors
-        label_colors = {
-            "Healthy": PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid"),  # Green
-            "Monitor": PatternFill(start_color="FFFCCC", end_color="FFFCCC", fill_type="solid"),  # Yellow
-            "Warning": PatternFill(start_color="FCE4D6", end_color="FCE4D6", fill_type="solid"),  # Orange
-            "Critical": PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")  # Red
-        }
-
-        for i, r in enumerate(dataframe_to_rows(df_main, index=False, header=True)):
-            ws.append(r)
-            if i == 0:
-                label_col_idx = r.index("Final_label") + 1
-            else:
-                label = r[label_col_idx - 1]
-                if label in label_colors:
-                    ws.cell(row=i + 1, column=label_col_idx).fill = label_colors[label]
+    df_main['time_based_frequency_score'] = df_main['time_based_frequency_score'].fillna(0)
+
+    df_main['Final_score'] = (df_main['time_domain_score'] + df_main['time_based_frequency_score']) / 2
+
+    # --- Custom Quantile-Based Labeling ---
+    cut_points = model.get('cut_points') or df_main['Final_score'].quantile(LABEL_QUANTILES).tolist()
+    df_main['Final_label'] = label_scores(df_main['Final_score'], cut_points)
+
+    return df_main
+
+def process_dataframe(df, reports):
+    if "FFT_Features" not in reports:
+        return df
+    df_spec = reports.get("Spectrogram_Features") if FREQUENCY_SOURCE == "spectrogram" else None
+    return score_dataframe(df, reports["FFT_Features"].copy(), df_spec, load_model(SCORE_MODEL_FILE))
+
+def load_inputs(filepath):
+    # Main columns and frequency sheets the scoring reads; a store is read as it
+    # was before this stage, so a re-run sees the raw recurrence_score again
+    columns = (['datetime', 'final_contextual_score', 'temporal_outlier_type', 'recurrence_score'] +
+               [f'{flag}_{a}' for flag in ('rms_combined_flag', 'kurt_combined_flag') for a in axes])
+    df_main = load_main(filepath, columns=columns, upto="15_final_score_label")
+    df_fft = load_sheet(filepath, 'FFT_Features')
+    df_spec = None
+    if FREQUENCY_SOURCE == "spectrogram" and has_sheet(filepath, 'Spectrogram_Features'):
+        df_spec = load_sheet(filepath, 'Spectrogram_Features')
+    return df_main, df_fft, df_spec
+
+@incremental_stage("15_final_score_label")
+def process_excel_file(filepath):
+    print(f"Processing: {filepath}")
+
+    # Load main and FFT sheets
+    df_main, df_fft, df_spec = load_inputs(filepath)
+
+    df_main = score_dataframe(df_main, df_fft, df_spec, load_model(SCORE_MODEL_FILE))
 
-        wb.save(filepath)
+    # Stores keep plain columns; label colours are applied when exporting to Excel
+    if is_store(filepath):
+        save_main(filepath, df_main, "15_final_score_label", columns=SCORE_COLUMNS)
         print(f"✅ Done: Scoring and revised labeling updated in {os.path.basename(filepath)}")
+        return
 
-    except Exception as e:
-        print(f"❌ Error in {filepath}: {e}")
+    # === Excel Writing === (label colours are conditional-format rules on Final_label)
+    wb = load_workbook(filepath)
+    replace_sheet(wb, wb.sheetnames[0], df_main, 0)
+    wb.save(filepath)
+    print(f"✅ Done: Scoring and revised labeling updated in {os.path.basename(filepath)}")
 
-def recursive_scoring_runner(root_folder):
-    for dirpath, _, filenames in os.walk(root_folder):
-        for file in filenames:
-            if file.endswith('.xlsx') and not file.startswith('~$'):
-                filepath = os.path.join(dirpath, file)
-                process_excel_file(filepath)
+def recursive_scoring_runner(root_folder, workers=None):
+    return run_parallel(process_excel_file, iter_inputs(root_folder), workers=workers)
 
 # === USAGE ===
 if __name__ == '__main__':
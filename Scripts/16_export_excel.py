@@ -0,0 +1,22 @@
+import os
+from columnar_store import STORE_SUFFIX, export_to_excel, iter_inputs
+from parallel_executor import run_parallel
+
+# === CONFIGURATION ===
+# Optional last step: turn the capture stores written by stages 01-15 into Excel deliverables
+OUTPUT_SUFFIX = "_scored.xlsx"
+
+def export_store(store_path):
+    excel_path = store_path[:-len(STORE_SUFFIX)] + OUTPUT_SUFFIX
+    export_to_excel(store_path, excel_path)
+    print(f"✅ Exported: {os.path.basename(excel_path)}")
+    return excel_path
+
+def export_folder(root_folder, workers=None):
+    stores = [p for p in iter_inputs(root_folder, suffix=STORE_SUFFIX) if p.endswith(STORE_SUFFIX)]
+    return run_parallel(export_store, stores, workers=workers, label="capture")
+
+# === USAGE ===
+if __name__ == "__main__":
+    root_dir = r"D:\extracted data from JSON file ISI\rerport writing data"
+    export_folder(root_dir)
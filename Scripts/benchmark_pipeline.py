@@ -0,0 +1,191 @@
+import os
+import csv
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from instrumentation import summarize
+from run_pipeline import run_pipeline
+from synthetic_captures import DURATION_SECONDS, generate_dataset
+
+# === CONFIGURATION ===
+SCALES = (1, 10, 100)       # multiples of the current data
+SCALE_BY = "length"         # "length": captures scale x 600 s long; "count": scale x CAPTURES captures of 600 s
+CAPTURES = 2                # captures per scale (before scaling by count)
+WORKERS = 1                 # serial, so the stage times are not shared between captures
+FAULT_PERIOD_SECONDS = 30.0
+SEED = 0
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Reports", "benchmarks")
+REGRESSION_FACTOR = 1.25    # a step this much slower than in the previous result is reported
+MIN_SECONDS = 0.5           # steps faster than this are too noisy to compare
+
+# Benchmark of the whole pipeline on synthetic captures (synthetic_captures.py).
+# Every scale writes a fresh, seeded data set, runs all stages with the
+# runner and keeps the per-step timings of its run report (instrumentation.py):
+# wall and CPU time, rows/s, bytes and peak memory for every stage script and
+# sub-step. Captures are independent and spread over worker processes, so
+# more captures cost linearly more; longer captures are what shows a stage
+# that grows faster than its input, hence SCALE_BY = "length" by default.
+#
+# Each result is saved as Reports/benchmarks/<date>_<commit>.json and its
+# step times are appended to history.csv; a run is compared with the
+# previous result and steps that got more than REGRESSION_FACTOR slower are
+# listed.
+
+
+def code_version():
+    """Commit of the working tree and whether it has uncommitted changes (None outside git)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def run_scale(scale, work_dir, captures=CAPTURES, scale_by=SCALE_BY, plots=True, seed=SEED):
+    """Generate the data set of one scale, run the pipeline on it and return its timings."""
+    if scale_by not in ("length", "count"):
+        raise ValueError(f"Unknown SCALE_BY '{scale_by}'. Choose from: length, count")
+    n_captures = captures * scale if scale_by == "count" else captures
+    duration = DURATION_SECONDS * scale if scale_by == "length" else DURATION_SECONDS
+    raw_dir = os.path.join(work_dir, f"x{scale}", "raw")
+    out_dir = os.path.join(work_dir, f"x{scale}", "out")
+    report = os.path.join(work_dir, f"x{scale}", "run_report.json")
+
+    paths = generate_dataset(raw_dir, n_captures, duration, seed=seed, fault_period_seconds=FAULT_PERIOD_SECONDS)
+    input_mb = sum(os.path.getsize(p) for p in paths) / 1e6
+    print(f"\n🧪 x{scale}: {n_captures} capture(s) of {duration:.0f} s, {input_mb:.0f} MB")
+
+    t0 = time.perf_counter()
+    results = run_pipeline(raw_dir, out_dir, workers=WORKERS, force=True, plots=plots, report=report)
+    wall = time.perf_counter() - t0
+    with open(report, "r") as f:
+        steps = json.load(f)["steps"]
+    shutil.rmtree(os.path.join(work_dir, f"x{scale}"), ignore_errors=True)
+
+    return {
+        "captures": n_captures,
+        "capture_seconds": duration,
+        "rows": sum(s["rows"] or 0 for s in steps if s["step"] == "load"),
+        "input_mb": input_mb,
+        "failed": sum(1 for _, _, error in results if error),
+        "wall_s": wall,
+        "steps": {s.pop("step"): s for s in summarize(steps)},
+    }
+
+
+def previous_result(results_dir, exclude=None):
+    """The most recent stored result other than ``exclude``, or None."""
+    if not os.path.isdir(results_dir):
+        return None
+    names = sorted(f for f in os.listdir(results_dir) if f.endswith(".json") and f != exclude)
+    if not names:
+        return None
+    with open(os.path.join(results_dir, names[-1]), "r") as f:
+        return json.load(f)
+
+
+def compare(previous, current, factor=REGRESSION_FACTOR, min_seconds=MIN_SECONDS):
+    """Steps that got more than ``factor`` slower, as (scale, step, previous s, current s) tuples."""
+    regressions = []
+    for scale, result in current["scales"].items():
+        old = previous.get("scales", {}).get(scale)
+        if not old:
+            continue
+        for step, timing in result["steps"].items():
+            before = old["steps"].get(step, {}).get("wall_s")
+            after = timing["wall_s"]
+            if before and max(before, after) >= min_seconds and after > factor * before:
+                regressions.append((scale, step, before, after))
+    return regressions
+
+
+def append_history(results_dir, result):
+    path = os.path.join(results_dir, "history.csv")
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["date", "commit", "dirty", "scale", "rows", "step", "calls", "wall_s", "cpu_s",
+                             "rows_per_s", "peak_rss_mb"])
+        for scale, timing in result["scales"].items():
+            for step, s in timing["steps"].items():
+                writer.writerow([result["date"], result["commit"], result["dirty"], scale, timing["rows"], step,
+                                 s["calls"], round(s["wall_s"], 4), round(s["cpu_s"], 4),
+                                 round(s["rows_per_s"], 1) if s["rows_per_s"] else "", round(s["peak_rss_mb"], 1)])
+    return path
+
+
+def run_benchmark(scales=SCALES, captures=CAPTURES, scale_by=SCALE_BY, plots=True, work_dir=None,
+                  results_dir=RESULTS_DIR):
+    """Time every stage at each scale, store the result and report regressions against the previous one."""
+    result = {
+        "date": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        **code_version(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {"scale_by": scale_by, "captures": captures, "workers": WORKERS, "plots": plots,
+                     "fault_period_seconds": FAULT_PERIOD_SECONDS, "seed": SEED},
+        "scales": {},
+    }
+    temporary = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    try:
+        for scale in scales:
+            result["scales"][str(scale)] = run_scale(scale, work_dir, captures, scale_by, plots)
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(results_dir, exist_ok=True)
+    name = f"{result['date'].replace(':', '')}_{result['commit'] or 'unknown'}.json"
+    with open(os.path.join(results_dir, name), "w") as f:
+        json.dump(result, f, indent=1)
+    append_history(results_dir, result)
+
+    print("\n📊 Seconds per step (all captures of a scale):")
+    print_table(result)
+    previous = previous_result(results_dir, exclude=name)
+    if previous is not None:
+        regressions = compare(previous, result)
+        label = f"{previous['date']} ({previous.get('commit')})"
+        for scale, step, before, after in regressions:
+            print(f"📈 x{scale} {step}: {before:.2f} s → {after:.2f} s ({after / before:.1f}x slower than {label})")
+        if not regressions:
+            print(f"[✓] No step more than {REGRESSION_FACTOR}x slower than {label}")
+    print(f"📝 Saved: {os.path.join(results_dir, name)}")
+    return result
+
+
+def print_table(result, top=15):
+    scales = list(result["scales"])
+    largest = result["scales"][scales[-1]]["steps"]
+    steps = sorted(largest, key=lambda s: largest[s]["wall_s"], reverse=True)[:top]
+    print(f"{'step':<52}" + "".join(f"{'x' + s:>10}" for s in scales))
+    for step in steps:
+        cells = [result["scales"][s]["steps"].get(step, {}).get("wall_s") for s in scales]
+        print(f"{step:<52}" + "".join(f"{c:10.2f}" if c is not None else f"{'-':>10}" for c in cells))
+    rows = "".join(f"{result['scales'][s]['rows']:>10}" for s in scales)
+    print(f"{'rows':<52}{rows}")
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic captures at several scales.")
+    parser.add_argument("--scales", default=",".join(map(str, SCALES)), help="comma-separated multiples, e.g. 1,10,100")
+    parser.add_argument("--captures", type=int, default=CAPTURES, help="captures per scale")
+    parser.add_argument("--scale-by", choices=["length", "count"], default=SCALE_BY)
+    parser.add_argument("--no-plots", action="store_true", help="skip the plot images")
+    parser.add_argument("--work-dir", help="folder for the generated captures (default: a temporary folder)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    args = parser.parse_args()
+    run_benchmark([int(s) for s in args.scales.split(",")], args.captures, args.scale_by, not args.no_plots,
+                  args.work_dir, args.results_dir)
@@ -0,0 +1,271 @@
+import os
+import re
+import time
+import sqlite3
+import pandas as pd
+from columnar_store import STORE_SUFFIX
+from compact_capture import COMPACT_SUFFIX
+
+# === CONFIGURATION ===
+CATALOG_FILE = "catalog.sqlite"   # default location: inside the raw data root
+# ac1_1712745731__machine-b827ebd4b62c-18e84132d60.json and ac1_1710826680_machine-b827eb7c4700-18e3205f7f7_input.json
+# (or the same names with COMPACT_SUFFIX, see compact_capture.py)
+NAME_PATTERN = re.compile(r"^ac1_(?P<epoch>\d+)_+machine-(?P<machine>[0-9a-fA-F]+)-(?P<sensor>[0-9a-fA-F]+?)"
+                          r"(?:_input)?(?:\.json|" + re.escape(COMPACT_SUFFIX) + r")$")
+
+# Catalog of the raw captures in one SQLite file. The raw layout is
+# <condition>/<component>/ac1_<start epoch>_machine-<machine>-<sensor>.json
+# (or .acz), so a capture's condition, component, machine, sensor id and start
+# time come from its path; sample count and first/last timestamp are read from
+# the file with a byte scan (no parsing; .acz files are decoded).
+# raw_captures() is how the catalog, the sensor archives and the sensor
+# alignment find raw captures. update_catalog() only rescans files whose
+# size or modification time changed and drops files that are gone; with an
+# output root it also records how far each capture got through the pipeline
+# (its manifest against the current stage versions and parameters).
+# query_captures() answers lookups from the indexed table without touching
+# the data folders:
+#
+#   query_captures("Data/Raw", component="Gearbox", condition="Op condition-2",
+#                  start="2024-03-18", end="2024-03-20")
+#
+# Condition names are normalised ("Op condition- 2" -> "Op condition-2").
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    path        TEXT PRIMARY KEY,   -- relative to the catalog root
+    condition   TEXT,
+    component   TEXT,
+    machine     TEXT,
+    sensor      TEXT,
+    start_epoch INTEGER,            -- from the file name (s)
+    first_ms    INTEGER,            -- first and last sample timestamp (epoch ms)
+    last_ms     INTEGER,
+    samples     INTEGER,
+    bytes       INTEGER,
+    mtime       REAL,
+    output      TEXT,               -- processed output, relative to the output root
+    status      TEXT,               -- pending, partial, stale or processed
+    stages_done INTEGER
+);
+CREATE INDEX IF NOT EXISTS captures_by_component ON captures (component, condition, start_epoch);
+CREATE INDEX IF NOT EXISTS captures_by_sensor ON captures (machine, sensor, start_epoch);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def normalize_condition(name):
+    """'Op condition- 2' -> 'Op condition-2': single spaces, none around hyphens."""
+    if name is None:
+        return None
+    return re.sub(r"\s*-\s*", "-", " ".join(name.split()))
+
+
+def parse_capture_path(rel_path):
+    """Catalog fields that come from a capture's path relative to the raw root."""
+    parts = rel_path.split(os.sep)
+    match = NAME_PATTERN.match(parts[-1])
+    return {
+        "path": rel_path,
+        "condition": normalize_condition(parts[-3]) if len(parts) >= 3 else None,
+        "component": parts[-2] if len(parts) >= 2 else None,
+        "machine": match["machine"] if match else None,
+        "sensor": match["sensor"] if match else None,
+        "start_epoch": int(match["epoch"]) if match else None,
+    }
+
+
+_TIMESTAMP = re.compile(rb'\[\s*"?(\d+)')
+
+
+def scan_capture(path):
+    """Sample count and first/last timestamp of a raw capture, from its bytes.
+
+    Every row of the "CSV" payload is one ``[...]`` list, so the rows are the
+    brackets after the payload's own; .acz captures and captures in another
+    layout are parsed with capture_loader.
+    """
+    if path.endswith(COMPACT_SUFFIX):
+        return _load_extent(path)
+    with open(path, "rb") as f:
+        raw = f.read()
+    key = raw.find(b'"CSV"')
+    start = raw.find(b"[", key) if key >= 0 else -1
+    last_row = raw.rfind(b"[")
+    samples = raw.count(b"[", start + 1) if start >= 0 else 0
+    if samples == 0 and start >= 0:
+        return {"samples": 0, "first_ms": None, "last_ms": None}
+    first = _TIMESTAMP.match(raw, raw.find(b"[", start + 1)) if start >= 0 else None
+    last = _TIMESTAMP.match(raw, last_row)
+    if first is None or last is None or raw.count(b"]", start) != samples + 1:
+        return _load_extent(path)
+    return {"samples": samples, "first_ms": int(first.group(1)), "last_ms": int(last.group(1))}
+
+
+def _load_extent(path):
+    from capture_loader import load_capture
+    timestamp = load_capture(path)["timestamp"]
+    return {"samples": len(timestamp), "first_ms": int(timestamp[0]) if len(timestamp) else None,
+            "last_ms": int(timestamp[-1]) if len(timestamp) else None}
+
+
+def catalog_path_for(root, catalog=None):
+    return catalog or os.path.join(root, CATALOG_FILE)
+
+
+def connect(catalog):
+    db = sqlite3.connect(catalog)
+    db.executescript(SCHEMA)
+    return db
+
+
+def one_per_capture(paths):
+    """Drop a .json capture whose .acz conversion sits next to it (same path stem), keeping the order.
+
+    convert_capture() writes <stem>.acz beside <stem>.json by default, and both
+    would otherwise be processed into the same output.
+    """
+    compact = {os.path.splitext(p)[0] for p in paths if p.endswith(COMPACT_SUFFIX)}
+    return [p for p in paths if not (p.endswith(".json") and os.path.splitext(p)[0] in compact)]
+
+
+def raw_captures(root):
+    """Raw captures (JSON or .acz) below ``root`` as paths relative to it.
+
+    Only files named like a capture (NAME_PATTERN) count, so other JSON files
+    (baselines, model files) are skipped; capture stores (.capture folders)
+    are not entered. A capture present as both .json and .acz is listed once,
+    as the .acz.
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.endswith(STORE_SUFFIX))
+        found += [os.path.relpath(os.path.join(dirpath, f), root) for f in sorted(filenames) if NAME_PATTERN.match(f)]
+    return one_per_capture(found)
+
+
+def processing_status(output_path, output_format="capture"):
+    """(status, stages done) of a capture's output, from its manifest.
+
+    "processed": every stage recorded with its current version and parameters,
+    "stale": recorded with other ones, "partial": only some stages, "pending":
+    no output. Input hashes are not checked here; the runner does that.
+    """
+    from manifest import is_stage_current, load_manifest
+    from run_pipeline import STAGES, stage_key, stage_signature
+
+    if not os.path.exists(output_path):
+        return "pending", 0
+    manifest = load_manifest(output_path)
+    scripts = [script for _, names in STAGES for script in names]
+    recorded = [s for s in scripts if stage_key(s) in manifest["stages"]]
+    if len(recorded) < len(scripts):
+        return "partial", len(recorded)
+    current = all(is_stage_current(manifest, stage_key(s), *stage_signature(s)) for s in scripts)
+    return ("processed" if current else "stale"), len(recorded)
+
+
+def update_catalog(root, output_root=None, catalog=None, output_format="capture"):
+    """Add new and changed captures below ``root`` to the catalog and drop deleted ones.
+
+    With ``output_root`` the processing status of every capture is refreshed
+    too. Returns the number of captures scanned.
+    """
+    from run_pipeline import output_path_for
+
+    catalog = catalog_path_for(root, catalog)
+    db = connect(catalog)
+    try:
+        known = {path: (size, mtime) for path, size, mtime in db.execute("SELECT path, bytes, mtime FROM captures")}
+        present = raw_captures(root)
+        gone = set(known) - set(present)
+        db.executemany("DELETE FROM captures WHERE path = ?", [(p,) for p in gone])
+
+        scanned = 0
+        for rel in present:
+            info = os.stat(os.path.join(root, rel))
+            if known.get(rel) == (info.st_size, info.st_mtime):
+                continue
+            row = {**parse_capture_path(rel), **scan_capture(os.path.join(root, rel)),
+                   "bytes": info.st_size, "mtime": info.st_mtime}
+            db.execute("INSERT OR REPLACE INTO captures (path, condition, component, machine, sensor, start_epoch, "
+                       "first_ms, last_ms, samples, bytes, mtime, status, stages_done) VALUES (:path, :condition, "
+                       ":component, :machine, :sensor, :start_epoch, :first_ms, :last_ms, :samples, :bytes, :mtime, "
+                       "'pending', 0)", row)
+            scanned += 1
+
+        if output_root is not None:
+            updates = []
+            for rel in present:
+                output = output_path_for(os.path.join(root, rel), root, output_root, output_format)
+                status, done = processing_status(output, output_format)
+                updates.append((os.path.relpath(output, output_root), status, done, rel))
+            db.executemany("UPDATE captures SET output = ?, status = ?, stages_done = ? WHERE path = ?", updates)
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('output_root', ?)", (os.path.abspath(output_root),))
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (os.path.abspath(root),))
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"🗂️ Catalog {catalog}: {len(present)} capture(s), {scanned} scanned, {len(gone)} removed")
+    return scanned
+
+
+def _epoch(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return int(pd.Timestamp(value).timestamp())
+
+
+def query_captures(root=None, catalog=None, condition=None, component=None, machine=None, sensor=None, start=None,
+                   end=None, status=None):
+    """Captures matching every given field, as a DataFrame sorted by start time.
+
+    ``start``/``end`` (epoch seconds, or anything pd.Timestamp accepts, in
+    UTC) bound the start time from the file name, both inclusive. The
+    ``file`` column is the absolute path of each capture.
+    """
+    filters = {"condition = ?": normalize_condition(condition), "component = ?": component, "machine = ?": machine,
+               "sensor = ?": sensor, "start_epoch >= ?": _epoch(start), "start_epoch <= ?": _epoch(end),
+               "status = ?": status}
+    filters = {clause: value for clause, value in filters.items() if value is not None}
+    where = " AND ".join(filters) or "1"
+    db = sqlite3.connect(catalog_path_for(root, catalog))
+    try:
+        base = db.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+        df = pd.read_sql_query(f"SELECT * FROM captures WHERE {where} ORDER BY start_epoch, path", db,
+                               params=list(filters.values()))
+    finally:
+        db.close()
+    df.insert(0, "file", [os.path.join(base[0] if base else root or "", p) for p in df["path"]])
+    return df
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build and query the catalog of raw captures.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    update = sub.add_parser("update", help="scan new and changed captures")
+    update.add_argument("root", help="raw data root")
+    update.add_argument("--output", help="pipeline output root, to record the processing status")
+    update.add_argument("--format", choices=["capture", "excel"], default="capture")
+    update.add_argument("--catalog", help=f"catalog file (default: <root>/{CATALOG_FILE})")
+    query = sub.add_parser("query", help="list matching captures")
+    query.add_argument("root", help="raw data root")
+    query.add_argument("--catalog", help=f"catalog file (default: <root>/{CATALOG_FILE})")
+    for field in ("condition", "component", "machine", "sensor", "start", "end", "status"):
+        query.add_argument(f"--{field}")
+    args = parser.parse_args()
+
+    if args.command == "update":
+        update_catalog(args.root, args.output, args.catalog, args.format)
+    else:
+        t0 = time.perf_counter()
+        found = query_captures(args.root, args.catalog, args.condition, args.component, args.machine, args.sensor,
+                               args.start, args.end, args.status)
+        ms = (time.perf_counter() - t0) * 1000
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(found[["path", "start_epoch", "samples", "status"]].to_string(index=False))
+        print(f"🔎 {len(found)} capture(s) in {ms:.1f} ms")
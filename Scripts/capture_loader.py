@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+import pandas as pd
+from compact_capture import COMPACT_SUFFIX, read_compact
+
+# === CONFIGURATION ===
+G_TO_MPS2 = 9.80665
+AXES = ['x', 'y', 'z']
+# Everything that is not part of a number in the "CSV" payload
+_PAYLOAD_NOISE = b'[]" \t\r\n'
+
+
+def _parse_payload_fast(raw):
+    """Parse the ``"CSV": [["ts", "x", "y", "z"], ...]`` payload without building Python objects.
+
+    Returns an (n, 4) float64 array, or None when the file does not have the
+    plain layout (other keys after the payload, unexpected tokens), in which
+    case the caller falls back to ``json``.
+    """
+    key = raw.find(b'"CSV"')
+    if key < 0:
+        return None
+    start = raw.find(b'[', key)
+    end = raw.rfind(b']')
+    if start < 0 or end < start:
+        return None
+
+    payload = raw[start:end + 1].translate(None, _PAYLOAD_NOISE)
+    if not payload:
+        return np.empty((0, 4))
+    expected = payload.count(b',') + 1
+    if expected % 4:
+        return None
+
+    try:
+        values = np.array(payload.split(b','), dtype=np.float64)
+    except ValueError:
+        return None
+    return values.reshape(-1, 4)
+
+
+def _parse_payload_json(raw):
+    data = json.loads(raw)
+    return np.asarray(data['CSV'], dtype=np.float64).reshape(-1, 4)
+
+
+def load_capture(json_path):
+    """Load one raw capture (JSON, or the compact .acz format) into typed NumPy arrays.
+
+    Returns a dict with ``timestamp`` (int64 epoch ms), ``datetime``
+    (datetime64[ms]), ``x``/``y``/``z`` (g), ``x_mps2``/``y_mps2``/``z_mps2``
+    and a ``stats`` entry with the file size, row count and parse throughput.
+    """
+    t0 = time.perf_counter()
+    if json_path.endswith(COMPACT_SUFFIX):
+        columns = read_compact(json_path)
+        size = os.path.getsize(json_path)
+    else:
+        with open(json_path, 'rb') as f:
+            raw = f.read()
+        size = len(raw)
+
+        table = _parse_payload_fast(raw)
+        if table is None:
+            table = _parse_payload_json(raw)
+        # Epoch-ms values have 13 digits, well inside the exact float64 integer range
+        columns = {'timestamp': table[:, 0].astype(np.int64)}
+        columns.update({axis: np.ascontiguousarray(table[:, i]) for i, axis in enumerate(AXES, start=1)})
+
+    timestamp = columns['timestamp']
+    capture = {
+        'timestamp': timestamp,
+        'datetime': timestamp.astype('datetime64[ms]'),
+    }
+    for axis in AXES:
+        capture[axis] = columns[axis]
+        capture[f'{axis}_mps2'] = capture[axis] * G_TO_MPS2
+
+    elapsed = time.perf_counter() - t0
+    capture['stats'] = {
+        'path': json_path,
+        'bytes': size,
+        'rows': len(timestamp),
+        'seconds': elapsed,
+        'mb_per_s': size / 1e6 / elapsed if elapsed > 0 else float('inf'),
+    }
+    return capture
+
+
+def capture_to_dataframe(capture):
+    """DataFrame with the columns stages 01-03 used to produce."""
+    columns = ['timestamp'] + AXES + ['datetime'] + [f'{axis}_mps2' for axis in AXES]
+    return pd.DataFrame({col: capture[col] for col in columns})
+
+
+def parse_throughput(paths):
+    """Aggregate parse throughput over several captures (MB/s)."""
+    total_bytes = 0
+    total_seconds = 0.0
+    total_rows = 0
+    for path in paths:
+        stats = load_capture(path)['stats']
+        total_bytes += stats['bytes']
+        total_seconds += stats['seconds']
+        total_rows += stats['rows']
+    return {
+        'files': len(paths),
+        'bytes': total_bytes,
+        'rows': total_rows,
+        'seconds': total_seconds,
+        'mb_per_s': total_bytes / 1e6 / total_seconds if total_seconds > 0 else float('inf'),
+    }
+
+
+def compare_with_json_load(paths):
+    """Throughput of this loader next to the old json.load + DataFrame path."""
+    t0 = time.perf_counter()
+    for path in paths:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        pd.DataFrame(data['CSV'], columns=['timestamp', 'x', 'y', 'z']).apply(pd.to_numeric)
+    json_seconds = time.perf_counter() - t0
+
+    fast = parse_throughput(paths)
+    json_mb_per_s = fast['bytes'] / 1e6 / json_seconds if json_seconds > 0 else float('inf')
+    return {'loader_mb_per_s': fast['mb_per_s'], 'json_mb_per_s': json_mb_per_s,
+            'speedup': fast['mb_per_s'] / json_mb_per_s if json_mb_per_s > 0 else float('inf')}
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'Data', 'Raw')
+    json_paths = sorted(os.path.join(d, f) for d, _, files in os.walk(root) for f in files if f.endswith('.json'))
+    result = compare_with_json_load(json_paths)
+    print(f"📦 {len(json_paths)} capture(s)")
+    print(f"⚡ Loader:    {result['loader_mb_per_s']:.1f} MB/s")
+    print(f"🐢 json.load: {result['json_mb_per_s']:.1f} MB/s")
+    print(f"[✓] Speedup: {result['speedup']:.1f}x")
@@ -0,0 +1,331 @@
+import os
+import shutil
+import functools
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+from instrumentation import timed
+from report_writer import replace_image_sheet, replace_sheet, write_workbook
+
+# === CONFIGURATION ===
+STORE_SUFFIX = ".capture"
+COLUMNS_DIR = "columns"
+SHEETS_DIR = "sheets"
+IMAGES_DIR = "images"
+NA_MARKERS = ["N.A.", "NA", "n.a.", "na"]
+MAIN_SHEET = "Sheet1"
+
+# A capture store is a directory holding one Parquet file per stage:
+#
+#   <capture>.capture/
+#       columns/01_convert_json_to_excel.parquet   <- columns written by stage 01
+#       columns/08_time_series.parquet             <- columns written by stage 08
+#       sheets/RollingStats_Report.parquet         <- side reports (former extra sheets)
+#       images/Plots_0.png
+#
+# Stages append their output columns as a new file instead of rewriting the
+# whole table, and read back only the columns they need. When two stages write
+# the same column (e.g. 07 overwriting x_mps2 with imputed values) the file of
+# the later stage wins. "Later" is the runner's order (run_pipeline.STAGES,
+# where 06 runs before 05), see stage_order().
+
+
+def is_store(path):
+    return str(path).endswith(STORE_SUFFIX) and os.path.isdir(path)
+
+
+def store_path_for(path):
+    """Return the store directory that corresponds to a JSON/Excel capture path."""
+    base = os.path.splitext(str(path))[0]
+    return base + STORE_SUFFIX
+
+
+def _typed(df):
+    """Coerce object columns to float/int64/bool where the content allows it."""
+    df = df.reset_index(drop=True).copy()
+    for col in df.columns:
+        if df[col].dtype != object and not pd.api.types.is_string_dtype(df[col]):
+            continue
+        values = df[col].replace(NA_MARKERS, np.nan)
+        if values.notna().any() and values.map(lambda v: isinstance(v, (bool, np.bool_)) or pd.isna(v)).all():
+            df[col] = values.astype("boolean") if values.isna().any() else values.astype(bool)
+            continue
+        if values.notna().any() and values.map(lambda v: isinstance(v, (pd.Timestamp, datetime)) or pd.isna(v)).all():
+            df[col] = pd.to_datetime(values)
+            continue
+        try:
+            df[col] = pd.to_numeric(values)
+        except (ValueError, TypeError):
+            df[col] = values.astype(str).where(values.notna(), None)
+    return df
+
+
+@functools.lru_cache(maxsize=1)
+def _runner_slots():
+    from run_pipeline import INGEST_SCRIPT, STAGES, stage_key
+    keys = [stage_key(INGEST_SCRIPT)] + [stage_key(s) for _, scripts in STAGES for s in scripts]
+    return dict(zip(keys, sorted(keys)))
+
+
+def stage_order(stage):
+    """Sort key of a stage's column file that follows the order the runner runs the stages in.
+
+    A runner stage takes the name that sorts into its place in run_pipeline.STAGES
+    (06 runs before 05, so 06 sorts as 05 and 05 as 06); column files of other
+    stages (the aligned table, stand-alone scripts) sort by their own name.
+    """
+    return _runner_slots().get(stage, stage)
+
+
+def _stage_files(store_path, upto=None):
+    folder = os.path.join(store_path, COLUMNS_DIR)
+    if not os.path.isdir(folder):
+        return []
+    files = sorted((f for f in os.listdir(folder) if f.endswith(".parquet")),
+                   key=lambda f: stage_order(os.path.splitext(f)[0]))
+    if upto is not None:
+        files = [f for f in files if stage_order(os.path.splitext(f)[0]) < stage_order(upto)]
+    return [os.path.join(folder, f) for f in files]
+
+
+def list_columns(store_path, upto=None):
+    """Map every column of the main table to the stage file that currently owns it.
+
+    ``upto`` restricts the view to the stages that run before it, which gives
+    the table as it looked before that stage ran.
+    """
+    owners = {}
+    for file in _stage_files(store_path, upto):
+        for name in pq.read_schema(file).names:
+            owners.pop(name, None)
+            owners[name] = file
+    return owners
+
+
+def create_store(store_path, df, stage):
+    """Start a new store from the ingest stage output, replacing any previous one."""
+    if os.path.isdir(store_path):
+        shutil.rmtree(store_path)
+    os.makedirs(os.path.join(store_path, COLUMNS_DIR))
+    append_columns(store_path, stage, df)
+    return store_path
+
+
+def append_columns(store_path, stage, df, columns=None):
+    """Write the given columns of ``df`` as the output file of ``stage``."""
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    table = pa.Table.from_pandas(_typed(df), preserve_index=False)
+    os.makedirs(os.path.join(store_path, COLUMNS_DIR), exist_ok=True)
+    pq.write_table(table, os.path.join(store_path, COLUMNS_DIR, f"{stage}.parquet"))
+
+
+def drop_stages(store_path, stages):
+    """Remove the column files of ``stages`` (e.g. before they are recomputed)."""
+    for stage in stages:
+        file = os.path.join(store_path, COLUMNS_DIR, f"{stage}.parquet")
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def read_columns(store_path, columns=None, upto=None):
+    """Read the main table, loading only ``columns`` when given.
+
+    Requested columns that no stage has written yet are silently left out so
+    callers can keep their usual ``'col' in df.columns`` checks.
+    """
+    owners = list_columns(store_path, upto)
+    wanted = list(owners) if columns is None else [c for c in columns if c in owners]
+
+    by_file = {}
+    for col in wanted:
+        by_file.setdefault(owners[col], []).append(col)
+
+    parts = [pq.read_table(file, columns=cols).to_pandas() for file, cols in by_file.items()]
+    if not parts:
+        return pd.DataFrame()
+    df = pd.concat(parts, axis=1)
+    return df[wanted]
+
+
+def write_sheet(store_path, sheet_name, df):
+    os.makedirs(os.path.join(store_path, SHEETS_DIR), exist_ok=True)
+    table = pa.Table.from_pandas(_typed(df), preserve_index=False)
+    pq.write_table(table, os.path.join(store_path, SHEETS_DIR, f"{sheet_name}.parquet"))
+
+
+def remove_sheet(store_path, sheet_name):
+    file = os.path.join(store_path, SHEETS_DIR, f"{sheet_name}.parquet")
+    if os.path.exists(file):
+        os.remove(file)
+
+
+def read_sheet(store_path, sheet_name, columns=None):
+    return pq.read_table(os.path.join(store_path, SHEETS_DIR, f"{sheet_name}.parquet"), columns=columns).to_pandas()
+
+
+def list_sheets(store_path):
+    folder = os.path.join(store_path, SHEETS_DIR)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(folder) if f.endswith(".parquet"))
+
+
+def write_images(store_path, sheet_name, buffers):
+    folder = os.path.join(store_path, IMAGES_DIR)
+    os.makedirs(folder, exist_ok=True)
+    for old in os.listdir(folder):
+        if old.startswith(f"{sheet_name}_"):
+            os.remove(os.path.join(folder, old))
+    for i, buf in enumerate(buffers):
+        buf.seek(0)
+        with open(os.path.join(folder, f"{sheet_name}_{i}.png"), "wb") as f:
+            f.write(buf.read())
+
+
+def read_images(store_path):
+    """Return {sheet_name: [BytesIO, ...]} for all images stored with the capture."""
+    folder = os.path.join(store_path, IMAGES_DIR)
+    images = {}
+    if not os.path.isdir(folder):
+        return images
+    for file in sorted(os.listdir(folder)):
+        sheet_name = file.rsplit("_", 1)[0]
+        with open(os.path.join(folder, file), "rb") as f:
+            images.setdefault(sheet_name, []).append(BytesIO(f.read()))
+    return images
+
+
+def write_capture(store_path, stage_frames, sheets=None, images=None, base_store=None, replace_stages=()):
+    """Write a whole in-memory pipeline result in one pass.
+
+    ``stage_frames`` maps stage names to the columns each stage produced. When
+    ``base_store`` is given its files are kept (copied if it lives elsewhere),
+    except those of ``replace_stages``, and the new stage files are added on
+    top; otherwise the store starts empty.
+    """
+    if base_store is None:
+        if os.path.isdir(store_path):
+            shutil.rmtree(store_path)
+    elif os.path.abspath(base_store) != os.path.abspath(store_path):
+        if os.path.isdir(store_path):
+            shutil.rmtree(store_path)
+        shutil.copytree(base_store, store_path)
+    drop_stages(store_path, replace_stages)
+
+    for stage, df in stage_frames.items():
+        append_columns(store_path, stage, df)
+    for name, df in (sheets or {}).items():
+        if df is None:
+            remove_sheet(store_path, name)
+        else:
+            write_sheet(store_path, name, df)
+    for name, buffers in (images or {}).items():
+        write_images(store_path, name, buffers)
+    return store_path
+
+
+# === Format-independent helpers used by the stage scripts ===
+
+@timed("load")
+def load_main(path, columns=None, upto=None):
+    """Load the main table of a capture store or Excel workbook.
+
+    For stores only ``columns`` are read, and with ``upto`` (a stage key) only
+    the stages before it, so a stage re-run reads its inputs rather than its
+    own previous output. Workbooks are always read in full because their main
+    sheet is rewritten as a whole.
+    """
+    if is_store(path):
+        return read_columns(path, columns, upto)
+    return pd.read_excel(path, sheet_name=0)
+
+
+@timed("save")
+def save_main(path, df, stage, columns=None):
+    """Persist a stage's result: append ``columns`` to a store, or rewrite the main sheet."""
+    if is_store(path):
+        append_columns(path, stage, df, columns)
+        return
+
+    wb = load_workbook(path)
+    replace_sheet(wb, wb.sheetnames[0], df, 0)
+    wb.save(path)
+
+
+def load_sheet(path, sheet_name):
+    if is_store(path):
+        return read_sheet(path, sheet_name)
+    return pd.read_excel(path, sheet_name=sheet_name)
+
+
+def has_sheet(path, sheet_name):
+    if is_store(path):
+        return sheet_name in list_sheets(path)
+    with pd.ExcelFile(path) as xls:
+        return sheet_name in xls.sheet_names
+
+
+@timed("save-sheets")
+def save_sheets(path, sheets):
+    """Add or replace side report sheets ({name: DataFrame}); a None value removes the sheet."""
+    if is_store(path):
+        for name, df in sheets.items():
+            if df is None:
+                remove_sheet(path, name)
+            else:
+                write_sheet(path, name, df)
+        return
+
+    wb = load_workbook(path)
+    for name, df in sheets.items():
+        if df is None:
+            if name in wb.sheetnames:
+                wb.remove(wb[name])
+        else:
+            replace_sheet(wb, name, df)
+    wb.save(path)
+
+
+@timed("save-images")
+def save_images(path, sheet_name, buffers):
+    """Embed PNG buffers in a sheet (Excel) or keep them next to the store."""
+    if is_store(path):
+        write_images(path, sheet_name, buffers)
+        return
+
+    wb = load_workbook(path)
+    replace_image_sheet(wb, sheet_name, buffers)
+    wb.save(path)
+
+
+def iter_inputs(root_folder, suffix=".xlsx", exclude_suffixes=()):
+    """Yield capture stores and Excel files (matching ``suffix``) below ``root_folder``."""
+    for dirpath, dirnames, filenames in os.walk(root_folder):
+        for d in sorted(dirnames):
+            if d.endswith(STORE_SUFFIX):
+                yield os.path.join(dirpath, d)
+        dirnames[:] = sorted(d for d in dirnames if not d.endswith(STORE_SUFFIX))
+        for file in sorted(filenames):
+            if file.endswith(suffix) and not file.startswith("~$") and not file.endswith(tuple(exclude_suffixes)):
+                yield os.path.join(dirpath, file)
+
+
+# === Optional Excel export at the end of the pipeline ===
+
+def write_excel(excel_path, df, sheets=None, images=None):
+    """Write a main table plus report sheets ({name: DataFrame}) and images ({sheet: [BytesIO]}) in one save."""
+    return write_workbook(excel_path, {MAIN_SHEET: df, **(sheets or {})}, images)
+
+
+def export_to_excel(store_path, excel_path=None):
+    """Write the full store (main table, report sheets, images) to one workbook."""
+    if excel_path is None:
+        excel_path = store_path[:-len(STORE_SUFFIX)] + ".xlsx"
+
+    sheets = {name: read_sheet(store_path, name) for name in list_sheets(store_path)}
+    return write_excel(excel_path, read_columns(store_path), sheets, read_images(store_path))
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import zlib
+import struct
+import numpy as np
+
+# === CONFIGURATION ===
+COMPACT_SUFFIX = ".acz"
+CODEC = "zstd"      # a pyarrow codec (zstd, lz4, brotli, ...) or "zlib" (standard library)
+LEVEL = 3
+DECIMALS = 6        # the sensor writes x/y/z with 6 decimals (1e-6 g)
+MAGIC = b"ACZ1"
+
+# Compact binary format for raw captures. A .acz file is MAGIC, the length
+# of a JSON header (uint32, little-endian), the header, then one compressed
+# block per column:
+#
+#   timestamp  "delta": first value in the header, then the differences
+#   x, y, z    "fixed": the values times 10**DECIMALS as integers
+#
+# Integers are stored in the smallest type that holds them (the deltas of a
+# capture fit int8/int16, the axes int32) and byte-shuffled, so the
+# compressor sees all high bytes together, then all low bytes. Decoding is
+# a decompress, a cumsum and a division per column. A value divided back by
+# 10**DECIMALS is the float that parsing the JSON string gives (IEEE
+# division is correctly rounded); a column that does not come back exactly
+# is stored as float64 instead, so the format is always lossless.
+# capture_loader.load_capture() reads .acz files like JSON captures.
+
+
+def _smallest_int(values):
+    if not len(values):
+        return np.dtype(np.int8)
+    lo, hi = int(values.min()), int(values.max())
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dtype)
+
+
+def _shuffle(values):
+    return np.ascontiguousarray(values.view(np.uint8).reshape(-1, values.itemsize).T).tobytes()
+
+
+def _unshuffle(data, dtype, rows):
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, rows)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(rows)
+
+
+def _compress(data, codec, level):
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    import pyarrow as pa
+    level = level if pa.Codec.supports_compression_level(codec) else None
+    return pa.Codec(codec, compression_level=level).compress(data, asbytes=True)
+
+
+def _decompress(data, size, codec):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    import pyarrow as pa
+    return pa.decompress(data, decompressed_size=size, codec=codec, asbytes=True)
+
+
+def fixed_point(values, decimals=DECIMALS):
+    """``values`` as integers in units of 10**-decimals, or None when that is not exact."""
+    scaled = np.round(values * 10.0 ** decimals)
+    if not np.all(np.isfinite(scaled)) or np.abs(scaled).max(initial=0) >= 2 ** 62:
+        return None
+    ints = scaled.astype(np.int64)
+    if not np.array_equal(ints / 10.0 ** decimals, values):
+        return None
+    return ints
+
+
+def _encode_column(name, values, codec, level):
+    if name == "timestamp":
+        ints, entry = np.diff(values), {"encoding": "delta", "first": int(values[0]) if len(values) else 0}
+    else:
+        ints = fixed_point(values)
+        entry = {"encoding": "fixed", "decimals": DECIMALS}
+        if ints is None:
+            ints, entry = values.astype(np.float64), {"encoding": "raw"}
+    stored = ints.astype(_smallest_int(ints)) if entry["encoding"] != "raw" else ints
+    block = _compress(_shuffle(stored), codec, level)
+    return {"name": name, "dtype": stored.dtype.str, "count": len(stored), **entry, "bytes": len(block)}, block
+
+
+def write_compact(path, timestamp, x, y, z, codec=CODEC, level=LEVEL):
+    """Write a capture (int64 epoch-ms timestamps, x/y/z in g) as a .acz file."""
+    columns, blocks = [], []
+    for name, values in (("timestamp", np.asarray(timestamp, dtype=np.int64)), ("x", x), ("y", y), ("z", z)):
+        entry, block = _encode_column(name, np.asarray(values), codec, level)
+        columns.append(entry)
+        blocks.append(block)
+    header = json.dumps({"rows": len(timestamp), "codec": codec, "columns": columns}).encode()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_compact(path):
+    """{"timestamp": int64, "x"/"y"/"z": float64 in g} of a .acz file."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if raw[:4] != MAGIC:
+        raise ValueError(f"{path} is not a compact capture (bad magic)")
+    (header_len,) = struct.unpack_from("<I", raw, 4)
+    header = json.loads(raw[8:8 + header_len])
+    rows, offset = header["rows"], 8 + header_len
+    out = {}
+    for entry in header["columns"]:
+        dtype = np.dtype(entry["dtype"])
+        data = _decompress(raw[offset:offset + entry["bytes"]], entry["count"] * dtype.itemsize, header["codec"])
+        offset += entry["bytes"]
+        values = _unshuffle(data, dtype, entry["count"])
+        if entry["encoding"] == "delta":
+            timestamp = np.empty(rows, dtype=np.int64)
+            if rows:
+                timestamp[0] = entry["first"]
+                np.cumsum(values, out=timestamp[1:])
+                timestamp[1:] += entry["first"]
+            out[entry["name"]] = timestamp
+        elif entry["encoding"] == "fixed":
+            out[entry["name"]] = values / 10.0 ** entry["decimals"]
+        else:
+            out[entry["name"]] = values.astype(np.float64)
+    return out
+
+
+def compact_path_for(json_path):
+    return os.path.splitext(json_path)[0] + COMPACT_SUFFIX
+
+
+def convert_capture(json_path, out_path=None, codec=CODEC, level=LEVEL):
+    """Convert one JSON capture and check that it decodes to exactly the JSON values."""
+    from capture_loader import load_capture
+    out_path = out_path or compact_path_for(json_path)
+    capture = load_capture(json_path)
+    write_compact(out_path, capture["timestamp"], capture["x"], capture["y"], capture["z"], codec, level)
+    decoded = read_compact(out_path)
+    for name in ("timestamp", "x", "y", "z"):
+        if not np.array_equal(decoded[name], capture[name]):
+            raise ValueError(f"{out_path}: column '{name}' does not round-trip")
+    return out_path
+
+
+def convert_tree(raw_root, out_root, codec=CODEC, level=LEVEL):
+    """Convert every JSON capture below ``raw_root`` into the same layout below ``out_root``."""
+    from capture_catalog import raw_captures
+    converted = []
+    for rel in raw_captures(raw_root):
+        if rel.endswith(".json"):
+            out_path = compact_path_for(os.path.join(out_root, rel))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            converted.append(convert_capture(os.path.join(raw_root, rel), out_path, codec, level))
+    print(f"🗜️ Converted {len(converted)} capture(s) to {out_root}")
+    return converted
+
+
+def benchmark(json_paths, codecs=("zstd", "lz4", "zlib")):
+    """Size and decode speed of each codec against json.load and the JSON loader, for the given captures."""
+    import tempfile
+    from capture_loader import _parse_payload_fast
+
+    json_bytes = sum(os.path.getsize(p) for p in json_paths)
+    t0 = time.perf_counter()
+    for path in json_paths:
+        with open(path, "r") as f:
+            np.asarray(json.load(f)["CSV"], dtype=np.float64)
+    json_load = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for path in json_paths:
+        with open(path, "rb") as f:
+            table = _parse_payload_fast(f.read())
+    rows = len(table) if table is not None else 0
+    fast = time.perf_counter() - t0
+
+    print(f"📦 {len(json_paths)} capture(s), {json_bytes / 1e6:.1f} MB of JSON ({rows} rows in the last one)")
+    print(f"🐢 json.load + np.asarray: {json_load:6.2f} s")
+    print(f"⚡ JSON loader:            {fast:6.2f} s")
+    results = {"json_mb": json_bytes / 1e6, "json_load_s": json_load, "loader_s": fast}
+    with tempfile.TemporaryDirectory() as folder:
+        for codec in codecs:
+            paths = [convert_capture(p, os.path.join(folder, f"{i}{COMPACT_SUFFIX}"), codec=codec)
+                     for i, p in enumerate(json_paths)]
+            size = sum(os.path.getsize(p) for p in paths)
+            t0 = time.perf_counter()
+            for path in paths:
+                read_compact(path)
+            seconds = time.perf_counter() - t0
+            results[codec] = {"mb": size / 1e6, "decode_s": seconds}
+            print(f"🗜️ {codec:<5} {size / 1e6:7.2f} MB ({json_bytes / size:5.1f}x smaller), decode {seconds:6.3f} s "
+                  f"({json_load / seconds:5.0f}x json.load, {fast / seconds:4.0f}x JSON loader)")
+    return results
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+
+    # python compact_capture.py <raw root>               size and decode benchmark
+    # python compact_capture.py <raw root> <out root>    convert every capture
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "Data", "Raw")
+    if len(sys.argv) > 2:
+        convert_tree(root, sys.argv[2])
+    else:
+        benchmark(sorted(os.path.join(d, f) for d, _, files in os.walk(root) for f in files if f.endswith(".json")))
@@ -0,0 +1,194 @@
+import os
+import sys
+import csv
+import json
+import time
+import cProfile
+import pstats
+import functools
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# === CONFIGURATION ===
+ENABLED = True
+PROFILER = "cprofile"   # "cprofile" (deterministic) or "pyinstrument" (sampling, optional dependency)
+PROFILE_TOP = 30        # functions listed in the text summary written next to every profile
+
+# Timing of stages and the steps inside them. step() measures a block and
+# records wall time, CPU time, rows/s, bytes read and written (from
+# /proc/self/io, Linux only) and the peak resident memory of the process so
+# far (not on Windows, where the resource module is missing). Steps nest, so a record is named by its path, e.g.
+# "10_outlier_detection_z-score/plots". Records are only kept inside
+# collect(), which run_parallel() opens around every capture: each
+# FileResult carries the steps of its capture, and write_run_report() turns
+# them into a JSON or CSV run report. Outside collect() a step costs two
+# clock reads, so library code can stay decorated.
+#
+# profiled() runs a block under cProfile (or pyinstrument) and writes the
+# profile plus a text summary sorted by cumulative time; the runner does this
+# for the stages given with --profile.
+
+_records = None
+_stack = []
+
+
+def io_counters():
+    """(bytes read, bytes written) by this process so far, or (None, None) where /proc/self/io is missing."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far in MB, or None where the resource module is missing."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@contextmanager
+def collect():
+    """Keep the records of every step run inside the block; yields the list they are added to."""
+    global _records
+    previous, _records = _records, []
+    try:
+        yield _records
+    finally:
+        _records = previous
+
+
+@contextmanager
+def step(name, rows=None):
+    """Measure the block as step ``name``; the yielded dict may get ``rows`` set later."""
+    record = {"step": "/".join(_stack + [name]), "rows": rows}
+    if _records is None or not ENABLED:
+        yield record
+        return
+    records = _records
+    _stack.append(name)
+    read0, written0 = io_counters()
+    t0, c0 = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - t0
+        cpu = time.process_time() - c0
+        read1, written1 = io_counters()
+        _stack.pop()
+        rows = record["rows"]
+        record.update({
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "rows_per_s": rows / wall if rows and wall > 0 else None,
+            "read_bytes": read1 - read0 if read0 is not None else None,
+            "written_bytes": written1 - written0 if written0 is not None else None,
+            "peak_rss_mb": peak_rss_mb(),
+        })
+        records.append(record)
+
+
+def _row_count(obj):
+    if hasattr(obj, "__len__") and not isinstance(obj, (str, bytes, os.PathLike, tuple, list, dict)):
+        return len(obj)
+    return None
+
+
+def timed(name):
+    """Decorator: run the function as step ``name``.
+
+    Rows are the length of the first positional DataFrame or array, or of the
+    returned DataFrame when there is none (e.g. a loader that takes a path).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows = next((n for n in map(_row_count, args) if n is not None), None)
+            with step(name, rows) as record:
+                result = func(*args, **kwargs)
+                if record["rows"] is None and hasattr(result, "columns"):
+                    record["rows"] = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profiled(path, profiler=None):
+    """Profile the block and write ``path`` (.prof, or .html for pyinstrument) plus a .txt summary."""
+    profiler = profiler or PROFILER
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    base = os.path.splitext(path)[0]
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("PROFILER = 'pyinstrument' needs the pyinstrument package (pip install pyinstrument)")
+        sampler = Profiler()
+        sampler.start()
+        try:
+            yield sampler
+        finally:
+            sampler.stop()
+            with open(base + ".html", "w") as f:
+                f.write(sampler.output_html())
+            with open(base + ".txt", "w") as f:
+                f.write(sampler.output_text())
+        return
+    if profiler != "cprofile":
+        raise ValueError(f"Unknown profiler '{profiler}'. Choose from: cprofile, pyinstrument")
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(base + ".prof")
+        with open(base + ".txt", "w") as f:
+            pstats.Stats(profile, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+
+def summarize(records):
+    """One row per step name: calls, summed times, rows and bytes, overall rows/s and the largest peak RSS."""
+    summary = {}
+    for r in records:
+        s = summary.setdefault(r["step"], {"step": r["step"], "calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "rows": 0,
+                                           "read_bytes": 0, "written_bytes": 0, "peak_rss_mb": 0.0})
+        s["calls"] += 1
+        for key in ("wall_s", "cpu_s", "rows", "read_bytes", "written_bytes"):
+            s[key] += r.get(key) or 0
+        s["peak_rss_mb"] = max(s["peak_rss_mb"], r.get("peak_rss_mb") or 0.0)
+    for s in summary.values():
+        s["rows_per_s"] = s["rows"] / s["wall_s"] if s["rows"] and s["wall_s"] > 0 else None
+    return sorted(summary.values(), key=lambda s: s["wall_s"], reverse=True)
+
+
+def write_run_report(path, records):
+    """Write the step records to ``path``: CSV for a .csv name, otherwise JSON with a per-step summary."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.lower().endswith(".csv"):
+        fields = ["capture", "step", "wall_s", "cpu_s", "rows", "rows_per_s", "read_bytes", "written_bytes",
+                  "peak_rss_mb"]
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(path, "w") as f:
+            json.dump({"summary": summarize(records), "steps": records}, f, indent=1)
+    return path
+
+
+def print_summary(records, top=10):
+    """Print the ``top`` steps by total wall time."""
+    for s in summarize(records)[:top]:
+        rate = f"{s['rows_per_s']:,.0f} rows/s" if s["rows_per_s"] else ""
+        print(f"⏱️ {s['step']:<55} {s['wall_s']:8.2f} s wall {s['cpu_s']:8.2f} s CPU  {rate}")
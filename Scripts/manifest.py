@@ -0,0 +1,149 @@
+import os
+import json
+import hashlib
+import functools
+from columnar_store import COLUMNS_DIR, is_store, stage_order
+from instrumentation import step
+
+# === CONFIGURATION ===
+MANIFEST_FILE = "manifest.json"      # inside a capture store
+SIDECAR_SUFFIX = ".manifest"         # next to an Excel workbook
+HASH_CHUNK = 1 << 20
+
+# Every capture keeps a small manifest of the stages already applied to it:
+#
+#   {"source_hash": "...",                       <- raw input the capture came from
+#    "stages": {"08_time_series": {"version": 1,
+#                                  "params": {"WINDOW_SIZE": 51, ...},
+#                                  "input_hash": "..."}}}
+#
+# For a capture store ``input_hash`` covers the column files of all earlier
+# stages, so appending later stages never invalidates an earlier one. A stage is
+# skipped on re-run when its version, parameters and input hash are unchanged.
+
+
+def manifest_path_for(path):
+    if is_store(path):
+        return os.path.join(path, MANIFEST_FILE)
+    return str(path) + SIDECAR_SUFFIX
+
+
+def load_manifest(path):
+    manifest_path = manifest_path_for(path)
+    if not os.path.exists(manifest_path):
+        return {"stages": {}}
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    manifest.setdefault("stages", {})
+    return manifest
+
+
+def save_manifest(path, manifest):
+    manifest_path = manifest_path_for(path)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_file_hashes(store_path):
+    """Content hash of every stage column file: {stage: sha256}."""
+    folder = os.path.join(store_path, COLUMNS_DIR)
+    if not os.path.isdir(folder):
+        return {}
+    return {os.path.splitext(f)[0]: hash_file(os.path.join(folder, f))
+            for f in sorted(os.listdir(folder)) if f.endswith(".parquet")}
+
+
+def inputs_hash(file_hashes, upto=None):
+    """Combined hash of the stage files that run before ``upto`` (all when None)."""
+    digest = hashlib.sha256()
+    for stage in sorted(file_hashes):
+        if upto is None or stage_order(stage) < stage_order(upto):
+            digest.update(f"{stage}:{file_hashes[stage]}\n".encode())
+    return digest.hexdigest()
+
+
+def input_hash_for(path, stage):
+    """Hash of what ``stage`` reads: earlier column files of a store, or the whole file."""
+    if is_store(path):
+        return inputs_hash(store_file_hashes(path), upto=stage)
+    return hash_file(path)
+
+
+def _jsonable(value):
+    try:
+        return json.loads(json.dumps(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def stage_params(namespace):
+    """Configuration of a stage: its upper-case module constants that fit in JSON."""
+    params = {}
+    for name, value in sorted(namespace.items()):
+        if not name.isupper() or name.startswith("_") or name == "STAGE_VERSION":
+            continue
+        value = _jsonable(value)
+        if value is not None:
+            params[name] = value
+    return params
+
+
+def stage_entry(version, params, input_hash):
+    return {"version": version, "params": _jsonable(params), "input_hash": input_hash}
+
+
+def is_stage_current(manifest, stage, version, params, input_hash=None):
+    """True when ``stage`` already ran with this version, these params and this input."""
+    entry = manifest["stages"].get(stage)
+    if entry is None:
+        return False
+    if entry.get("version") != version or entry.get("params") != _jsonable(params):
+        return False
+    # Workbooks are rewritten in place, so their own last output counts as unchanged too
+    return input_hash is None or input_hash in (entry.get("input_hash"), entry.get("output_hash"))
+
+
+def record_stage(path, stage, version, params, input_hash):
+    manifest = load_manifest(path)
+    entry = stage_entry(version, params, input_hash)
+    if not is_store(path) and os.path.exists(path):
+        entry["output_hash"] = hash_file(path)
+    manifest["stages"][stage] = entry
+    save_manifest(path, manifest)
+
+
+def incremental_stage(stage):
+    """Skip a per-file stage function when the capture has not changed since its last run.
+
+    The decorated function takes the capture path first. Version and parameters
+    are read from the stage module (``STAGE_VERSION`` and its upper-case
+    constants) at call time. Pass ``force=True`` to run regardless.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(path, *args, force=False, **kwargs):
+            namespace = func.__globals__
+            version = namespace.get("STAGE_VERSION", 1)
+            params = stage_params(namespace)
+            input_hash = input_hash_for(path, stage)
+
+            if not force and is_stage_current(load_manifest(path), stage, version, params, input_hash):
+                print(f"⏭️ Unchanged, skipped: {os.path.basename(path)}")
+                return None
+
+            with step(stage):
+                result = func(path, *args, **kwargs)
+            record_stage(path, stage, version, params, input_hash)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,125 @@
+import os
+import time
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from instrumentation import collect, print_summary, write_run_report
+
+# === CONFIGURATION ===
+# None uses every core; 1 runs in the calling process (handy for debugging)
+DEFAULT_WORKERS = None
+
+
+@dataclass
+class FileResult:
+    path: str
+    value: object = None
+    error: str = None
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    steps: list = field(default_factory=list)  # instrumentation records of this capture
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def resolve_workers(workers=None, n_items=None):
+    workers = DEFAULT_WORKERS if workers is None else workers
+    workers = (os.cpu_count() or 1) if workers is None else max(1, int(workers))
+    if n_items is not None:
+        workers = max(1, min(workers, n_items))
+    return workers
+
+
+def _run_one(func, path, args):
+    """Run ``func(path, *args)`` and turn any exception into an error message."""
+    result = FileResult(path)
+    t0, c0 = time.perf_counter(), time.process_time()
+    with collect() as steps:
+        try:
+            result.value = func(path, *args)
+        except Exception as e:
+            result.error = str(e) or type(e).__name__
+    result.steps = [{"capture": path, **record} for record in steps]
+    result.seconds = time.perf_counter() - t0
+    result.cpu_seconds = time.process_time() - c0
+    return result
+
+
+def run_parallel(func, paths, workers=None, args=(), label="file", report=None):
+    """Run ``func(path, *args)`` for every path on a process pool.
+
+    Captures are independent, so each one is a separate task. Results come back
+    as a list of FileResult in the order of ``paths`` no matter which worker
+    finishes first, and an exception in one capture is recorded on its result
+    instead of stopping the others. ``func`` must be a module-level function so
+    it can be sent to the workers. The timed steps of every capture
+    (instrumentation.py) are kept on its result and, with ``report``, written
+    to that JSON or CSV file.
+    """
+    paths = list(paths)
+    workers = resolve_workers(workers, len(paths))
+    t0 = time.perf_counter()
+
+    if workers == 1:
+        results = [_run_one(func, path, args) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_one, func, path, args) for path in paths]
+            results = [future.result() for future in futures]
+
+    report_results(results, time.perf_counter() - t0, workers, label)
+    if report:
+        steps = [record for r in results for record in r.steps]
+        write_run_report(report, steps)
+        print_summary(steps)
+        print(f"📝 Run report: {report}")
+    return results
+
+
+def report_results(results, wall_seconds, workers, label="file"):
+    """Print the per-file errors and a summary with the speedup over serial mode.
+
+    The serial time is estimated as the sum of the per-file wall times, which
+    include I/O waits and helper processes such as the plot renderer (CPU
+    times would miss both). When workers compete for cores each file takes
+    longer than it would alone, so the estimate is an upper bound;
+    measure_speedup() (the runner's --measure-speedup) times both modes.
+    """
+    failed = [r for r in results if not r.ok]
+    for r in failed:
+        print(f"❌ Error processing {r.path}: {r.error}")
+
+    serial_seconds = sum(r.seconds for r in results)
+    speedup = serial_seconds / wall_seconds if wall_seconds > 0 else 1.0
+    print(f"\n[✓] Processed {len(results) - len(failed)} {label}(s), {len(failed)} failed "
+          f"with {workers} worker(s) in {wall_seconds:.1f}s "
+          f"(serial {serial_seconds:.1f}s, speedup {speedup:.1f}x).")
+
+
+def measure_speedup(func, paths, workers=None, args=(), label="file", **kwargs):
+    """Run the same work serially and on the pool and return the measured speedup.
+
+    Every path is processed twice, so ``func`` must redo its work the second
+    time: pass ``force=True`` for an @incremental_stage function (``kwargs``
+    go to every call), otherwise the parallel run finds current manifests and
+    skips everything.
+    """
+    paths = list(paths)
+    if kwargs:
+        func = functools.partial(func, **kwargs)
+    t0 = time.perf_counter()
+    run_parallel(func, paths, workers=1, args=args, label=label)
+    serial_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    run_parallel(func, paths, workers=workers, args=args, label=label)
+    parallel_seconds = time.perf_counter() - t0
+
+    return {
+        'workers': resolve_workers(workers, len(paths)),
+        'serial_seconds': serial_seconds,
+        'parallel_seconds': parallel_seconds,
+        'speedup': serial_seconds / parallel_seconds if parallel_seconds > 0 else 1.0,
+    }
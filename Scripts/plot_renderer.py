@@ -0,0 +1,185 @@
+import time
+import multiprocessing
+from multiprocessing import util
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+import numpy as np
+
+# === CONFIGURATION ===
+RENDER_WORKERS = 1   # background render processes per pipeline process; 0 = render inline
+DPI = 100            # matplotlib's default, so a 12 in wide figure is 1200 pixel columns
+
+# Plot rendering off the numeric path. A stage describes its figures as plain
+# data (panels of lines, points and horizontal lines, already decimated) and
+# submit_figures() hands them to a small background pool. The stage gets back a
+# PendingPlots object right away and carries on; the PNG buffers are only
+# waited for when the capture is written, after the remaining stages ran.
+# Figures are drawn with matplotlib's object API (no pyplot state), so the
+# same code runs in a worker process or, inside a daemonic process that may
+# not start children, in a thread.
+#
+# Decimation keeps a line's shape at a fraction of its points: "minmax" keeps
+# the lowest and highest sample of every pixel column, so the drawn envelope
+# is the same as with all samples; "lttb" (Largest-Triangle-Three-Buckets)
+# keeps one visually dominant point per bucket. Samples passed in ``keep``
+# (flagged spikes) are always kept.
+
+
+def minmax_indices(x, y, n_bins):
+    """Indices of the lowest and highest ``y`` in each of ``n_bins`` equal ``x`` intervals, plus both ends."""
+    n = len(x)
+    if n <= 2 * n_bins or n_bins < 1:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    span = x.max() - x.min()
+    if span > 0:
+        bins = np.minimum(((x - x.min()) / span * n_bins).astype(np.int64), n_bins - 1)
+    else:
+        bins = np.arange(n) * n_bins // n
+    # Sorted by bin, then by value (NaN last), the first entry of a bin is its minimum
+    counts = np.bincount(bins, minlength=n_bins)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[counts > 0]
+    lowest = np.lexsort((y, bins))[starts]
+    highest = np.lexsort((-y, bins))[starts]
+    return np.unique(np.concatenate([[0, n - 1], lowest, highest]))
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: ``n_out`` indices, always including the first and last sample."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        # Third corner: the mean of the next bucket
+        cx, cy = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def decimate(x, y, n_points, keep=None, method="minmax"):
+    """Sorted indices of the samples to draw: about ``n_points`` of them plus every ``keep`` sample.
+
+    ``method`` is "minmax", "lttb" or None (every sample).
+    """
+    if method is None:
+        return np.arange(len(x))
+    if method == "minmax":
+        idx = minmax_indices(x, y, n_points // 2)
+    elif method == "lttb":
+        idx = lttb_indices(x, y, n_points)
+    else:
+        raise ValueError(f"Unknown decimation method '{method}'. Choose from: minmax, lttb, None")
+    if keep is not None:
+        idx = np.union1d(idx, np.flatnonzero(np.asarray(keep)))
+    return idx
+
+
+def render_figure(spec):
+    """PNG bytes of one figure spec.
+
+    ``spec``: {"figsize": (w, h), "xlabel": str, "panels": [{"lines": [(x, y, style)],
+    "points": [(x, y, style)], "hlines": [(y, style)], "ylabel": str}, ...]} where
+    ``style`` is a dict of matplotlib keyword arguments (label, color, linestyle).
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=spec.get("figsize", (12, 8)), dpi=DPI)
+    panels = spec["panels"]
+    axs = np.atleast_1d(fig.subplots(len(panels), 1, sharex=True))
+    for ax, panel in zip(axs, panels):
+        for x, y, style in panel.get("lines", []):
+            ax.plot(x, y, **style)
+        for x, y, style in panel.get("points", []):
+            ax.scatter(x, y, **style)
+        for y, style in panel.get("hlines", []):
+            ax.axhline(y, **style)
+        ax.legend()
+        ax.set_ylabel(panel.get("ylabel", ""))
+        ax.grid(True)
+    axs[-1].set_xlabel(spec.get("xlabel", ""))
+    fig.tight_layout()
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+class PendingPlots:
+    """PNG buffers that are still being rendered; iterating waits for them.
+
+    Every consumer of report images only iterates over them, so this stands in
+    for the usual list of BytesIO until the capture is written.
+    """
+
+    def __init__(self, futures):
+        self.futures = list(futures)
+
+    def __iter__(self):
+        return iter([BytesIO(future.result()) for future in self.futures])
+
+    def __len__(self):
+        return len(self.futures)
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+
+_pool = None
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        if multiprocessing.current_process().daemon:
+            _pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS)
+        else:
+            # Spawned, not forked: a forked child of a pool worker can inherit locks held by its threads
+            _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            # A pool worker exits through multiprocessing's exit handler, which waits for its child
+            # processes, so the render pool has to be shut down before that
+            util.Finalize(None, _pool.shutdown, exitpriority=100)
+    return _pool
+
+
+def submit_figures(specs):
+    """Render figure specs in the background; returns PendingPlots (a list of BytesIO with RENDER_WORKERS = 0)."""
+    if not RENDER_WORKERS:
+        return [BytesIO(render_figure(spec)) for spec in specs]
+    pool = _executor()
+    return PendingPlots(pool.submit(render_figure, spec) for spec in specs)
+
+
+def benchmark(store_path):
+    """Time the z-score stage plots drawn from every sample against decimated ones for one capture store."""
+    from columnar_store import read_columns
+    from run_pipeline import load_stage_module
+    stage = load_stage_module("10_outlier_detection_z-score.py")
+
+    df = stage.parse_datetime(read_columns(store_path))
+    axes = stage.detect_axes(df)
+    df, *_ = stage.compute_spike_statistics(df, axes)
+    for method in (None, "minmax", "lttb"):
+        t0 = time.perf_counter()
+        specs = stage.spike_plot_specs(df, axes, method=method)
+        build = time.perf_counter() - t0
+        pngs = [render_figure(spec) for spec in specs]
+        seconds = time.perf_counter() - t0
+        points = sum(len(line[0]) for spec in specs for panel in spec["panels"] for line in panel["lines"])
+        print(f"{str(method):>6}: {seconds:5.2f} s ({build * 1000:.0f} ms decimating), "
+              f"{points} line points drawn, {sum(map(len, pngs)) // 1024} KB PNG")
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+    benchmark(sys.argv[1])
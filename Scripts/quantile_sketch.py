@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import math
+import numpy as np
+from columnar_store import STORE_SUFFIX, iter_inputs, load_main
+from parallel_executor import run_parallel
+
+# === CONFIGURATION ===
+COMPRESSION = 500            # t-digest δ: about δ/2 centroids, rank error ≈ π/δ of the count at the median
+SKETCH_COLUMNS = ['x', 'y', 'z', 'x_mps2', 'y_mps2', 'z_mps2']   # 10 uses the g columns when present
+LEVELS = ("sensor", "machine", "fleet")
+
+# Mergeable quantile sketches for thresholds over many captures. Every capture
+# is summarised per axis by a t-digest (a few hundred weighted centroids, small
+# clusters in the tails, larger ones in the middle), and the digests of all
+# captures of a sensor are merged into a baseline file:
+#
+#   {"captures": {"ac1_1712909109__machine-b827...-18e8...": "b827...-18e8..."},
+#    "sketches": {"b827...-18e8...": {"x_mps2": {"means": [...], "weights": [...], ...}}}}
+#
+# Machine and fleet baselines are merged from the sensor digests on request,
+# so months of captures are summarised without keeping any of them in memory.
+
+CAPTURE_NAME = re.compile(r"machine-(?P<machine>[0-9a-fA-F]+)-(?P<sensor>[0-9a-fA-F]+)")
+
+
+class TDigest:
+    """Merging t-digest (Dunning & Ertl) with the k1 scale function."""
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def update(self, values):
+        """Add a batch of values; NaN and infinite values are ignored."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return self
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+        return self
+
+    def merge(self, other):
+        """Fold another digest into this one."""
+        if other.count:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._compress(np.concatenate([self.means, other.means]),
+                           np.concatenate([self.weights, other.weights]))
+        return self
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # Centroids whose left edge falls into the same unit of k(q) are merged,
+        # so no cluster spans more than one unit of the scale function
+        q_left = (np.cumsum(weights) - weights) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q_left - 1)
+        cluster = np.floor(k - k[0]).astype(np.int64)
+        cluster = np.unique(cluster, return_inverse=True)[1]
+        merged = np.bincount(cluster, weights=weights)
+        self.means = np.bincount(cluster, weights=means * weights) / merged
+        self.weights = merged
+
+    def quantile(self, q):
+        """Estimated quantile(s) with the linear interpolation of ``pandas.Series.quantile``."""
+        q = np.asarray(q, dtype=float)
+        if not len(self.weights):
+            return np.full(q.shape, np.nan) if q.ndim else float("nan")
+        total = self.weights.sum()
+        # A centroid covering ranks start..start+w-1 sits at their mid rank
+        centres = np.cumsum(self.weights) - (self.weights + 1) / 2
+        ranks = np.concatenate([[0.0], centres, [total - 1]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        result = np.interp(q * (total - 1), ranks, values)
+        return result if q.ndim else float(result)
+
+    def to_dict(self):
+        return {"compression": self.compression, "min": self.min, "max": self.max,
+                "means": self.means.tolist(), "weights": self.weights.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(data.get("compression", COMPRESSION))
+        digest.means = np.asarray(data["means"], dtype=float)
+        digest.weights = np.asarray(data["weights"], dtype=float)
+        digest.min, digest.max = data["min"], data["max"]
+        return digest
+
+
+def capture_group(capture, level="sensor"):
+    """Baseline key of a capture path or file name, or None when the name carries no machine id."""
+    if level == "fleet":
+        return "fleet"
+    match = CAPTURE_NAME.search(os.path.basename(str(capture)))
+    if match is None:
+        return None
+    if level == "machine":
+        return match["machine"]
+    if level == "sensor":
+        return f"{match['machine']}-{match['sensor']}"
+    raise ValueError(f"Unknown baseline level '{level}'. Choose from: {', '.join(LEVELS)}")
+
+
+def capture_id(capture):
+    name = os.path.basename(os.path.normpath(str(capture)))
+    return name[:-len(STORE_SUFFIX)] if name.endswith(STORE_SUFFIX) else os.path.splitext(name)[0]
+
+
+def sketch_capture(path, columns=SKETCH_COLUMNS, compression=COMPRESSION):
+    """One pass over a capture: {column: digest dict} for the columns it has."""
+    df = load_main(path, columns=list(columns))
+    return {col: TDigest(compression).update(df[col].to_numpy(dtype=float)).to_dict()
+            for col in columns if col in df.columns}
+
+
+def load_baseline(baseline_path):
+    if not baseline_path or not os.path.exists(baseline_path):
+        return {"captures": {}, "sketches": {}}
+    with open(baseline_path, "r") as f:
+        return json.load(f)
+
+
+def save_baseline(baseline_path, baseline):
+    tmp_path = baseline_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(baseline, f)
+    os.replace(tmp_path, baseline_path)
+
+
+def add_to_baseline(baseline, capture, sketches):
+    """Merge the per-axis digests of one capture into its sensor baseline (once per capture)."""
+    cid, group = capture_id(capture), capture_group(capture)
+    if group is None or cid in baseline["captures"]:
+        return False
+    stored = baseline["sketches"].setdefault(group, {})
+    for col, data in sketches.items():
+        digest = TDigest.from_dict(data)
+        if col in stored:
+            digest = TDigest.from_dict(stored[col]).merge(digest)
+        stored[col] = digest.to_dict()
+    baseline["captures"][cid] = group
+    return True
+
+
+def merged_digest(baseline, group, column, level="sensor"):
+    """Digest of ``column`` over all sensors that belong to ``group`` at ``level``."""
+    digest = None
+    for sensor, sketches in baseline["sketches"].items():
+        if column not in sketches or capture_group(f"machine-{sensor}", level) != group:
+            continue
+        part = TDigest.from_dict(sketches[column])
+        digest = part if digest is None else digest.merge(part)
+    return digest
+
+
+_cache = {}
+
+
+def _cached_baseline(baseline_path):
+    mtime = os.path.getmtime(baseline_path)
+    if _cache.get(baseline_path, (None,))[0] != mtime:
+        _cache[baseline_path] = (mtime, load_baseline(baseline_path), {})
+    return _cache[baseline_path]
+
+
+def baseline_quantiles(baseline_path, capture, column, quantiles, level="sensor"):
+    """Quantiles of ``column`` from the baseline of the capture's sensor, machine or fleet.
+
+    Returns None when there is no baseline file, the capture name carries no
+    machine id, or the baseline has no data for it; the caller then falls back
+    to the quantiles of the capture itself.
+    """
+    if not baseline_path or capture is None or not os.path.exists(baseline_path):
+        return None
+    group = capture_group(capture, level)
+    if group is None:
+        return None
+    _, baseline, digests = _cached_baseline(baseline_path)
+    key = (group, column, level)
+    if key not in digests:
+        digests[key] = merged_digest(baseline, group, column, level)
+    digest = digests[key]
+    if digest is None or not digest.count:
+        return None
+    return [float(v) for v in digest.quantile(quantiles)]
+
+
+def build_baseline(root_folder, baseline_path, workers=None):
+    """Sketch every capture below ``root_folder`` that is not in the baseline yet and merge it in."""
+    baseline = load_baseline(baseline_path)
+    pending = [p for p in iter_inputs(root_folder)
+               if capture_group(p) is not None and capture_id(p) not in baseline["captures"]]
+    results = run_parallel(sketch_capture, pending, workers=workers, label="capture")
+    added = sum(add_to_baseline(baseline, r.path, r.value) for r in results if r.ok and r.value)
+    save_baseline(baseline_path, baseline)
+    print(f"📦 Added {added} capture(s) to {baseline_path} "
+          f"({len(baseline['captures'])} captures, {len(baseline['sketches'])} sensor(s)).")
+    return baseline
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+
+    # Build or extend a baseline, then print the thresholds it gives per sensor
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    baseline_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(root, "quantile_baseline.json")
+    baseline = build_baseline(root, baseline_path)
+    for group in sorted(baseline["sketches"]):
+        for col in SKETCH_COLUMNS:
+            digest = merged_digest(baseline, group, col)
+            if digest is None:
+                continue
+            q1, q3, p99 = digest.quantile([0.25, 0.75, 0.99])
+            print(f"{group} {col}: n={digest.count:.0f} Q1={q1:.4f} Q3={q3:.4f} p99={p99:.4f} "
+                  f"({len(digest.weights)} centroids)")
@@ -0,0 +1,174 @@
+import time
+import multiprocessing
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.drawing.image import Image as XLImage
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
+from instrumentation import peak_rss_mb, timed
+
+# === CONFIGURATION ===
+LABEL_COLUMN = "Final_label"
+LABEL_COLORS = {
+    "Healthy": "C6EFCE",   # Green
+    "Monitor": "FFFCCC",   # Yellow
+    "Warning": "FCE4D6",   # Orange
+    "Critical": "FFC7CE",  # Red
+}
+IMAGE_ROW_STEP = 30  # rows between the top-left corners of stacked plots
+
+# Excel output for all stages. Workbooks are written in openpyxl's write-only
+# mode: rows are streamed to the file as they are appended, so memory does not
+# grow with the row count, and the whole workbook (main table, report sheets,
+# plots) is saved once. The label colours are conditional-format rules on the
+# label column, one per label, instead of a fill on every cell, and plots are
+# embedded straight from their PNG buffers. The helpers below also work on
+# ordinary worksheets, for the stages that update a workbook in place.
+
+
+def dataframe_rows(df):
+    """Header row, then one list per row with NaN/NaT as empty cells."""
+    yield [str(c) for c in df.columns]
+    columns = []
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        # astype(object) gives plain Python scalars and Timestamps, which openpyxl writes directly
+        columns.append(values.astype(object).where(values.notna(), None).to_numpy())
+    if not columns:
+        return
+    for row in zip(*columns):
+        yield list(row)
+
+
+def append_dataframe(ws, df):
+    for row in dataframe_rows(df):
+        ws.append(row)
+    return ws
+
+
+def add_label_formatting(ws, df, column=LABEL_COLUMN, colors=LABEL_COLORS):
+    """Colour the label column with conditional-format rules (one per label)."""
+    if column not in df.columns or df.empty:
+        return
+    letter = get_column_letter(df.columns.get_loc(column) + 1)
+    cells = f"{letter}2:{letter}{len(df) + 1}"
+    for label, color in colors.items():
+        fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        ws.conditional_formatting.add(cells, CellIsRule(operator="equal", formula=[f'"{label}"'], fill=fill))
+
+
+def add_images(ws, buffers):
+    """Embed PNG buffers (BytesIO) in a sheet, one below the other."""
+    for i, buf in enumerate(buffers):
+        buf.seek(0)
+        ws.add_image(XLImage(buf), f"B{2 + i * IMAGE_ROW_STEP}")
+
+
+def replace_sheet(wb, name, df, index=None):
+    """Write ``df`` to sheet ``name`` of an open workbook, replacing a sheet of that name."""
+    if name in wb.sheetnames:
+        index = wb.sheetnames.index(name) if index is None else index
+        wb.remove(wb[name])
+    ws = wb.create_sheet(name, index)
+    add_label_formatting(ws, df)
+    return append_dataframe(ws, df)
+
+
+def replace_image_sheet(wb, name, buffers):
+    """Replace sheet ``name`` with the given images; no images removes the sheet."""
+    if name in wb.sheetnames:
+        wb.remove(wb[name])
+    buffers = list(buffers)
+    if not buffers:
+        return None
+    ws = wb.create_sheet(name)
+    add_images(ws, buffers)
+    return ws
+
+
+@timed("excel-save")
+def write_workbook(path, sheets, images=None):
+    """Write a new workbook in one pass: ``sheets`` {name: DataFrame} in order, then ``images`` {name: [BytesIO]}."""
+    wb = Workbook(write_only=True)
+    for name, df in sheets.items():
+        if df is None:
+            continue
+        ws = wb.create_sheet(name)
+        # Conditional formats are written before the rows, so they are set up first
+        add_label_formatting(ws, df)
+        append_dataframe(ws, df)
+    # Images last: plots that are still rendering are waited for here
+    for name, buffers in (images or {}).items():
+        buffers = list(buffers)
+        if buffers:
+            add_images(wb.create_sheet(name), buffers)
+    wb.save(path)
+    return path
+
+
+def _per_cell_export(path, df, sheets, images):
+    # The previous export: pandas writer plus a PatternFill on every label cell
+    from openpyxl.drawing.image import Image as Picture
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        df.to_excel(writer, sheet_name="Sheet1", index=False)
+        for name, sheet_df in sheets.items():
+            sheet_df.to_excel(writer, sheet_name=name, index=False)
+        ws = writer.book["Sheet1"]
+        if LABEL_COLUMN in df.columns:
+            col_idx = df.columns.get_loc(LABEL_COLUMN) + 1
+            fills = {k: PatternFill(start_color=v, end_color=v, fill_type="solid") for k, v in LABEL_COLORS.items()}
+            for i, label in enumerate(df[LABEL_COLUMN], start=2):
+                if label in fills:
+                    ws.cell(row=i, column=col_idx).fill = fills[label]
+        for name, buffers in images.items():
+            ws = writer.book.create_sheet(name)
+            for i, buf in enumerate(buffers):
+                buf.seek(0)
+                ws.add_image(Picture(buf), f"B{2 + i * IMAGE_ROW_STEP}")
+
+
+def _timed_export(method, store_path, excel_path, queue):
+    # Runs in a child process so the peak RSS belongs to this export alone
+    from columnar_store import MAIN_SHEET, list_sheets, read_columns, read_images, read_sheet
+    df = read_columns(store_path)
+    sheets = {name: read_sheet(store_path, name) for name in list_sheets(store_path)}
+    images = read_images(store_path)
+    loaded = peak_rss_mb()
+    t0 = time.perf_counter()
+    if method == "per-cell":
+        _per_cell_export(excel_path, df, sheets, images)
+    else:
+        write_workbook(excel_path, {MAIN_SHEET: df, **sheets}, images)
+    seconds = time.perf_counter() - t0
+    queue.put((seconds, loaded, peak_rss_mb(), len(df), len(df.columns), len(sheets)))
+
+
+def benchmark(store_path, excel_path):
+    """Export time and peak memory of write_workbook against the per-cell export for one capture store.
+
+    Each export runs in a fresh process; memory is the peak resident set size
+    (Linux/macOS, not measured on Windows), and the growth over the loaded
+    data is what the export added.
+    """
+    results = {}
+    for method in ("per-cell", "write-only"):
+        queue = multiprocessing.Queue()
+        child = multiprocessing.Process(target=_timed_export, args=(method, store_path, excel_path, queue))
+        child.start()
+        seconds, loaded_mb, peak_mb, rows, cols, n_sheets = queue.get()
+        child.join()
+        export_mb = peak_mb - loaded_mb if peak_mb is not None else None
+        results[method] = {"seconds": seconds, "peak_mb": peak_mb, "export_mb": export_mb}
+        memory = f", peak RSS {peak_mb:7.1f} MB (+{export_mb:.1f} MB for the export)" if peak_mb is not None else ""
+        print(f"{method:>10}: {seconds:6.2f} s{memory} - {rows} rows x {cols} columns, {n_sheets} report sheets")
+    return results
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+    # Compare both exports on one capture store
+    benchmark(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "report_writer_benchmark.xlsx")
@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+
+# === CONFIGURATION ===
+GRID_SAMPLE_RATE = None   # Hz; None = the nominal rate of the capture (estimated rate rounded to whole Hz)
+GAP_FACTOR = 5.0          # an interval longer than this many median intervals is a gap
+GAP_FILL = 0.0            # value of grid points inside gaps; 0.0 is a sensor dropout for stages 04-07
+AXES = ['x', 'y', 'z']
+
+# Put a capture on a uniform time grid. The sensor delivers its samples in
+# bursts (49 ms, 98 ms, then 2 ms apart), so every window that counts samples
+# covers a different stretch of time. Duplicate timestamps are averaged, the
+# sample clock is estimated by a least-squares fit of time against sample
+# number within each gap-free segment, and every axis is linearly
+# interpolated with one set of bracketing samples and weights shared by all
+# columns. An axis reading exactly 0.0 is a sensor dropout (stage 04) and is
+# treated like NaN in that axis' columns. Grid points that fall into a gap,
+# next to a NaN sample or on a dropout (every dropout marks the grid point
+# nearest to it, so none is lost between grid points) get GAP_FILL and a
+# False validity mask ({axis}_valid), so the later stages see ordinary
+# dropouts; check_dropouts() makes sure every dropout of the input is there.
+
+
+def _dedupe(timestamps, values):
+    """Sort by time and average the rows that share a timestamp."""
+    if (np.diff(timestamps) > 0).all():
+        return timestamps, values
+    order = np.argsort(timestamps, kind="stable")
+    t, inverse = np.unique(timestamps[order], return_inverse=True)
+    counts = np.bincount(inverse)
+    merged = {col: np.bincount(inverse, weights=v[order]) / counts for col, v in values.items()}
+    return t, merged
+
+
+def sampling_report(timestamps, rate=GRID_SAMPLE_RATE):
+    """Sample rate, gaps, jitter and clock drift of one capture (epoch-ms timestamps)."""
+    timestamps = np.asarray(timestamps, dtype=float)
+    t = np.unique(timestamps)
+    report = {
+        "samples": len(timestamps),
+        "duplicates": len(timestamps) - len(t),
+        "out_of_order": int((np.diff(timestamps) < 0).sum()),
+    }
+    if len(t) < 3:
+        return report
+
+    d = np.diff(t)
+    median = float(np.median(d))
+    gap = d > GAP_FACTOR * median
+    # Least-squares slope of time against sample number, one intercept per gap-free segment
+    segment = np.concatenate([[0], np.cumsum(gap)])
+    index = np.arange(len(t)) - np.flatnonzero(np.concatenate([[True], gap]))[segment]
+    counts = np.bincount(segment)
+    i_mean = np.bincount(segment, weights=index) / counts
+    t_mean = np.bincount(segment, weights=t) / counts
+    di, dt = index - i_mean[segment], t - t_mean[segment]
+    period = float((di * dt).sum() / (di * di).sum()) if (di * di).sum() > 0 else median
+    residual = dt - period * di
+
+    fs = 1000.0 / period
+    nominal = rate if rate else max(1.0, round(fs))
+    report.update({
+        "median_interval_ms": median,
+        "gaps": int(gap.sum()),
+        "gap_seconds": float((d[gap] - period).sum() / 1000.0),
+        "sample_rate_hz": fs,
+        "nominal_rate_hz": float(nominal),
+        "drift_ppm": (fs / nominal - 1.0) * 1e6,
+        "jitter_ms": float(residual.std()),
+    })
+    return report
+
+
+def resample_to_grid(df, rate=GRID_SAMPLE_RATE):
+    """Interpolate a capture (``timestamp`` in epoch ms plus value columns) onto a uniform grid.
+
+    Every numeric column other than ``timestamp`` is resampled; ``datetime``
+    is rebuilt from the grid timestamps. Returns the grid DataFrame and the
+    sampling report of the input (with the grid rate and size added).
+    """
+    value_cols = [c for c in df.columns
+                  if c not in ("timestamp", "datetime") and pd.api.types.is_numeric_dtype(df[c])]
+    timestamps = df["timestamp"].to_numpy(dtype=float)
+    report = sampling_report(timestamps, rate)
+    if "nominal_rate_hz" not in report:
+        return df.copy(), report
+
+    values = {c: df[c].to_numpy(dtype=float) for c in value_cols}
+    dropouts = {}
+    for axis in AXES:
+        source = axis if axis in values else f"{axis}_mps2"
+        if source in values:
+            dropouts[axis] = values[source] == 0.0
+    for col in value_cols:
+        dropout = dropouts.get(col.split("_")[0])
+        if dropout is not None and dropout.any():
+            values[col] = np.where(dropout, np.nan, values[col])
+
+    t, values = _dedupe(timestamps, values)
+    period = 1000.0 / report["nominal_rate_hz"]
+    grid = t[0] + period * np.arange(int(np.floor((t[-1] - t[0]) / period)) + 1)
+    # The grid point nearest to each dropout sample
+    dropout_cells, on_dropout = {}, {}
+    for axis, dropout in dropouts.items():
+        cells = np.round((timestamps[dropout] - grid[0]) / period).astype(np.int64)
+        dropout_cells[axis] = np.clip(cells, 0, len(grid) - 1)
+        on_dropout[axis] = np.zeros(len(grid), dtype=bool)
+        on_dropout[axis][dropout_cells[axis]] = True
+
+    # Bracketing samples of every grid point; a grid point on a sample only needs that one
+    right = np.clip(np.searchsorted(t, grid, side="right"), 1, len(t) - 1)
+    left = right - 1
+    on_sample = grid == t[left]
+    span = t[right] - t[left]
+    covered = on_sample | (span <= GAP_FACTOR * report["median_interval_ms"])
+    weight = (grid - t[left]) / span  # 0 on a sample, so the sample value is kept exactly
+
+    out = {"timestamp": np.round(grid).astype(np.int64)}
+    masks = {}
+    for col in value_cols:
+        v = values[col]
+        lo, hi = v[left], v[right]
+        axis = col.split("_")[0]
+        valid = covered & ~on_dropout[axis] if axis in on_dropout else covered
+        finite = np.isfinite(v)
+        if not finite.all():
+            valid = valid & finite[left] & (on_sample | finite[right])
+            hi = np.where(on_sample, lo, hi)
+        out[col] = np.where(valid, lo + weight * (hi - lo), GAP_FILL)
+        if axis in AXES:
+            masks[f"{axis}_valid"] = masks.get(f"{axis}_valid", True) & valid
+    if "datetime" in df.columns:
+        out["datetime"] = out["timestamp"].astype("datetime64[ms]")
+
+    grid_df = pd.DataFrame({c: out[c] for c in df.columns if c in out})
+    for name, mask in masks.items():
+        grid_df[name] = mask
+    all_valid = np.all(list(masks.values()), axis=0) if masks else np.ones(len(grid), dtype=bool)
+    report.update({
+        "grid_rate_hz": report["nominal_rate_hz"],
+        "grid_points": len(grid),
+        "invalid_fraction": float(1 - np.mean(all_valid)),
+        "dropout_samples": int(sum(d.sum() for d in dropouts.values())),
+        "dropout_grid_points": int(sum(d.sum() for d in on_dropout.values())),
+    })
+    check_dropouts(dropout_cells, masks)
+    return grid_df, report
+
+
+def check_dropouts(dropout_cells, masks):
+    """Every dropout of the input ({axis: grid point of each missing sample}) must be invalid on the grid.
+
+    Returns the number of missing samples, which is then the same before and
+    after resampling.
+    """
+    missing = kept = 0
+    for axis, cells in dropout_cells.items():
+        missing += len(cells)
+        kept += int((~masks[f"{axis}_valid"][cells]).sum()) if f"{axis}_valid" in masks else 0
+    if kept != missing:
+        raise ValueError(f"Resampling lost dropouts: {missing} missing samples in the capture, "
+                         f"only {kept} of them on invalid grid points")
+    return missing
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import os
+    import sys
+    from capture_loader import capture_to_dataframe, load_capture
+
+    # Print the sampling report of every raw capture below the given folder
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(f for f in filenames if f.endswith(".json")):
+            path = os.path.join(dirpath, filename)
+            try:
+                df = capture_to_dataframe(load_capture(path))
+            except (ValueError, KeyError):
+                continue
+            _, report = resample_to_grid(df)
+            print(f"⏱️ {path}")
+            print("   " + ", ".join(f"{k} {v:.4g}" if isinstance(v, float) else f"{k} {v}" for k, v in report.items()))
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from instrumentation import timed
+
+# === CONFIGURATION ===
+# Same cut-off pandas uses: windows with a smaller variance get NaN skew/kurtosis
+VARIANCE_EPSILON = 1e-14
+
+# Rolling moments from running sums: the window sums of x, x², x³ and x⁴ come
+# from block-wise running sums, so every statistic costs O(n) regardless of the
+# window length, and all axes are handled at once as columns of one array.
+# Values are shifted by their overall mean first, which keeps the higher powers
+# small.
+
+
+def _window_sums(values, window):
+    """Sums over the trailing window [i - window + 1, i] for every row of a 2-D array.
+
+    The rows are cut into blocks of ``window`` rows. Each window then covers the
+    tail of one block and the head of the next, so its sum is a suffix sum plus
+    a prefix sum of samples that all lie inside the window: O(n) like a plain
+    cumulative sum, but without subtracting large running totals (which loses
+    precision for x⁴ as soon as a spike has gone by).
+    """
+    n, k = values.shape
+    blocks = -(-n // window)
+    padded = np.zeros((blocks * window, k))
+    padded[:n] = values
+    padded = padded.reshape(blocks, window, k)
+    prefix = np.cumsum(padded, axis=1).reshape(-1, k)[:n]
+    suffix = np.cumsum(padded[:, ::-1], axis=1)[:, ::-1].reshape(-1, k)[:n]
+
+    sums = prefix.copy()
+    rows = np.arange(window - 1, n)
+    spans_two_blocks = (rows + 1) % window != 0
+    rows = rows[spans_two_blocks]
+    sums[rows] += suffix[rows - window + 1]
+    return sums
+
+
+def _constant_run_length(values):
+    """Length of the run of identical values ending at each row (per column)."""
+    n = len(values)
+    same = np.zeros(values.shape, dtype=bool)
+    same[1:] = values[1:] == values[:-1]
+    # Positions where a new run starts; the run length is the distance to that start
+    rows = np.arange(n)[:, None]
+    starts = np.where(same, 0, rows)
+    np.maximum.accumulate(starts, axis=0, out=starts)
+    return rows - starts + 1
+
+
+def rolling_moments(values, window, center=True, min_periods=None):
+    """Rolling mean, RMS, variance (ddof=1), skewness and kurtosis (excess, unbiased).
+
+    ``values`` is a 1-D array or a 2-D (rows, columns) array; each result has
+    the same shape. Window placement, ``min_periods`` handling, NaN inputs and
+    the estimators follow ``pandas.Series.rolling(window, center=...,
+    min_periods=...)``, so rows without a complete window are NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    one_dim = values.ndim == 1
+    if one_dim:
+        values = values[:, None]
+    min_periods = window if min_periods is None else min_periods
+    n = len(values)
+    # pandas labels a centred window ending at row j with row j - (window - 1) // 2;
+    # padding the end lets the last rows see their truncated windows
+    offset = (window - 1) // 2 if center else 0
+    if offset:
+        values = np.concatenate([values, np.full((offset, values.shape[1]), np.nan)])
+
+    valid = ~np.isnan(values)
+    shift = np.nanmean(values, axis=0) if valid.any() else np.zeros(values.shape[1])
+    shift = np.nan_to_num(shift)
+    x = np.where(valid, values - shift, 0.0)
+
+    count = _window_sums(valid.astype(float), window)
+    s1 = _window_sums(x, window)
+    x2 = x * x
+    s2 = _window_sums(x2, window)
+    s3 = _window_sums(x2 * x, window)
+    s4 = _window_sums(x2 * x2, window)
+    raw_sq = _window_sums(np.where(valid, values * values, 0.0), window)
+    constant = _constant_run_length(np.where(valid, values, np.nan)) >= count
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        A = s1 / count
+        B = s2 / count - A * A
+        C = s3 / count - A ** 3 - 3 * A * B
+        D = s4 / count - A ** 4 - 6 * B * A * A - 4 * C * A
+
+        mean = A + shift
+        rms = np.sqrt(raw_sq / count)
+        var = np.maximum(B, 0.0) * count / (count - 1)
+        skew = np.sqrt(count * (count - 1)) * C / ((count - 2) * B ** 1.5)
+        kurt = ((count * count - 1) * D / (B * B) - 3 * (count - 1) ** 2) / ((count - 2) * (count - 3))
+
+    skew[B <= VARIANCE_EPSILON] = np.nan
+    kurt[B <= VARIANCE_EPSILON] = np.nan
+    skew[constant] = 0.0
+    kurt[constant] = -3.0
+    var[constant] = 0.0
+    var[count < 2] = np.nan
+    skew[count < 3] = np.nan
+    kurt[count < 4] = np.nan
+
+    results = {"mean": mean, "rms": rms, "var": var, "skew": skew, "kurt": kurt}
+    enough = count >= max(min_periods, 1)
+    for name, result in results.items():
+        result[~enough] = np.nan
+        result = result[offset:offset + n]
+        results[name] = result[:, 0] if one_dim else result
+    return results
+
+
+@timed("rolling")
+def rolling_moments_frame(df, columns, window, center=True, min_periods=None):
+    """rolling_moments for several DataFrame columns: {stat: DataFrame with ``columns``}."""
+    stats = rolling_moments(df[columns].to_numpy(dtype=float), window, center, min_periods)
+    return {name: pd.DataFrame(values, index=df.index, columns=columns) for name, values in stats.items()}
+
+
+def check_against_pandas(values, window, center=True, min_periods=None):
+    """Largest difference to the pandas rolling results per statistic (relative above 1)."""
+    series = pd.Series(np.asarray(values, dtype=float))
+    rolling = series.rolling(window, center=center, min_periods=min_periods)
+    expected = {
+        "mean": rolling.mean(),
+        "rms": rolling.apply(lambda s: np.sqrt(np.mean(s ** 2)), raw=True),
+        "var": rolling.var(),
+        "skew": rolling.skew(),
+        "kurt": rolling.kurt(),
+    }
+    ours = rolling_moments(series.to_numpy(), window, center, min_periods)
+    diffs = {}
+    for name, ref in expected.items():
+        ref = ref.to_numpy()
+        if not np.array_equal(np.isnan(ref), np.isnan(ours[name])):
+            diffs[name] = np.inf
+            continue
+        both = ~np.isnan(ref)
+        scale = np.maximum(np.abs(ref[both]), 1.0)
+        diffs[name] = float(np.max(np.abs(ref[both] - ours[name][both]) / scale)) if both.any() else 0.0
+    return diffs
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+    from columnar_store import iter_inputs, load_main
+
+    # Compare with pandas on every capture below the given folder
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else 51
+    for path in iter_inputs(root):
+        df = load_main(path, columns=["x_mps2", "y_mps2", "z_mps2"])
+        for col in df.columns:
+            diffs = check_against_pandas(df[col].to_numpy(), window)
+            print(f"{path} {col}: " + ", ".join(f"{k} {v:.1e}" for k, v in diffs.items()))
@@ -0,0 +1,360 @@
+import os
+import json
+import argparse
+import importlib.util
+from importlib.machinery import SourceFileLoader
+import pandas as pd
+from capture_loader import capture_to_dataframe, load_capture as load_json_capture
+from contextlib import nullcontext
+from columnar_store import STORE_SUFFIX, is_store, list_sheets, read_columns, read_sheet, write_capture, write_excel
+from manifest import (hash_file, inputs_hash, is_stage_current, load_manifest, save_manifest, stage_entry,
+                      stage_params, store_file_hashes)
+from instrumentation import profiled, step
+from parallel_executor import measure_speedup, run_parallel
+from capture_catalog import one_per_capture, update_catalog
+from compact_capture import COMPACT_SUFFIX
+import resample_grid
+
+# === CONFIGURATION ===
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+INGEST_SCRIPT = "01_convert_json_to_excel.PY"
+PROFILE_DIR = "profiles"   # next to the outputs; one profile per capture and profiled stage
+
+# Pipeline stages in execution order, each made of one or more stage scripts.
+# Every script exposes process_dataframe(df, reports) -> df, where ``reports``
+# collects the side sheets ({name: DataFrame}) and plot images ({name: [BytesIO]}).
+# 06 runs before 05 because the missing-value report shows the imputed values.
+STAGES = [
+    ("ingest", ["02_convert_timestamp_date-time.PY", "03_convert_g_mps2.py"]),
+    ("missing-values", ["04_detect _missing_values.py", "06_handle_missing_values_using_rollingmean.py",
+                        "05_missing_value_reports.py", "07_impute_missing_values.py"]),
+    ("rolling-stats", ["08_time_series.py"]),
+    ("box-plot", ["09_outlier_detection_ box_plot.py"]),
+    ("z-score", ["10_outlier_detection_z-score.py"]),
+    ("contextual", ["11_outlier_classification_01.py"]),
+    ("temporal", ["12_outlier_classification_02.py"]),
+    ("recurrence", ["13_outlier_classification_03.py"]),
+    ("fft", ["14_FFT_feature.py"]),
+    ("scoring", ["15_final_score_label.py"]),
+]
+STAGE_NAMES = [name for name, _ in STAGES]
+
+_modules = {}
+
+
+def load_stage_module(script):
+    """Import a stage script by file name (the numbered names are not valid module names)."""
+    if script not in _modules:
+        module_name = "stage_" + os.path.splitext(script)[0].replace(" ", "").replace("-", "_")
+        path = os.path.join(SCRIPTS_DIR, script)
+        # An explicit loader is needed for the upper-case .PY scripts
+        spec = importlib.util.spec_from_file_location(module_name, path, loader=SourceFileLoader(module_name, path))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[script] = module
+    return _modules[script]
+
+
+def stage_key(script):
+    """Name of the column file a stage script writes into a capture store."""
+    return os.path.splitext(script)[0].replace(" ", "")
+
+
+def select_stages(stages=None):
+    if not stages:
+        return list(STAGES)
+    unknown = [s for s in stages if s not in STAGE_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)}. Choose from: {', '.join(STAGE_NAMES)}")
+    return [(name, scripts) for name, scripts in STAGES if name in stages]
+
+
+def changed_columns(before, df):
+    """Columns that are new in ``df`` or whose values differ from the ``before`` snapshot."""
+    return [c for c in df.columns if c not in before or not before[c].equals(df[c])]
+
+
+def run_stages(df, stages=None, reports=None, capture=None, plots=True, profile=None):
+    """Run the selected stages in memory.
+
+    ``capture`` (the input path) is passed to the stages as ``df.attrs["capture"]``
+    so they can look up per-sensor baselines, and ``plots`` as
+    ``df.attrs["render_plots"]`` (False skips the plot images). Every script
+    is a timed step, and the stages in ``profile`` ({stage: profile path})
+    run under the profiler. Returns the final DataFrame, the reports and
+    {stage script: the columns it wrote, as they were right after that
+    script ran}.
+    """
+    reports = {} if reports is None else reports
+    written = {}
+    for name, scripts in select_stages(stages):
+        with profiled(profile[name]) if profile and name in profile else nullcontext():
+            df = _run_scripts(df, scripts, reports, written, capture, plots)
+    return df, reports, written
+
+
+def _run_scripts(df, scripts, reports, written, capture, plots):
+    for script in scripts:
+        if capture is not None:
+            df.attrs["capture"] = capture
+        df.attrs["render_plots"] = plots
+        before = {c: df[c] for c in df.columns}
+        module = load_stage_module(script)
+        with step(stage_key(script), rows=len(df)):
+            df = module.process_dataframe(df, reports)
+        df = df.reset_index(drop=True)
+        cols = changed_columns(before, df)
+        if cols:
+            frame = df[cols].copy()
+            frame.attrs = {}  # pyarrow would store them in the Parquet metadata
+            written[stage_key(script)] = frame
+    return df
+
+
+def load_capture(input_path, upto=None, resample=False):
+    """One read per capture: a raw JSON file or an existing capture store.
+
+    For a store, ``upto`` gives the table as it was before that stage. With
+    ``resample`` a raw capture is put on a uniform time grid (resample_grid.py)
+    and its sampling report is added as the "Sampling_Report" sheet; stores
+    are already ingested and are read as they are.
+    """
+    if is_store(input_path):
+        reports = {name: read_sheet(input_path, name) for name in list_sheets(input_path)}
+        return read_columns(input_path, upto=upto), reports
+    # The loader already yields datetime and m/s² columns, so 02/03 find nothing to change
+    df = capture_to_dataframe(load_json_capture(input_path))
+    if not resample:
+        return df, {}
+    df, report = resample_grid.resample_to_grid(df)
+    return df, {"Sampling_Report": pd.DataFrame([report])}
+
+
+def split_reports(reports):
+    # A None sheet is one a stage removed
+    sheets = {k: v for k, v in reports.items() if v is None or isinstance(v, pd.DataFrame)}
+    images = {k: v for k, v in reports.items() if not (v is None or isinstance(v, pd.DataFrame))}
+    return sheets, images
+
+
+def stage_signature(script):
+    """(STAGE_VERSION, parameters) of a stage script, as recorded in the manifest."""
+    namespace = vars(load_stage_module(script))
+    return namespace.get("STAGE_VERSION", 1), stage_params(namespace)
+
+
+def source_hash(input_path, upto=None, resample=False):
+    """Content hash of a raw capture, or of the store columns the selected stages start from.
+
+    A resampled raw capture also hashes the grid parameters, so changing them recomputes it.
+    """
+    if is_store(input_path):
+        return inputs_hash(store_file_hashes(input_path), upto=upto)
+    if resample:
+        grid = json.dumps(stage_params(vars(resample_grid)), sort_keys=True)
+        return inputs_hash({"capture": hash_file(input_path), "resample_grid": grid})
+    return hash_file(input_path)
+
+
+def first_changed_stage(output_path, selected, source, output_format="capture"):
+    """Index in ``selected`` of the first stage that must run again, or None if all are current.
+
+    A stage is current when the manifest of the output holds the same version,
+    parameters and, for capture stores, the same input hash. Everything after
+    the first changed stage is recomputed because its input changes with it.
+    """
+    if not os.path.exists(output_path):
+        return 0
+    manifest = load_manifest(output_path)
+    if manifest.get("source_hash") != source:
+        return 0
+
+    file_hashes = store_file_hashes(output_path) if output_format == "capture" else None
+    for i, (_, scripts) in enumerate(selected):
+        for script in scripts:
+            key = stage_key(script)
+            input_hash = inputs_hash(file_hashes, upto=key) if file_hashes is not None else None
+            if not is_stage_current(manifest, key, *stage_signature(script), input_hash):
+                return i
+    return None
+
+
+def record_manifest(output_path, selected, source, output_format="capture"):
+    manifest = load_manifest(output_path)
+    manifest["source_hash"] = source
+    file_hashes = store_file_hashes(output_path) if output_format == "capture" else None
+    for _, scripts in selected:
+        for script in scripts:
+            key = stage_key(script)
+            input_hash = inputs_hash(file_hashes, upto=key) if file_hashes is not None else None
+            manifest["stages"][key] = stage_entry(*stage_signature(script), input_hash)
+    save_manifest(output_path, manifest)
+
+
+def profile_path(output_path, stage):
+    """Where the profile of one stage of one capture goes: a ``profiles`` folder next to the output."""
+    name = os.path.basename(output_path.rstrip(os.sep))
+    name = name[:-len(STORE_SUFFIX)] if name.endswith(STORE_SUFFIX) else os.path.splitext(name)[0]
+    return os.path.join(os.path.dirname(output_path), PROFILE_DIR, f"{name}.{stage}.prof")
+
+
+def process_capture(input_path, output_path, stages=None, output_format="capture", force=False, resample=False,
+                    plots=True, profile=None):
+    """Load one capture, run the stages and write the result once.
+
+    Stages that already ran on the same input with the same version and
+    parameters are skipped using the output's manifest; a capture store is
+    resumed from the first changed stage. ``resample`` puts raw captures on a
+    uniform time grid first; ``plots=False`` skips the plot images, and the
+    stages named in ``profile`` are profiled (see profile_path). Returns
+    False when nothing had to run.
+    """
+    selected = select_stages(stages)
+    from_store = is_store(input_path)
+    source = source_hash(input_path, upto=stage_key(selected[0][1][0]), resample=resample)
+    start = 0 if force else first_changed_stage(output_path, selected, source, output_format)
+    if start is None:
+        return False
+
+    resume = start > 0 and output_format == "capture"
+    if not resume:
+        start = 0
+    reruns = [stage_key(script) for _, scripts in selected[start:] for script in scripts]
+    with step("load") as record:
+        if resume:
+            # Earlier stages are unchanged: start from the output as it was before the first changed stage
+            df, reports = load_capture(output_path, upto=reruns[0])
+        else:
+            # A store input may already hold the output of the selected stages; start from before them
+            df, reports = load_capture(input_path, upto=reruns[0] if from_store else None, resample=resample)
+        record["rows"] = len(df)
+    ingested = df.copy()
+
+    profile = {name: profile_path(output_path, name) for name in (profile or [])}
+    df, reports, written = run_stages(df, [name for name, _ in selected[start:]], reports, input_path, plots, profile)
+    sheets, images = split_reports(reports)
+    with step("wait-plots"):
+        # Plots render in the background during the stages; this is what is left of it
+        images = {name: list(buffers) for name, buffers in images.items()}
+
+    with step("write", rows=len(df)):
+        if output_format == "excel":
+            write_excel(output_path, df, sheets, images)
+        else:
+            stage_frames = {} if from_store or resume else {stage_key(INGEST_SCRIPT): ingested}
+            stage_frames.update(written)
+            base_store = output_path if resume else (input_path if from_store else None)
+            # Old files of the recomputed stages must not outlive them (a stage may no longer write a column)
+            write_capture(output_path, stage_frames, sheets, images, base_store=base_store, replace_stages=reruns)
+
+    record_manifest(output_path, selected, source, output_format)
+    return True
+
+
+def find_captures(input_root):
+    """Raw captures (JSON or .acz) and capture stores below ``input_root``, in a stable order.
+
+    A capture present as both <stem>.json and <stem>.acz is taken once, as the
+    .acz, since both map to the same output.
+    """
+    captures = []
+    for dirpath, dirnames, filenames in os.walk(input_root):
+        captures += [os.path.join(dirpath, d) for d in dirnames if d.endswith(STORE_SUFFIX)]
+        dirnames[:] = sorted(d for d in dirnames if not d.endswith(STORE_SUFFIX))
+        captures += [os.path.join(dirpath, f) for f in filenames if f.endswith((".json", COMPACT_SUFFIX))]
+    return one_per_capture(sorted(captures))
+
+
+def output_path_for(input_path, input_root, output_root, output_format="capture"):
+    rel = os.path.relpath(input_path, input_root)
+    base = os.path.splitext(rel)[0] if not rel.endswith(STORE_SUFFIX) else rel[:-len(STORE_SUFFIX)]
+    suffix = ".xlsx" if output_format == "excel" else STORE_SUFFIX
+    return os.path.join(output_root, base + suffix)
+
+
+def process_into_root(input_path, input_root, output_root, stages=None, output_format="capture", force=False,
+                      resample=False, plots=True, profile=None):
+    """Process one capture found under ``input_root`` into the mirrored output path."""
+    output_path = output_path_for(input_path, input_root, output_root, output_format)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if process_capture(input_path, output_path, stages, output_format, force, resample, plots, profile):
+        print(f"✅ {os.path.relpath(input_path, input_root)} → {output_path}")
+    else:
+        print(f"⏭️ Unchanged, skipped: {os.path.relpath(input_path, input_root)}")
+    return output_path
+
+
+def run_pipeline(input_root, output_root, stages=None, output_format="capture", workers=None, force=False,
+                 resample=False, plots=True, report=None, profile=None, catalog=None):
+    """Run the selected stages for every capture under ``input_root``.
+
+    Captures are processed on ``workers`` processes (all cores by default, 1 for
+    serial). Captures and stages that are unchanged since the last run are
+    skipped unless ``force`` is set. With ``resample`` raw captures are put on
+    a uniform time grid before the first stage, and ``plots=False`` skips the
+    plot images for batch runs. ``report`` is a JSON or CSV file for the
+    timed steps of every capture (instrumentation.py); the stages in
+    ``profile`` are profiled per capture. With ``catalog`` (a catalog file,
+    or True for the default one in ``input_root``) the capture catalog and
+    its processing status are updated after the run. Returns a list of
+    (input path, output path or None, error or None) in input order.
+    """
+    select_stages(stages)
+    if profile:
+        select_stages(profile)
+    results = run_parallel(process_into_root, find_captures(input_root), workers=workers,
+                           args=(input_root, output_root, stages, output_format, force, resample, plots, profile),
+                           label="capture", report=report)
+    if catalog:
+        update_catalog(input_root, output_root, None if catalog is True else catalog, output_format)
+    return [(r.path, r.value, r.error) for r in results]
+
+
+def measure_pipeline_speedup(input_root, output_root, stages=None, output_format="capture", workers=None,
+                             resample=False, plots=True):
+    """Run the pipeline serially and then on ``workers`` processes and print the measured speedup.
+
+    Both runs are forced, so the second one recomputes every capture instead
+    of finding the outputs of the first one current.
+    """
+    select_stages(stages)
+    result = measure_speedup(process_into_root, find_captures(input_root), workers=workers,
+                             args=(input_root, output_root, stages, output_format, True, resample, plots, None),
+                             label="capture")
+    print(f"\n⏱️ Measured: serial {result['serial_seconds']:.1f}s, {result['workers']} worker(s) "
+          f"{result['parallel_seconds']:.1f}s, speedup {result['speedup']:.2f}x")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pump health pipeline in memory, one read and one write per capture.")
+    parser.add_argument("input_root", help="folder with raw JSON captures or capture stores")
+    parser.add_argument("output_root", help="folder for the results (mirrors the input layout)")
+    parser.add_argument("--stages", help=f"comma-separated subset of: {','.join(STAGE_NAMES)}")
+    parser.add_argument("--format", choices=["capture", "excel"], default="capture", help="output format")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: all cores, 1 = serial)")
+    parser.add_argument("--force", action="store_true", help="ignore the manifests and recompute everything")
+    parser.add_argument("--resample", action="store_true",
+                        help="put raw captures on a uniform time grid first (see resample_grid.py)")
+    parser.add_argument("--no-plots", action="store_true", help="skip the plot images (faster batch runs)")
+    parser.add_argument("--report", help="write the timing of every stage and step to this .json or .csv file")
+    parser.add_argument("--profile", help="comma-separated stages to profile (files in a 'profiles' folder next to "
+                                          "the outputs)")
+    parser.add_argument("--catalog", nargs="?", const=True,
+                        help="update the capture catalog after the run (default file: <input_root>/catalog.sqlite)")
+    parser.add_argument("--measure-speedup", action="store_true",
+                        help="run everything serially, then with --workers, and print the measured speedup")
+    args = parser.parse_args(argv)
+
+    stages = args.stages.split(",") if args.stages else None
+    profile = args.profile.split(",") if args.profile else None
+    if args.measure_speedup:
+        measure_pipeline_speedup(args.input_root, args.output_root, stages, args.format, args.workers,
+                                 args.resample, not args.no_plots)
+        return
+    run_pipeline(args.input_root, args.output_root, stages, args.format, args.workers, args.force, args.resample,
+                 not args.no_plots, args.report, profile, args.catalog)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import os
+import json
+from parallel_executor import run_parallel
+from quantile_sketch import TDigest, capture_id
+
+# === CONFIGURATION ===
+MODEL_VERSION = 1
+SCORING_SCRIPT = "15_final_score_label.py"
+
+# Persisted scoring model for 15_final_score_label.py. Normally every score in
+# a capture depends on the whole capture (min-max ranges of the FFT features,
+# the largest recurrence score, label cut-points at its own 50/75/95th
+# percentiles), so adding data changes all of them. A model fixes these from
+# baseline captures:
+#
+#   {"version": 1, "frequency_source": "fft", "recurrence_max": 41.0,
+#    "feature_ranges": {"x_mps2_total_power": [0.0, 812.4], ...},
+#    "weights": {"time_series_score": 0.5, ...},
+#    "cut_points": [0.21, 0.27, 0.41], "captures": ["ac1_1712909109__machine-...", ...]}
+#
+# and each row is then scored from its own values with a few arithmetic
+# operations and one binary search, in batch or on small streaming batches.
+# Fitting takes two passes: the ranges and recurrence maximum are merged first
+# (min/max), then every baseline capture is scored with them and its
+# Final_score values are merged into one t-digest for the cut-points.
+
+
+def _scoring():
+    # Imported on first use: the stage script itself imports this module
+    from run_pipeline import load_stage_module
+    return load_stage_module(SCORING_SCRIPT)
+
+
+_cache = {}
+
+
+def load_model(model_path):
+    """The scoring model at ``model_path`` (re-read when the file changes), or None."""
+    if not model_path or not os.path.exists(model_path):
+        return None
+    mtime = os.path.getmtime(model_path)
+    if _cache.get(model_path, (None,))[0] != mtime:
+        with open(model_path, "r") as f:
+            _cache[model_path] = (mtime, json.load(f))
+    return _cache[model_path][1]
+
+
+def save_model(model_path, model):
+    tmp_path = model_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(model, f, indent=1)
+    os.replace(tmp_path, model_path)
+
+
+def capture_ranges(path):
+    """Pass 1: feature ranges and the largest recurrence score of one capture."""
+    stage = _scoring()
+    df_main, df_fft, df_spec = stage.load_inputs(path)
+    df_freq = df_spec if stage.FREQUENCY_SOURCE == "spectrogram" and df_spec is not None else df_fft
+    return {
+        "feature_ranges": stage.column_ranges(df_freq, stage.frequency_features(df_freq)),
+        "recurrence_max": float(df_main['recurrence_score'].max()),
+    }
+
+
+def capture_score_digest(path, model):
+    """Pass 2: t-digest of the Final_score values of one capture scored with ``model``."""
+    stage = _scoring()
+    df_main = stage.score_dataframe(*stage.load_inputs(path), model)
+    return TDigest().update(df_main['Final_score'].to_numpy(dtype=float)).to_dict()
+
+
+def merge_ranges(parts):
+    ranges = {}
+    for part in parts:
+        for col, (lo, hi) in part.items():
+            old = ranges.get(col, [lo, hi])
+            ranges[col] = [min(old[0], lo), max(old[1], hi)]
+    return ranges
+
+
+def fit_model(root_folder, model_path, workers=None):
+    """Fit a scoring model on every scored capture below ``root_folder`` and save it."""
+    stage = _scoring()
+    paths = list(stage.iter_inputs(root_folder))
+    first = [r for r in run_parallel(capture_ranges, paths, workers=workers, label="capture") if r.ok]
+    if not first:
+        raise ValueError(f"No capture below {root_folder} could be read for fitting")
+    model = {
+        "version": MODEL_VERSION,
+        "frequency_source": stage.FREQUENCY_SOURCE,
+        "recurrence_max": max(r.value["recurrence_max"] for r in first),
+        "feature_ranges": merge_ranges(r.value["feature_ranges"] for r in first),
+        "weights": dict(stage.TIME_DOMAIN_WEIGHTS),
+        "label_quantiles": list(stage.LABEL_QUANTILES),
+    }
+
+    second = run_parallel(capture_score_digest, [r.path for r in first], workers=workers,
+                          args=(model,), label="capture")
+    digest = TDigest()
+    for r in second:
+        if r.ok:
+            digest.merge(TDigest.from_dict(r.value))
+    model["cut_points"] = [float(v) for v in digest.quantile(stage.LABEL_QUANTILES)]
+    model["captures"] = [capture_id(r.path) for r in second if r.ok]
+    save_model(model_path, model)
+    print(f"📦 Fitted scoring model on {len(model['captures'])} capture(s): {model_path}")
+    return model
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+
+    # Fit on scored baseline captures, then set SCORE_MODEL_FILE in 15_final_score_label.py
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    model_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(root, "score_model.json")
+    model = fit_model(root, model_path)
+    print("   cut-points: " + ", ".join(f"{label} > {cut:.4f}"
+                                        for label, cut in zip(_scoring().LABELS[1:], model["cut_points"])))
@@ -0,0 +1,284 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from itertools import combinations
+from capture_loader import AXES, G_TO_MPS2, capture_to_dataframe, load_capture
+from capture_catalog import raw_captures
+from columnar_store import STORE_SUFFIX, write_capture
+from instrumentation import collect, print_summary, step
+from parallel_executor import run_parallel
+
+# === CONFIGURATION ===
+COMPONENTS = ["Motor", "Gearbox", "Blower"]   # component folders of a condition folder
+REFERENCE = "Motor"         # shared timeline: the sample times of this component (else the first one found)
+TOLERANCE_MS = 50           # largest distance to a matched sample (the usual 49 ms interval)
+DIRECTION = "nearest"       # as in pandas.merge_asof: "backward", "forward" or "nearest"
+WINDOW_SECONDS = 10         # cross-sensor correlation windows, the 10 s intervals of the FFT stage
+ALIGNED_STAGE = "00_sensor_alignment"   # column file of the aligned table in the output store
+
+# Alignment of the Motor, Gearbox and Blower sensors of one condition folder.
+# The captures of each component are concatenated in time order (rows that
+# overlap an earlier capture are dropped), then every component is joined
+# onto the reference component's timeline with an as-of merge: for each
+# reference time the nearest (or last/next) sample within TOLERANCE_MS.
+# The merge is np.searchsorted on the sorted timestamps, so it produces index
+# arrays and gathers each column once; it matches pandas.merge_asof but does
+# not build or sort a DataFrame per component. Rows where a component has no
+# sample within the tolerance are dropped, so every row holds all sensors.
+#
+# The pipeline stages then run on each component as it is on the shared
+# timeline (rolling stats, FFT, scoring and everything they depend on), so
+# their outputs line up row for row and window for window. The result is one
+# capture store per condition with <Component>_<column> columns, the stage
+# sheets as <Component>_<sheet>, a "Cross_Sensor" sheet with the correlation
+# of the acceleration magnitude between every pair of components per
+# WINDOW_SECONDS window, and a Drive_train_score column (the worst
+# component's Final_score).
+
+
+def component_series(paths):
+    """Captures of one component concatenated in time order: {"timestamp", "x", "y", "z"} arrays."""
+    captures = sorted((load_capture(p) for p in paths), key=lambda c: c["timestamp"][0] if len(c["timestamp"]) else 0)
+    parts, last = [], None
+    for capture in captures:
+        order = np.argsort(capture["timestamp"], kind="stable")
+        if last is not None:
+            order = order[capture["timestamp"][order] > last]
+        if len(order):
+            parts.append({name: capture[name][order] for name in ["timestamp"] + AXES})
+            last = parts[-1]["timestamp"][-1]
+    if not parts:
+        return {"timestamp": np.empty(0, dtype=np.int64), **{axis: np.empty(0) for axis in AXES}}
+    return {name: np.concatenate([p[name] for p in parts]) for name in ["timestamp"] + AXES}
+
+
+def asof_indices(left, right, tolerance=TOLERANCE_MS, direction=DIRECTION):
+    """Index into sorted ``right`` of the as-of match of every ``left`` value, -1 where none is within ``tolerance``."""
+    n = len(right)
+    if n == 0:
+        return np.full(len(left), -1, dtype=np.int64)
+    back = np.searchsorted(right, left, side="right") - 1
+    fwd = np.searchsorted(right, left, side="left")
+    back_dist = np.where(back >= 0, left - right[np.maximum(back, 0)], np.iinfo(np.int64).max)
+    fwd_dist = np.where(fwd < n, right[np.minimum(fwd, n - 1)] - left, np.iinfo(np.int64).max)
+    if direction == "backward":
+        idx, dist = back, back_dist
+    elif direction == "forward":
+        idx, dist = fwd, fwd_dist
+    elif direction == "nearest":
+        # Ties go to the earlier sample, as in merge_asof
+        use_fwd = fwd_dist < back_dist
+        idx, dist = np.where(use_fwd, fwd, back), np.where(use_fwd, fwd_dist, back_dist)
+    else:
+        raise ValueError(f"Unknown direction '{direction}'. Choose from: backward, forward, nearest")
+    return np.where(dist <= tolerance, idx, -1)
+
+
+def align_components(series, reference=REFERENCE, tolerance=TOLERANCE_MS, direction=DIRECTION):
+    """Join every component of ``series`` {component: arrays} onto the reference's timeline.
+
+    Returns the aligned DataFrame (timestamp, datetime, <Component>_x/y/z in g)
+    and an alignment report with one row per component.
+    """
+    reference = reference if reference in series else next(iter(series))
+    timeline = series[reference]["timestamp"]
+    indices = {name: (np.arange(len(timeline)) if name == reference else
+                      asof_indices(timeline, s["timestamp"], tolerance, direction))
+               for name, s in series.items()}
+    keep = np.logical_and.reduce([idx >= 0 for idx in indices.values()])
+
+    columns = {"timestamp": timeline[keep]}
+    columns["datetime"] = columns["timestamp"].astype("datetime64[ms]")
+    report = []
+    for name, s in series.items():
+        idx = indices[name][keep]
+        for axis in AXES:
+            columns[f"{name}_{axis}"] = s[axis][idx]
+        lag = np.abs(s["timestamp"][idx] - columns["timestamp"]) if len(idx) else np.zeros(0)
+        report.append({"component": name, "samples": len(s["timestamp"]),
+                       "matched": int((indices[name] >= 0).sum()), "aligned_rows": int(keep.sum()),
+                       "mean_lag_ms": float(lag.mean()) if len(lag) else np.nan,
+                       "max_lag_ms": int(lag.max()) if len(lag) else 0})
+    return pd.DataFrame(columns), pd.DataFrame(report)
+
+
+def component_frame(aligned, component):
+    """One component of the aligned table in the loader's layout, so the stage scripts can run on it."""
+    capture = {"timestamp": aligned["timestamp"].to_numpy(), "datetime": aligned["datetime"].to_numpy()}
+    for axis in AXES:
+        capture[axis] = aligned[f"{component}_{axis}"].to_numpy()
+        capture[f"{axis}_mps2"] = capture[axis] * G_TO_MPS2
+    return capture_to_dataframe(capture)
+
+
+def cross_sensor_features(aligned, components, window_seconds=WINDOW_SECONDS):
+    """Per window: samples and the Pearson correlation of the acceleration magnitude for every component pair."""
+    timestamp = aligned["timestamp"].to_numpy()
+    if not len(timestamp):
+        return pd.DataFrame()
+    window_ms = int(window_seconds * 1000)
+    starts, window_ids = np.unique(timestamp // window_ms, return_inverse=True)
+    n = np.bincount(window_ids, minlength=len(starts)).astype(float)
+    magnitude = {c: np.sqrt(sum(aligned[f"{c}_{axis}"].to_numpy(dtype=float) ** 2 for axis in AXES)) * G_TO_MPS2
+                 for c in components}
+    sums = {c: np.bincount(window_ids, m, len(starts)) for c, m in magnitude.items()}
+    squares = {c: np.bincount(window_ids, m * m, len(starts)) for c, m in magnitude.items()}
+
+    columns = {"datetime": (starts * window_ms).astype("datetime64[ms]"), "samples": n.astype(int)}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for a, b in combinations(components, 2):
+            cross = np.bincount(window_ids, magnitude[a] * magnitude[b], len(starts))
+            cov = cross - sums[a] * sums[b] / n
+            var_a = squares[a] - sums[a] ** 2 / n
+            var_b = squares[b] - sums[b] ** 2 / n
+            columns[f"{a}_{b}_corr"] = cov / np.sqrt(var_a * var_b)
+    return pd.DataFrame(columns)
+
+
+def find_components(condition_folder, components=COMPONENTS):
+    """{component: sorted raw capture paths} for the component folders present."""
+    found = {}
+    for name in components:
+        folder = os.path.join(condition_folder, name)
+        if os.path.isdir(folder):
+            paths = sorted(os.path.join(folder, rel) for rel in raw_captures(folder))
+            if paths:
+                found[name] = paths
+    return found
+
+
+def process_condition(condition_folder, output_path, stages=None, plots=True):
+    """Align the sensors of one condition folder, run the stages per component and write one capture store."""
+    from run_pipeline import run_stages, split_reports
+
+    found = find_components(condition_folder)
+    if len(found) < 2:
+        raise ValueError(f"{condition_folder}: needs at least two of {', '.join(COMPONENTS)} with captures")
+    with step("align-load") as record:
+        series = {name: component_series(paths) for name, paths in found.items()}
+        record["rows"] = sum(len(s["timestamp"]) for s in series.values())
+    with step("align-merge") as record:
+        aligned, alignment_report = align_components(series)
+        record["rows"] = len(aligned)
+    del series
+
+    sheets = {"Alignment_Report": alignment_report}
+    images = {}
+    outputs, scores = [aligned], []
+    for name in found:
+        with step(name, rows=len(aligned)):
+            df, reports, _ = run_stages(component_frame(aligned, name), stages, plots=plots)
+        df = df.drop(columns=["timestamp", "datetime"] + [a for a in AXES if a in df.columns])
+        outputs.append(df.add_prefix(f"{name}_").set_axis(aligned.index))
+        if "Final_score" in df.columns:
+            scores.append(df["Final_score"].to_numpy())
+        component_sheets, component_images = split_reports(reports)
+        sheets.update({f"{name}_{sheet}": frame for sheet, frame in component_sheets.items()})
+        images.update({f"{name}_{sheet}": buffers for sheet, buffers in component_images.items()})
+
+    if scores:
+        outputs.append(pd.DataFrame({"Drive_train_score": np.max(scores, axis=0)}, index=aligned.index))
+    aligned = pd.concat(outputs, axis=1)
+    del outputs
+    with step("align-cross", rows=len(aligned)):
+        sheets["Cross_Sensor"] = cross_sensor_features(aligned, list(found))
+
+    with step("wait-plots"):
+        images = {name: list(buffers) for name, buffers in images.items()}
+    with step("write", rows=len(aligned)):
+        aligned.attrs = {}
+        write_capture(output_path, {ALIGNED_STAGE: aligned}, sheets, images)
+    return output_path
+
+
+def find_conditions(input_root, components=COMPONENTS):
+    """Folders below ``input_root`` holding at least two component folders, in a stable order."""
+    found = []
+    for dirpath, dirnames, _ in os.walk(input_root):
+        dirnames.sort()
+        if sum(name in dirnames for name in components) >= 2:
+            found.append(dirpath)
+    return found
+
+
+def process_condition_into_root(condition_folder, input_root, output_root, stages=None, plots=True):
+    rel = os.path.relpath(condition_folder, input_root)
+    output_path = os.path.join(output_root, ("aligned" if rel == "." else rel) + STORE_SUFFIX)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    process_condition(condition_folder, output_path, stages, plots)
+    print(f"✅ {rel} → {output_path}")
+    return output_path
+
+
+def align_conditions(input_root, output_root, stages=None, workers=None, plots=True, report=None):
+    """Align every condition folder under ``input_root`` into ``output_root`` (one store per condition)."""
+    results = run_parallel(process_condition_into_root, find_conditions(input_root), workers=workers,
+                           args=(input_root, output_root, stages, plots), label="condition", report=report)
+    return [(r.path, r.value, r.error) for r in results]
+
+
+def _merge_asof_pandas(series, reference=REFERENCE, tolerance=TOLERANCE_MS, direction=DIRECTION):
+    # The same join with pandas.merge_asof, for the benchmark
+    reference = reference if reference in series else next(iter(series))
+    merged = pd.DataFrame({"timestamp": series[reference]["timestamp"],
+                           **{f"{reference}_{a}": series[reference][a] for a in AXES}})
+    for name, s in series.items():
+        if name != reference:
+            right = pd.DataFrame({"timestamp": s["timestamp"], **{f"{name}_{a}": s[a] for a in AXES}})
+            merged = pd.merge_asof(merged, right, on="timestamp", tolerance=tolerance, direction=direction)
+    return merged.dropna().reset_index(drop=True)
+
+
+def benchmark(condition_folder, output_path=None, stages=None):
+    """Time and peak memory of aligning one condition folder and running the stages on it.
+
+    Also runs the join with pandas.merge_asof and checks that both give the
+    same table.
+    """
+    import tempfile
+    found = find_components(condition_folder)
+    series = {name: component_series(paths) for name, paths in found.items()}
+    t0 = time.perf_counter()
+    aligned, _ = align_components(series)
+    numpy_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    merged = _merge_asof_pandas(series)
+    pandas_seconds = time.perf_counter() - t0
+    same = merged.columns.tolist() == aligned.drop(columns="datetime").columns.tolist() and all(
+        np.array_equal(merged[c].to_numpy(), aligned[c].to_numpy()) for c in merged.columns)
+    rows = sum(len(s["timestamp"]) for s in series.values())
+    print(f"🔗 {len(found)} components, {rows} samples → {len(aligned)} aligned rows")
+    print(f"   searchsorted join: {numpy_seconds * 1000:7.1f} ms ({rows / numpy_seconds:,.0f} samples/s), "
+          f"merge_asof: {pandas_seconds * 1000:7.1f} ms, same result: {same}")
+    print(f"   aligned table: {aligned.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+    del series, merged, aligned
+
+    with tempfile.TemporaryDirectory() as folder, collect() as records:
+        process_condition(condition_folder, output_path or os.path.join(folder, "aligned" + STORE_SUFFIX), stages,
+                          plots=False)
+    total = sum(r["wall_s"] for r in records if "/" not in r["step"])
+    print(f"⏱️ Whole condition: {total:.2f} s, peak RSS {max(r['peak_rss_mb'] or 0.0 for r in records):.0f} MB")
+    print_summary([r for r in records if "/" not in r["step"]], top=12)
+    return records
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Align the Motor, Gearbox and Blower sensors of each condition folder.")
+    parser.add_argument("input_root", help="raw data root, or one condition folder")
+    parser.add_argument("output_root", nargs="?", help="folder for the aligned capture stores")
+    parser.add_argument("--stages", help="comma-separated pipeline stages to run per component (default: all)")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: all cores, 1 = serial)")
+    parser.add_argument("--no-plots", action="store_true", help="skip the plot images")
+    parser.add_argument("--report", help="write the timing of every step to this .json or .csv file")
+    parser.add_argument("--benchmark", action="store_true", help="time and measure one condition folder")
+    args = parser.parse_args()
+
+    stages = args.stages.split(",") if args.stages else None
+    if args.benchmark:
+        benchmark(args.input_root, stages=stages)
+    else:
+        align_conditions(args.input_root, args.output_root, stages, args.workers, not args.no_plots, args.report)
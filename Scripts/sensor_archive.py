@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from capture_loader import load_capture
+from capture_catalog import NAME_PATTERN, raw_captures, scan_capture
+
+# === CONFIGURATION ===
+ARCHIVE_FILE = "archive.json"
+COLUMNS = {"timestamp": "int64", "x": "float64", "y": "float64", "z": "float64"}   # epoch ms, g
+INDEX_STRIDE = 4096   # one (timestamp, row) index entry every INDEX_STRIDE rows
+
+# One append-only archive per machine/sensor holding all of its captures as
+# concatenated columns: <archive root>/<machine>-<sensor>/ with one raw binary
+# file per column (timestamp.int64, x.float64, ...) that np.memmap opens
+# directly, a sparse index (index.int64: the timestamp of every
+# INDEX_STRIDE-th row) and archive.json with the committed row count and the
+# captures appended so far.
+#
+# Rows are kept in time order. A capture is appended by writing to the end of
+# the column files; rows at or before the archive's last timestamp (captures
+# that overlap, or the same capture filed under two folders) are skipped and
+# counted, and a capture that was already appended is skipped entirely.
+# archive.json is replaced last, so bytes past its row count (an interrupted
+# append) are cut off by the next append. read_range() finds a time range with
+# the sparse index, narrows it inside one index block, and returns slices of
+# the memory maps: NumPy views, nothing is copied or read beyond the touched
+# pages.
+
+
+def archive_dir_for(archive_root, machine, sensor):
+    return os.path.join(archive_root, f"{machine}-{sensor}")
+
+
+def _column_path(path, name):
+    return os.path.join(path, f"{name}.{COLUMNS[name]}")
+
+
+def load_meta(path):
+    meta_path = os.path.join(path, ARCHIVE_FILE)
+    if not os.path.exists(meta_path):
+        return {"rows": 0, "index_stride": INDEX_STRIDE, "columns": COLUMNS, "segments": []}
+    with open(meta_path, "r") as f:
+        return json.load(f)
+
+
+def _save_meta(path, meta):
+    meta_path = os.path.join(path, ARCHIVE_FILE)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def _append_file(file_path, committed_bytes, data):
+    with open(file_path, "ab") as f:
+        f.truncate(committed_bytes)
+        f.write(np.ascontiguousarray(data).tobytes())
+
+
+def append_capture(path, json_path, source=None):
+    """Append one raw capture to the archive at ``path``; returns the number of rows added.
+
+    ``source`` (default: the file name) identifies the capture in archive.json,
+    so appending it again is a no-op.
+    """
+    source = source or os.path.basename(json_path)
+    os.makedirs(path, exist_ok=True)
+    meta = load_meta(path)
+    if any(segment["source"] == source for segment in meta["segments"]):
+        return 0
+
+    capture = load_capture(json_path)
+    timestamp = capture["timestamp"]
+    order = np.argsort(timestamp, kind="stable")
+    rows = meta["rows"]
+    last_ms = meta["segments"][-1]["last_ms"] if rows else None
+    if last_ms is not None:
+        order = order[timestamp[order] > last_ms]
+
+    stride = meta["index_stride"]
+    if len(order):
+        columns = {"timestamp": timestamp[order], **{axis: capture[axis][order] for axis in ("x", "y", "z")}}
+        for name, values in columns.items():
+            itemsize = np.dtype(COLUMNS[name]).itemsize
+            _append_file(_column_path(path, name), rows * itemsize, values.astype(COLUMNS[name], copy=False))
+        # Index entries for the rows rows, rows + 1, ... that fall on the stride
+        first_entry = -(-rows // stride)
+        positions = np.arange(first_entry * stride, rows + len(order), stride)
+        _append_file(os.path.join(path, "index.int64"), first_entry * 8, columns["timestamp"][positions - rows])
+
+    meta["segments"].append({
+        "source": source,
+        "first_row": rows,
+        "rows": int(len(order)),
+        "skipped_rows": int(len(timestamp) - len(order)),
+        "first_ms": int(timestamp[order[0]]) if len(order) else None,
+        "last_ms": int(timestamp[order[-1]]) if len(order) else last_ms,
+    })
+    meta["rows"] = rows + int(len(order))
+    _save_meta(path, meta)
+    return int(len(order))
+
+
+class SensorArchive:
+    """Read-only view of one sensor archive; columns are np.memmap arrays of the committed rows."""
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = load_meta(path)
+        self.rows = self.meta["rows"]
+        self.columns = {}
+        for name, dtype in self.meta["columns"].items():
+            self.columns[name] = (np.memmap(_column_path(path, name), dtype=dtype, mode="r", shape=(self.rows,))
+                                  if self.rows else np.empty(0, dtype=dtype))
+        n_index = -(-self.rows // self.meta["index_stride"])
+        self.index = np.fromfile(os.path.join(path, "index.int64"), dtype=np.int64, count=n_index) \
+            if self.rows else np.empty(0, dtype=np.int64)
+
+    def row_range(self, start_ms=None, end_ms=None):
+        """(first, stop) rows with start_ms <= timestamp <= end_ms."""
+        return (self._search(start_ms, "left") if start_ms is not None else 0,
+                self._search(end_ms, "right") if end_ms is not None else self.rows)
+
+    def _search(self, value, side):
+        # The sparse index gives the block, a search inside the block the row
+        stride = self.meta["index_stride"]
+        block = max(int(np.searchsorted(self.index, value, side)) - 1, 0)
+        lo, hi = block * stride, min((block + 2) * stride, self.rows)
+        return lo + int(np.searchsorted(self.columns["timestamp"][lo:hi], value, side))
+
+    def read_range(self, start=None, end=None, columns=None):
+        """{column: view} of the rows between ``start`` and ``end`` (epoch ms or timestamps, inclusive)."""
+        first, stop = self.row_range(_epoch_ms(start), _epoch_ms(end))
+        return {name: self.columns[name][first:stop] for name in (columns or self.columns)}
+
+    def to_dataframe(self, start=None, end=None):
+        """The range as a DataFrame with a datetime column, like a loaded capture (this copies)."""
+        data = self.read_range(start, end)
+        df = pd.DataFrame({name: np.asarray(values) for name, values in data.items()})
+        df.insert(1, "datetime", pd.to_datetime(df["timestamp"], unit="ms"))
+        return df
+
+
+def _epoch_ms(value):
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return int(pd.Timestamp(value).value // 1_000_000)
+
+
+def open_archive(archive_root, machine, sensor):
+    return SensorArchive(archive_dir_for(archive_root, machine, sensor))
+
+
+def build_archives(raw_root, archive_root):
+    """Append every raw capture below ``raw_root`` to the archive of its machine/sensor.
+
+    Captures are appended in order of their first sample, so a fresh build
+    keeps all rows; already appended captures are skipped.
+    """
+    captures = {}
+    for rel in raw_captures(raw_root):
+        match = NAME_PATTERN.match(os.path.basename(rel))
+        captures.setdefault((match["machine"], match["sensor"]), []).append(rel)
+
+    totals = {}
+    for (machine, sensor), rels in sorted(captures.items()):
+        path = archive_dir_for(archive_root, machine, sensor)
+        done = {segment["source"] for segment in load_meta(path)["segments"]}
+        todo = [rel for rel in rels if rel not in done]
+        todo.sort(key=lambda rel: scan_capture(os.path.join(raw_root, rel))["first_ms"] or 0)
+        added = sum(append_capture(path, os.path.join(raw_root, rel), source=rel) for rel in todo)
+        meta = load_meta(path)
+        totals[(machine, sensor)] = meta["rows"]
+        print(f"🗄️ {machine}-{sensor}: {len(todo)} capture(s) appended, {added} rows added, "
+              f"{meta['rows']} rows in total")
+    return totals
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+
+    # python sensor_archive.py <raw root> <archive root>                      build or extend the archives
+    # python sensor_archive.py <archive root> <machine>-<sensor> <start> <end>  time a range read
+    if len(sys.argv) == 3:
+        build_archives(sys.argv[1], sys.argv[2])
+    else:
+        t0 = time.perf_counter()
+        archive = SensorArchive(os.path.join(sys.argv[1], sys.argv[2]))
+        data = archive.read_range(sys.argv[3], sys.argv[4])
+        z_mean = float(np.mean(data["z"])) if len(data["z"]) else float("nan")
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"📖 {len(data['timestamp'])} of {archive.rows} rows in {ms:.1f} ms (mean z {z_mean:.4f} g)")
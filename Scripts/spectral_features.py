@@ -0,0 +1,197 @@
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import rfft, rfftfreq
+from scipy.signal import get_window
+from instrumentation import timed
+
+# === CONFIGURATION ===
+MIN_WINDOW_SAMPLES = 8   # shorter windows get all-zero features
+MAX_FREQUENCY = 10.0     # Hz, upper edge of the analysed spectrum
+RAGGED_WINDOWS = "exact"  # "exact": one batch per distinct window length; "pad": zero-pad to the longest window
+CHUNK_SAMPLES = 1 << 21   # spectrogram windows are transformed in chunks of about this many samples
+
+# Spectral features of many windows at once. Windows of equal length are
+# stacked into a 2-D array, detrended and transformed with one rfft per batch,
+# and every feature is a weighted sum over the power spectrum, so all of them
+# come out of one matrix product with a weight matrix that depends only on the
+# window length (and is built once per length):
+#
+#   features = power @ W,   W[:, 0] = in-range mask         -> total power
+#                           W[:, 1] = frequency * mask      -> centroid numerator
+#                           W[:, 2 + b] = mask of band b    -> band powers
+
+
+@functools.lru_cache(maxsize=256)
+def feature_weights(n, fs, bands, max_frequency=MAX_FREQUENCY):
+    """Weight matrix (n // 2 + 1, 2 + len(bands)) for windows of ``n`` samples."""
+    freqs = rfftfreq(n, d=1 / fs)
+    mask = (freqs > 0) & (freqs <= max_frequency)
+    if n % 2 == 0:
+        # The two-sided FFT lists the Nyquist bin as a negative frequency
+        mask[-1] = False
+    weights = [mask.astype(float), np.where(mask, freqs, 0.0)]
+    weights += [(mask & (freqs >= lo) & (freqs < hi)).astype(float) for lo, hi in bands]
+    return np.stack(weights, axis=1)
+
+
+def detrend_rows(windows, lengths):
+    """Remove the least-squares line from the first ``lengths[i]`` samples of every row.
+
+    The same result as ``scipy.signal.detrend`` per window, for all rows at once;
+    samples beyond a row's length are left at zero.
+    """
+    m, n = windows.shape
+    lengths = np.asarray(lengths, dtype=float)
+    inside = np.arange(n) < lengths[:, None]
+    x = np.where(inside, windows, 0.0)
+    # Centred sample index, so slope and mean are independent
+    t = np.where(inside, np.arange(n) - (lengths[:, None] - 1) / 2, 0.0)
+    mean = x.sum(axis=1) / lengths
+    slope = (t * x).sum(axis=1) / (lengths * (lengths ** 2 - 1) / 12)
+    return np.where(inside, x - mean[:, None] - slope[:, None] * t, 0.0)
+
+
+def _finish(sums):
+    """Turn the centroid numerator into the centroid (0 where there is no power)."""
+    total = sums[:, 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sums[:, 1] = np.where(total > 0, sums[:, 1] / total, 0.0)
+    return sums
+
+
+@timed("fft-windows")
+def window_features(values, window_ids, n_windows, fs, bands, ragged=RAGGED_WINDOWS):
+    """Features of every window of one signal.
+
+    ``values`` is the signal and ``window_ids`` (same length, non-decreasing)
+    the window each sample belongs to; NaN samples are dropped per window.
+    Returns an (n_windows, 2 + len(bands)) array: total power, spectral
+    centroid, then one column per band.
+
+    Windows are packed into one zero-padded 2-D array and detrended together.
+    With ``ragged="exact"`` every distinct window length then gets one rfft
+    over its rows, so each window keeps its own frequency grid and the result
+    matches the per-window computation. ``ragged="pad"`` runs a single rfft
+    over the padded array: faster when lengths vary a lot, but short windows
+    are analysed on the (finer) grid of the longest one, so band edges fall
+    differently and the values are only comparable, not equal.
+    """
+    if ragged not in ("exact", "pad"):
+        raise ValueError(f"Unknown ragged window policy '{ragged}'. Choose from: exact, pad")
+    bands = tuple(tuple(band) for band in bands)
+    values = np.asarray(values, dtype=float)
+    window_ids = np.asarray(window_ids)
+    valid = ~np.isnan(values)
+    values, window_ids = values[valid], window_ids[valid]
+    lengths = np.bincount(window_ids, minlength=n_windows)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    features = np.zeros((n_windows, 2 + len(bands)))
+
+    usable = np.flatnonzero(lengths >= MIN_WINDOW_SAMPLES)
+    if not len(usable):
+        return features
+    n_max = lengths[usable].max()
+    positions = starts[usable][:, None] + np.arange(n_max)
+    padded = values[np.minimum(positions, len(values) - 1)]
+    batch = detrend_rows(padded, lengths[usable])
+
+    if ragged == "pad":
+        power = np.abs(rfft(batch, axis=1)) ** 2
+        # Zero padding spreads a window's power over n_max / n times as many bins
+        sums = (power @ feature_weights(n_max, fs, bands)) * (lengths[usable] / n_max)[:, None]
+        features[usable] = _finish(sums)
+        return features
+
+    for n in np.unique(lengths[usable]):
+        rows = lengths[usable] == n
+        power = np.abs(rfft(batch[rows, :n], axis=1)) ** 2
+        features[usable[rows]] = _finish(power @ feature_weights(int(n), fs, bands))
+    return features
+
+
+@functools.lru_cache(maxsize=32)
+def _taper(name, n):
+    window = get_window(name, n, fftbins=True)
+    window.setflags(write=False)
+    return window
+
+
+@timed("spectrogram")
+def spectrogram_features(values, fs, window, hop, taper="hann", bands=((0, 1), (1, 3), (3, 5), (5, 10))):
+    """Features of overlapping windows (STFT) of one evenly sampled signal.
+
+    Windows of ``window`` samples start every ``hop`` samples. Each is
+    mean-removed and multiplied by the ``taper`` (any scipy.signal.get_window
+    name), and total power (0 < f <= highest band edge), spectral centroid and
+    band powers are computed as in window_features. Returns (start index of
+    every window, (n_windows, 2 + len(bands)) array); windows holding a NaN
+    get NaN features.
+
+    The windows are a strided view of ``values`` and are transformed in
+    chunks of about CHUNK_SAMPLES samples. Only one chunk is ever copied, so
+    memory grows with the output, not with windows × window length. All
+    chunks share one FFT length, so scipy reuses its cached plan.
+    """
+    values = np.asarray(values, dtype=float)
+    bands = tuple(tuple(band) for band in bands)
+    n_features = 2 + len(bands)
+    if window < MIN_WINDOW_SAMPLES or len(values) < window:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, n_features))
+
+    windows = sliding_window_view(values, window)[::hop]
+    starts = np.arange(len(windows)) * hop
+    taper_values = _taper(taper, window)
+    weights = feature_weights(window, fs, bands, max(hi for _, hi in bands))
+    # NaN count per window from a running count
+    nan_count = np.concatenate([[0], np.cumsum(np.isnan(values))])
+    has_nan = nan_count[starts + window] > nan_count[starts]
+
+    features = np.empty((len(windows), n_features))
+    per_chunk = max(1, CHUNK_SAMPLES // window)
+    for first in range(0, len(windows), per_chunk):
+        chunk = windows[first:first + per_chunk]
+        chunk = (chunk - chunk.mean(axis=1, keepdims=True)) * taper_values
+        power = np.abs(rfft(chunk, axis=1)) ** 2
+        features[first:first + per_chunk] = _finish(power @ weights)
+    features[has_nan] = np.nan
+    return starts, features
+
+
+def benchmark(hours=1.0, fs=100.0, window_seconds=10, seed=0):
+    """Time window_features against the per-window fft_features of 14_FFT_feature.py on a synthetic signal."""
+    import time
+    from run_pipeline import load_stage_module
+    stage = load_stage_module("14_FFT_feature.py")
+
+    rng = np.random.default_rng(seed)
+    n = int(hours * 3600 * fs)
+    # Jittered sampling, so windows have slightly different lengths as in real captures
+    t = np.cumsum(rng.uniform(0.5, 1.5, n) / fs)
+    values = np.sin(2 * np.pi * 2.5 * t) + 0.3 * np.sin(2 * np.pi * 7 * t) + rng.normal(0, 0.2, n)
+    window_ids = (t // window_seconds).astype(np.int64)
+    window_ids -= window_ids[0]
+    n_windows = window_ids[-1] + 1
+
+    t0 = time.perf_counter()
+    bounds = np.searchsorted(window_ids, np.arange(n_windows + 1))
+    reference = [stage.fft_features(values[bounds[w]:bounds[w + 1]], fs) for w in range(n_windows)]
+    loop_seconds = time.perf_counter() - t0
+    reference = np.array([[r[name] for name in stage.FEATURE_NAMES] for r in reference], dtype=float)
+
+    timings = {}
+    for ragged in ("exact", "pad"):
+        t0 = time.perf_counter()
+        features = window_features(values, window_ids, n_windows, fs, stage.BANDS, ragged=ragged)
+        timings[ragged] = time.perf_counter() - t0
+        diff = np.abs(features - reference) / np.maximum(np.abs(reference), 1e-12)
+        print(f"{ragged:>5}: {timings[ragged] * 1000:7.1f} ms, {loop_seconds / timings[ragged]:5.1f}x faster, "
+              f"relative difference median {np.median(diff):.1e}")
+    print(f" loop: {loop_seconds * 1000:7.1f} ms for {n_windows} windows x 1 axis ({n} samples)")
+    return loop_seconds, timings
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+    benchmark(hours=float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
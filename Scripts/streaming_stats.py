@@ -0,0 +1,280 @@
+import math
+import time
+import functools
+import numpy as np
+
+# === CONFIGURATION ===
+# Window length, thresholds and axes (WINDOW_SIZE, RMS_STD_MULTIPLIER,
+# KURTOSIS_FIXED_THRESHOLD, PERCENTILE, AXES) are those of the batch stage,
+# read from it when a StreamingMoments/StreamingScorer is created
+BATCH_STAGE = "08_time_series.py"
+VARIANCE_EPSILON = 1e-14
+_EXPONENTS = np.arange(5.0)[:, None]
+
+# Streaming counterpart of 08_time_series.py: samples are pushed one at a time,
+# a ring buffer keeps the last WINDOW_SIZE of them, and running sums of x, x²,
+# x³ and x⁴ give the window RMS and kurtosis in O(1). The flag thresholds come
+# from online estimators (Welford mean/std and P² quantiles) instead of the
+# whole column, so memory does not grow with the length of the feed. The
+# running sums are recomputed from the buffer once per window to stop
+# rounding drift. A window of one repeated value has kurtosis -3, as in the
+# batch stage (rolling_stats.rolling_moments).
+
+
+@functools.lru_cache(maxsize=1)
+def batch_stage():
+    """The batch stage module, imported on first use (the runner is only needed then)."""
+    from run_pipeline import load_stage_module
+    return load_stage_module(BATCH_STAGE)
+
+
+class RunningMeanStd:
+    """Welford's online mean and sample standard deviation."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else float("nan")
+
+
+class P2Quantile:
+    """P² estimate of one quantile with five markers (Jain & Chlamtac, 1985)."""
+
+    def __init__(self, p):
+        self.p = p
+        self._initial = []
+        self._q = None
+        self._n = [0, 1, 2, 3, 4]
+        self._desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self._step = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def update(self, x):
+        if self._q is None:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                self._q = sorted(self._initial)
+            return
+
+        q, n = self._q, self._n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._step[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    @property
+    def value(self):
+        if self._q is not None:
+            return self._q[2]
+        if not self._initial:
+            return float("nan")
+        return float(np.quantile(self._initial, self.p))
+
+
+class StreamingMoments:
+    """RMS and excess kurtosis over the last ``window`` samples of several channels."""
+
+    def __init__(self, window=None, channels=None):
+        window = window or batch_stage().WINDOW_SIZE
+        channels = channels or len(batch_stage().AXES)
+        self.window = window
+        self._buffer = np.zeros((window, channels))
+        self._run = np.zeros(channels, dtype=np.int64)  # samples of the current constant run per channel
+        self._missing = np.zeros((window, channels), dtype=bool)
+        self._pos = 0
+        self._seen = 0
+        self._shift = None
+        self._sums = np.zeros((5, channels))  # count-free sums of x⁰..x⁴ of the shifted values
+        self._raw_sq = np.zeros(channels)
+
+    def _powers(self, shifted):
+        return shifted[..., None, :] ** _EXPONENTS
+
+    def _resync(self):
+        # Missing values are stored as the shift, so they add nothing to x¹..x⁴
+        seen = min(self._seen, self.window)
+        values, missing = self._buffer[:seen], self._missing[:seen]
+        self._sums = self._powers(values - self._shift).sum(axis=0)
+        self._raw_sq = np.where(missing, 0.0, values * values).sum(axis=0)
+
+    def push(self, sample):
+        """Add one sample (one value per channel); returns (rms, kurt) or None until the window is full."""
+        sample = np.asarray(sample, dtype=float)
+        missing = np.isnan(sample)
+        if self._shift is None:
+            self._shift = np.where(missing, 0.0, sample)
+        sample = np.where(missing, self._shift, sample)
+
+        if self._seen >= self.window:
+            old, old_missing = self._buffer[self._pos], self._missing[self._pos]
+            self._sums -= self._powers(old - self._shift)
+            self._raw_sq -= np.where(old_missing, 0.0, old * old)
+        self._sums += self._powers(sample - self._shift)
+        self._raw_sq += np.where(missing, 0.0, sample * sample)
+        previous = self._buffer[self._pos - 1]
+        self._run = np.where(missing, 0, np.where((self._seen > 0) & (sample == previous), self._run + 1, 1))
+        self._buffer[self._pos] = sample
+        self._missing[self._pos] = missing
+        self._pos = (self._pos + 1) % self.window
+        self._seen += 1
+        if self._seen % self.window == 0:
+            self._resync()
+
+        if self._seen < self.window:
+            return None
+
+        n = float(self.window)
+        A = self._sums[1] / n
+        B = self._sums[2] / n - A * A
+        C = self._sums[3] / n - A ** 3 - 3 * A * B
+        D = self._sums[4] / n - A ** 4 - 6 * B * A * A - 4 * C * A
+        rms = np.sqrt(np.maximum(self._raw_sq, 0.0) / n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            kurt = ((n * n - 1) * D / (B * B) - 3 * (n - 1) ** 2) / ((n - 2) * (n - 3))
+        kurt[B <= VARIANCE_EPSILON] = np.nan
+        kurt[self._run >= self.window] = -3.0
+        # Same as min_periods=WINDOW_SIZE: a gap in a channel's window gives no value for that channel
+        gap = self._missing.any(axis=0)
+        rms[gap] = np.nan
+        kurt[gap] = np.nan
+        return rms, kurt
+
+
+class StreamingScorer:
+    """Sample-by-sample RMS/kurtosis values and flags with constant memory.
+
+    ``update`` takes one (x, y, z) sample in m/s² and returns, once the window
+    is full, a dict for the sample at the centre of the window (the batch stage
+    uses a centred window, so results lag the input by WINDOW_SIZE // 2
+    samples). Thresholds follow the batch rules: RMS above mean + 2·std or
+    above the 95th percentile of the RMS values seen so far, kurtosis above
+    KURTOSIS_FIXED_THRESHOLD or above its 95th percentile.
+    """
+
+    def __init__(self, window=None, axes=None):
+        batch = batch_stage()
+        self.axes = list(axes or batch.AXES)
+        self.rms_std_multiplier = batch.RMS_STD_MULTIPLIER
+        self.kurtosis_threshold = batch.KURTOSIS_FIXED_THRESHOLD
+        self.moments = StreamingMoments(window or batch.WINDOW_SIZE, len(self.axes))
+        self.lag = (self.moments.window - 1) // 2
+        self.rms_stats = [RunningMeanStd() for _ in self.axes]
+        self.rms_quantiles = [P2Quantile(batch.PERCENTILE) for _ in self.axes]
+        self.kurt_quantiles = [P2Quantile(batch.PERCENTILE) for _ in self.axes]
+        self.latency = RunningMeanStd()
+        self.latency_p99 = P2Quantile(0.99)
+        self.latency_max = 0.0
+        self.samples = 0
+
+    def update(self, sample):
+        t0 = time.perf_counter()
+        result = self.moments.push(sample)
+        record = None
+        if result is not None:
+            record = {"sample": self.samples - self.lag}
+            rms, kurt = result
+            for i, axis in enumerate(self.axes):
+                record.update(self._flag(i, axis, rms[i], kurt[i]))
+        self.samples += 1
+
+        elapsed = time.perf_counter() - t0
+        self.latency.update(elapsed)
+        self.latency_p99.update(elapsed)
+        self.latency_max = max(self.latency_max, elapsed)
+        return record
+
+    def _flag(self, i, axis, rms, kurt):
+        # Missing values count as 0, like the fillna(0) of the batch stage
+        rms = 0.0 if math.isnan(rms) else float(rms)
+        kurt = 0.0 if math.isnan(kurt) else float(kurt)
+        stats, rms_q, kurt_q = self.rms_stats[i], self.rms_quantiles[i], self.kurt_quantiles[i]
+        stats.update(rms)
+        rms_q.update(rms)
+        kurt_q.update(kurt)
+
+        rms_fixed = stats.count > 1 and rms > stats.mean + self.rms_std_multiplier * stats.std
+        rms_percentile = rms > rms_q.value
+        kurt_fixed = kurt > self.kurtosis_threshold
+        kurt_percentile = kurt > kurt_q.value
+        return {
+            f"rolling_rms_{axis}": rms,
+            f"rolling_kurtosis_{axis}": kurt,
+            f"rms_fixed_flag_{axis}": rms_fixed,
+            f"rms_percentile_flag_{axis}": rms_percentile,
+            f"rms_combined_flag_{axis}": rms_fixed or rms_percentile,
+            f"kurt_fixed_flag_{axis}": kurt_fixed,
+            f"kurt_percentile_flag_{axis}": kurt_percentile,
+            f"kurt_combined_flag_{axis}": kurt_fixed or kurt_percentile,
+        }
+
+    def latency_summary(self):
+        """Per-sample processing time in microseconds."""
+        return {
+            "samples": self.samples,
+            "mean_us": self.latency.mean * 1e6,
+            "p99_us": self.latency_p99.value * 1e6,
+            "max_us": self.latency_max * 1e6,
+        }
+
+
+def replay(values, window=None):
+    """Feed an (n, 3) array through a StreamingScorer; returns the records and the latency summary."""
+    scorer = StreamingScorer(window)
+    records = []
+    for sample in np.asarray(values, dtype=float):
+        record = scorer.update(sample)
+        if record is not None:
+            records.append(record)
+    return records, scorer.latency_summary()
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+    import pandas as pd
+    from columnar_store import iter_inputs, load_main
+
+    # Replay stored captures as if they arrived live and compare with the batch flags
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    columns = [f"{axis}_mps2" for axis in batch_stage().AXES]
+    for path in iter_inputs(root):
+        df = load_main(path, columns=columns)
+        if not all(col in df.columns for col in columns):
+            continue
+        records, latency = replay(df[columns].to_numpy())
+        streamed = pd.DataFrame(records).set_index("sample")
+        batch = batch_stage().add_rolling_statistics(df.copy()).loc[streamed.index]
+        agreement = {flag: (streamed[flag] == batch[flag]).mean()
+                     for flag in streamed.columns if "combined_flag" in flag}
+        print(f"📡 {path}")
+        print(f"   latency: mean {latency['mean_us']:.1f} µs, p99 {latency['p99_us']:.1f} µs, max {latency['max_us']:.1f} µs")
+        print("   agreement with batch flags: " + ", ".join(f"{k} {v:.1%}" for k, v in agreement.items()))
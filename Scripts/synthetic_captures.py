@@ -0,0 +1,113 @@
+import os
+import numpy as np
+
+# === CONFIGURATION ===
+DURATION_SECONDS = 600.0    # length of one real capture
+# Sample intervals of the real sensor (ms) and how often each occurs (Data/Raw): it delivers in bursts
+INTERVALS_MS = (3, 49, 97)
+INTERVAL_WEIGHTS = (0.12, 0.76, 0.12)
+JITTER_MS = 1.0             # std of the extra timing noise on every interval
+AXIS_MEAN_G = (0.018, 0.0095, 0.951)   # gravity mostly on z
+AXIS_NOISE_G = (0.035, 0.040, 0.015)
+VIBRATION_HZ = 2.5
+VIBRATION_G = 0.01
+DROPOUT_RATE = 0.003        # fraction of samples written as 0.0 (a sensor dropout, see stage 04)
+DROPOUT_RUN = 5             # mean length of a dropout run, in samples
+SPIKE_RATE = 0.002          # fraction of samples with an isolated spike
+SPIKE_G = 0.25              # typical spike height
+FAULT_PERIOD_SECONDS = None  # e.g. 30.0: a fault burst every 30 s (what stage 13 looks for)
+FAULT_SECONDS = 1.0
+FAULT_G = 0.3
+FAULT_HZ = 7.0
+FIRST_EPOCH = 1712900000
+
+# Synthetic captures in the raw JSON layout ({"CSV": [["ts", "x", "y", "z"], ...]}
+# with ac1_<epoch>__machine-<machine>-<sensor>.json names), for benchmarks
+# at any volume. Every property that matters to a stage is a parameter:
+# length, the bursty sample clock and its jitter, dropouts, isolated spikes
+# and periodic fault bursts. The same seed always gives the same files.
+
+
+def capture_filename(epoch, machine, sensor):
+    return f"ac1_{int(epoch)}__machine-{machine}-{sensor}.json"
+
+
+def generate_capture(duration_seconds=DURATION_SECONDS, seed=0, start_ms=FIRST_EPOCH * 1000, jitter_ms=JITTER_MS,
+                     dropout_rate=DROPOUT_RATE, spike_rate=SPIKE_RATE, fault_period_seconds=FAULT_PERIOD_SECONDS):
+    """An (n, 4) array of epoch-ms timestamps and x/y/z in g."""
+    rng = np.random.default_rng(seed)
+    weights = np.asarray(INTERVAL_WEIGHTS) / np.sum(INTERVAL_WEIGHTS)
+    mean_interval = float(np.dot(INTERVALS_MS, weights))
+    n = int(duration_seconds * 1000 / mean_interval)
+    intervals = rng.choice(INTERVALS_MS, size=n, p=weights) + rng.normal(0, jitter_ms, n)
+    timestamps = start_ms + np.cumsum(np.maximum(np.round(intervals), 1))
+    seconds = (timestamps - timestamps[0]) / 1000.0
+
+    values = np.empty((n, 3))
+    for i in range(3):
+        phase = rng.uniform(0, 2 * np.pi)
+        values[:, i] = (AXIS_MEAN_G[i] + rng.normal(0, AXIS_NOISE_G[i], n)
+                        + VIBRATION_G * np.sin(2 * np.pi * VIBRATION_HZ * seconds + phase))
+
+    # Isolated spikes on one axis at a time
+    spikes = np.flatnonzero(rng.random(n) < spike_rate)
+    values[spikes, rng.integers(0, 3, len(spikes))] += rng.choice([-1, 1], len(spikes)) * rng.exponential(SPIKE_G, len(spikes))
+
+    # Periodic fault bursts on all axes
+    if fault_period_seconds:
+        in_fault = (seconds % fault_period_seconds) < FAULT_SECONDS
+        values[in_fault] += FAULT_G * np.sin(2 * np.pi * FAULT_HZ * seconds[in_fault])[:, None]
+
+    # Dropout runs: every axis reads exactly 0.0
+    starts = np.flatnonzero(rng.random(n) < dropout_rate / DROPOUT_RUN)
+    lengths = rng.geometric(1 / DROPOUT_RUN, len(starts))
+    for start, length in zip(starts, lengths):
+        values[start:start + length] = 0.0
+
+    return np.column_stack([timestamps, np.round(values, 6)])
+
+
+_ROW = '        [\n            "%d",\n            "%.6f",\n            "%.6f",\n            "%.6f"\n        ]'
+
+
+def write_capture_json(path, table, chunk_rows=100_000):
+    """Write a capture in the layout of the real files (json.dump with indent=4, values as strings)."""
+    with open(path, "w") as f:
+        f.write('{\n    "CSV": [\n')
+        for first in range(0, len(table), chunk_rows):
+            chunk = table[first:first + chunk_rows]
+            if first:
+                f.write(",\n")
+            f.write(",\n".join([_ROW] * len(chunk)) % tuple(chunk.ravel()))
+        f.write('\n    ]\n}')
+    return path
+
+
+def generate_dataset(folder, n_captures, duration_seconds=DURATION_SECONDS, seed=0, machines=1, **params):
+    """Write ``n_captures`` synthetic captures into ``folder``; returns their paths.
+
+    Captures are spread over ``machines`` machine ids (one sensor each) and
+    follow each other in time. ``params`` are passed to generate_capture().
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    sensors = [(rng.bytes(6).hex(), rng.bytes(6).hex()[:11]) for _ in range(machines)]
+    paths = []
+    for i in range(n_captures):
+        machine, sensor = sensors[i % machines]
+        epoch = FIRST_EPOCH + int(i * duration_seconds)
+        table = generate_capture(duration_seconds, seed=seed * 100_003 + i, start_ms=epoch * 1000, **params)
+        paths.append(write_capture_json(os.path.join(folder, capture_filename(epoch, machine, sensor)), table))
+    return paths
+
+
+# === USAGE ===
+if __name__ == "__main__":
+    import sys
+
+    # python synthetic_captures.py <folder> [captures] [duration seconds]
+    folder = sys.argv[1] if len(sys.argv) > 1 else "synthetic_captures"
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else DURATION_SECONDS
+    paths = generate_dataset(folder, n, duration, fault_period_seconds=FAULT_PERIOD_SECONDS or 30.0)
+    print(f"🧪 Wrote {len(paths)} synthetic capture(s) of {duration:.0f} s to {folder}")
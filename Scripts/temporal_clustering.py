@@ -0,0 +1,123 @@
+import numpy as np
+from instrumentation import timed
+
+# === CONFIGURATION ===
+# Relative slack when locating the ±eps window with a binary search; points
+# inside the slack are checked with the exact distance
+BOUNDARY_TOLERANCE = 1e-9
+
+# DBSCAN on a single time axis without a neighbour search. With the times
+# sorted, the eps-neighbourhood of every point is a contiguous range found by
+# binary search, core points are those whose range holds MIN_SAMPLES points,
+# and two core points belong to the same cluster exactly when no gap between
+# consecutive core points exceeds eps. A border point joins the cluster of the
+# nearest core point on either side (the lower cluster id when both are within
+# eps, which is the one DBSCAN expands first). Cluster ids follow the first
+# core point of each cluster in input order, like sklearn.cluster.DBSCAN.
+
+
+def _window_start(t, eps):
+    """For sorted ``t``: index of the first j with t[i] - t[j] <= eps, for every i."""
+    slack = BOUNDARY_TOLERANCE * max(eps, 1.0)
+    start = np.searchsorted(t, t - eps - slack, side="left")
+    stop = np.searchsorted(t, t - eps + slack, side="left")
+    # Only the few points within the slack need the exact test
+    undecided = np.flatnonzero(start < stop)
+    while len(undecided):
+        outside = t[undecided] - t[start[undecided]] > eps
+        start[undecided[outside]] += 1
+        undecided = undecided[outside & (start[undecided] < stop[undecided])]
+    return start
+
+
+def _window_stop(t, eps):
+    """For sorted ``t``: one past the last j with t[j] - t[i] <= eps, for every i."""
+    return len(t) - _window_start(-t[::-1], eps)[::-1]
+
+
+@timed("dbscan")
+def cluster_1d(times, eps, min_samples):
+    """DBSCAN labels (-1 = noise) for 1-D ``times``, in the order given."""
+    times = np.asarray(times, dtype=float).ravel()
+    n = len(times)
+    labels = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return labels
+
+    order = np.argsort(times, kind="stable")
+    t = times[order]
+    core = (_window_stop(t, eps) - _window_start(t, eps)) >= min_samples
+    core_pos = np.flatnonzero(core)
+    if not len(core_pos):
+        return labels
+
+    # Core points split into clusters wherever the gap between them exceeds eps
+    core_t = t[core_pos]
+    new_cluster = np.concatenate([[True], np.diff(core_t) > eps])
+    starts = np.flatnonzero(new_cluster)
+    cluster = np.cumsum(new_cluster) - 1
+    # Number the clusters by their first core point in input order
+    first_index = np.minimum.reduceat(order[core_pos], starts)
+    rank = np.empty(len(starts), dtype=np.int64)
+    rank[np.argsort(first_index, kind="stable")] = np.arange(len(starts))
+    sorted_labels = np.full(n, -1, dtype=np.int64)
+    sorted_labels[core_pos] = rank[cluster]
+
+    # Border points: nearest core point on the left and on the right
+    border = np.flatnonzero(~core)
+    left = np.searchsorted(core_t, t[border], side="right") - 1
+    right = left + 1
+    has_left = left >= 0
+    has_left[has_left] = t[border[has_left]] - core_t[left[has_left]] <= eps
+    has_right = right < len(core_t)
+    has_right[has_right] = core_t[right[has_right]] - t[border[has_right]] <= eps
+
+    big = np.iinfo(np.int64).max
+    left_label = np.where(has_left, sorted_labels[core_pos[np.clip(left, 0, None)]], big)
+    right_label = np.where(has_right, sorted_labels[core_pos[np.clip(right, None, len(core_pos) - 1)]], big)
+    border_label = np.minimum(left_label, right_label)
+    sorted_labels[border] = np.where(border_label == big, -1, border_label)
+
+    labels[order] = sorted_labels
+    return labels
+
+
+class TemporalClusterStream:
+    """DBSCAN labels for outlier times that arrive in time order.
+
+    A gap of more than eps between consecutive times separates everything
+    before it from everything after it (no neighbourhood reaches across), so
+    only the segment after the last such gap can still change. ``extend``
+    re-labels just that open segment; labels before it are final.
+    """
+
+    def __init__(self, eps, min_samples):
+        self.eps = eps
+        self.min_samples = min_samples
+        self.times = np.empty(0)
+        self.labels = np.empty(0, dtype=np.int64)
+        self._open_start = 0       # first index of the open segment
+        self._closed_clusters = 0  # clusters that ended before it
+
+    def extend(self, new_times):
+        """Append times (not earlier than the last one) and return the labels of all points."""
+        new_times = np.sort(np.asarray(new_times, dtype=float).ravel())
+        if not len(new_times):
+            return self.labels
+        if len(self.times) and new_times[0] < self.times[-1]:
+            raise ValueError("TemporalClusterStream.extend() needs times that are not earlier than the last one")
+        self.times = np.concatenate([self.times, new_times])
+        self.labels = np.concatenate([self.labels, np.full(len(new_times), -1, dtype=np.int64)])
+
+        segment = cluster_1d(self.times[self._open_start:], self.eps, self.min_samples)
+        segment[segment >= 0] += self._closed_clusters
+        self.labels[self._open_start:] = segment
+
+        gaps = np.flatnonzero(np.diff(self.times[self._open_start:]) > self.eps)
+        if len(gaps):
+            new_start = self._open_start + gaps[-1] + 1
+            closed = self.labels[self._open_start:new_start]
+            if (closed >= 0).any():
+                self._closed_clusters = int(closed.max()) + 1
+            self._open_start = new_start
+        return self.labels